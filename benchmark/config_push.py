@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+""" Benchmark pushing configuration over the serial console
+
+    Compares typing a block of configuration lines one at a time, waiting for
+    the prompt after every line (wait_write()), with streaming the block with
+    VM.send_config(). The router is simulated by a local telnet server which
+    takes --latency to pass input to the CLI, like a qemu serial console, and
+    --line-delay for the CLI to process every line before printing the next
+    prompt.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import vrnetlab
+
+logging.Logger.trace = lambda self, message, *args, **kws: None
+
+
+def router(latency, line_delay, error=None):
+    """ Start a simulated router CLI, returns the port it listens on
+    """
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+
+    def cli():
+        conn, _ = srv.accept()
+        srv.close()
+        conn.sendall(b"router(config)#")
+        buf = b""
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            time.sleep(latency)
+            buf += data
+            while b"\r" in buf:
+                line, buf = buf.split(b"\r", 1)
+                conn.sendall(line + b"\r\n")
+                time.sleep(line_delay)
+                if error and error.encode() in line:
+                    conn.sendall(b"% Invalid input detected at '^' marker.\r\n")
+                conn.sendall(b"router(config)#")
+        conn.close()
+
+    threading.Thread(target=cli, daemon=True).start()
+    return srv.getsockname()[1]
+
+
+class ConsoleVM(vrnetlab.VM):
+    """ Just enough of a VM to talk to the simulated router
+    """
+    def __init__(self, port, engine):
+        self.logger = logging.getLogger()
+        self.console_engine = engine
+        self.config_line_mode = False
+        self.config_timing = []
+        self.tn = self.open_console(port)
+
+
+def config(lines):
+    block = []
+    for i in range(lines):
+        block.append(["interface GigabitEthernet0/0/%d" % i, "description link %d" % i,
+                      "no shutdown", "exit"][i % 4])
+    return block
+
+
+def line_mode(vm, block):
+    for line in block:
+        vm.wait_write(line)
+
+
+def bulk_mode(vm, block):
+    vm.send_config(block)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark configuration push over the serial console')
+    parser.add_argument('--lines', type=int, default=40, help='configuration lines per block')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds for input to reach the CLI')
+    parser.add_argument('--line-delay', type=float, default=0.005, help='seconds to process a line')
+    parser.add_argument('--engine', choices=['asyncio', 'telnetlib'], default='asyncio')
+    parser.add_argument('--error', help='lines containing this are rejected by the router')
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+
+    block = config(args.lines)
+    print("%-6s %8s %10s %10s" % ("mode", "lines", "seconds", "lines/s"))
+    for name, func in (("line", line_mode), ("bulk", bulk_mode)):
+        vm = ConsoleVM(router(args.latency, args.line_delay, args.error), args.engine)
+        start = time.perf_counter()
+        func(vm, block)
+        # wait for the prompt after the last line
+        vm.tn.read_until(b"#")
+        duration = time.perf_counter() - start
+        vm.tn.close()
+        print("%-6s %8d %10.3f %10.1f" % (name, len(block), duration, len(block) / duration))
+        if vm.config_timing:
+            print("       %s" % vm.config_timing)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+""" Micro-benchmark of console pattern matching
+
+    Replays the boot transcripts in transcripts/ in small chunks, like they
+    arrive from a qemu serial console, and waits for the patterns the
+    platform's bootstrap_spin() waits for. Every match consumes the data up
+    to the match and matching continues with the rest of the transcript.
+
+    The bootstrap scenario waits for all of the patterns, which match often.
+    The wait scenario waits for the last line of the transcript, which is
+    only printed at the end of the last repetition, so all of the data piles
+    up like it does while waiting for the first prompt of a long boot.
+
+    Two modes:
+
+      match  - in-process, compares the telnetlib expect() algorithm (every
+               pattern compiled and searched over the whole buffer for
+               every chunk received) with console.Console
+      socket - end to end over a local telnet server, compares
+               telnetlib.Telnet with console.Console
+"""
+
+import argparse
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import console
+import vrnetlab
+
+try:
+    import telnetlib
+except ImportError:
+    telnetlib = None
+
+TRANSCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcripts")
+
+# what bootstrap_spin() of each platform waits for
+PATTERNS = {
+    'xrv': [b"Press RETURN to get started", b"SYSTEM CONFIGURATION COMPLETE",
+            b"Enter root-system username", b"Username:", b"^[^ ]+#"],
+    'sros': [b"Login:", b"^[^ ]+#"],
+    'veos': [b"login:", b"^[^ ]+#"],
+}
+
+# the last thing printed in each transcript, waiting for it means data piles
+# up like it does in wait_write() / read_until() during a long boot
+LAST = {
+    'xrv': [b"SYSTEM CONFIGURATION COMPLETE"],
+    'sros': [b"A:vSIM# logout"],
+    'veos': [b"Copy completed successfully"],
+}
+
+
+def load_transcript(platform, repeat, scenario='bootstrap'):
+    with open(os.path.join(TRANSCRIPT_DIR, platform + ".log"), "rb") as f:
+        data = f.read().replace(b"\n", b"\r\n")
+    if scenario == 'wait':
+        # only the last repetition ends with what we are waiting for
+        head = data[:data.rindex(LAST[platform][0])]
+        return head * (repeat - 1) + data
+    return data * repeat
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def match_telnetlib(chunks, patterns):
+    """ What telnetlib.Telnet.expect() does with the data, minus the socket
+    """
+    matches = 0
+    buf = b""
+    compiled = [re.compile(p) for p in patterns]
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            for r in compiled:
+                m = r.search(buf)
+                if m:
+                    break
+            else:
+                break
+            matches += 1
+            buf = buf[m.end():]
+            # a new call to expect()
+            compiled = [re.compile(p) for p in patterns]
+    return matches
+
+
+def match_console(chunks, patterns):
+    matches = 0
+    con = console.Console(window=len(b"".join(chunks)) + 1)
+    for chunk in chunks:
+        con.feed(chunk)
+        while con.match(patterns) is not None:
+            matches += 1
+    return matches
+
+
+def serve(data, chunk_size):
+    """ Start a telnet server replaying data to a single client, returns the
+        port it listens on
+    """
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+
+    def replay():
+        conn, _ = srv.accept()
+        srv.close()
+        # what qemu says when a client connects to a telnet chardev
+        conn.sendall(bytes([console.IAC, console.WILL, 1, console.IAC, console.WILL, 3]))
+        for chunk in chunked(data, chunk_size):
+            conn.sendall(chunk)
+        # let the client read everything and answer the negotiation
+        conn.shutdown(socket.SHUT_WR)
+        while conn.recv(4096):
+            pass
+        conn.close()
+
+    threading.Thread(target=replay, daemon=True).start()
+    return srv.getsockname()[1]
+
+
+def expect_all(con, patterns):
+    matches = 0
+    while True:
+        try:
+            idx, m, res = con.expect(patterns, 10)
+        except EOFError:
+            return matches
+        if m is not None:
+            matches += 1
+
+
+def socket_telnetlib(data, chunk_size, patterns):
+    con = telnetlib.Telnet("127.0.0.1", serve(data, chunk_size))
+    try:
+        return expect_all(con, patterns)
+    finally:
+        con.close()
+
+
+def socket_console(data, chunk_size, patterns):
+    con = console.Console("127.0.0.1", serve(data, chunk_size), loop=vrnetlab.event_loop())
+    try:
+        return expect_all(con, patterns)
+    finally:
+        con.close()
+
+
+def bench(func, *args, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        matches = func(*args)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, matches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark console pattern matching')
+    parser.add_argument('--mode', choices=['match', 'socket'], default='match')
+    parser.add_argument('--scenario', choices=['bootstrap', 'wait'], default='bootstrap')
+    parser.add_argument('--platform', action='append', choices=sorted(PATTERNS),
+                        help='platform transcript to replay, default all')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='replay the transcript this many times in a row')
+    parser.add_argument('--chunk', type=int, default=64,
+                        help='bytes per read from the console')
+    parser.add_argument('--runs', type=int, default=5, help='best of this many runs')
+    args = parser.parse_args()
+
+    if args.mode == 'match':
+        engines = [('telnetlib', match_telnetlib), ('console', match_console)]
+    else:
+        engines = [('console', socket_console)]
+        if telnetlib is not None:
+            engines.insert(0, ('telnetlib', socket_telnetlib))
+        else:
+            print("telnetlib is not available, only benchmarking console")
+
+    patterns = PATTERNS if args.scenario == 'bootstrap' else LAST
+    print("%-6s %-10s %10s %8s %10s %10s" % ("", "engine", "bytes", "matches", "seconds", "MB/s"))
+    for platform in args.platform or sorted(PATTERNS):
+        data = load_transcript(platform, args.repeat, args.scenario)
+        for name, func in engines:
+            if args.mode == 'match':
+                duration, matches = bench(func, chunked(data, args.chunk), patterns[platform], runs=args.runs)
+            else:
+                duration, matches = bench(func, data, args.chunk, patterns[platform], runs=args.runs)
+            print("%-6s %-10s %10d %8d %10.4f %10.2f" % (platform, name, len(data), matches,
+                                                      duration, len(data) / duration / 1e6))
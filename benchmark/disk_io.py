@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+""" Benchmark the disk I/O profiles of the overlay disk image
+
+    Puts a qcow2 overlay on top of a base image, like the launch scripts do,
+    and runs the I/O pattern of a booting NOS against it with qemu-img bench
+    for every profile in diskio.PROFILES and every overlay directory given:
+
+      read  - large reads spread over the base image, loading the software
+      write - small writes with a flush every few writes, logs and config
+              being written by a journaling file system
+      reread - the read pass again, now partly served by the overlay
+
+    The cache mode, AIO backend and qcow2 cache sizes of the profile are
+    used; the disk interface (IDE, virtio) is a guest side thing and is not
+    covered. Pass a real router image with --image, otherwise a base image
+    is created and filled with data first.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import diskio
+
+
+def qemu_img(*args):
+    return subprocess.run(["qemu-img"] + list(args), check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+
+def image_size(path):
+    info = qemu_img("info", "--output", "json", path)
+    return int(re.search(r'"virtual-size":\s*(\d+)', info).group(1))
+
+
+def image_format(path):
+    info = qemu_img("info", "--output", "json", path)
+    return re.search(r'"format":\s*"([^"]+)"', info).group(1)
+
+
+def create_base(path, size_mb):
+    qemu_img("create", "-q", "-f", "qcow2", path, "%dM" % size_mb)
+    # fill it, so reads through the overlay hit allocated clusters
+    qemu_img("bench", "-q", "-w", "-c", str(size_mb * 16), "-s", "64k", "--pattern=165", path)
+
+
+def drop_caches():
+    subprocess.run(["sync"])
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3")
+    except OSError:
+        return False
+    return True
+
+
+def bench(overlay, profile, size, count, depth, write=False):
+    """ Run qemu-img bench with the settings of profile, returns seconds
+    """
+    opts = ["driver=qcow2", "file.filename=%s" % overlay]
+    if profile.l2_cache_size:
+        opts.append("l2-cache-size=%s" % profile.l2_cache_size)
+    if profile.refcount_cache_size:
+        opts.append("refcount-cache-size=%s" % profile.refcount_cache_size)
+    cmd = ["bench", "--image-opts", "-c", str(count), "-d", str(depth), "-t", profile.cache or "writeback",
+           "-i", profile.aio or "threads"]
+    if write:
+        # 4k writes all over the disk with a flush every 16 of them
+        step = max(4096, size // count // 4096 * 4096)
+        cmd += ["-w", "-s", "4k", "-S", str(step), "--flush-interval=16", "--pattern=90"]
+    else:
+        step = max(65536, size // count // 65536 * 65536)
+        cmd += ["-s", "64k", "-S", str(step)]
+    start = time.perf_counter()
+    out = qemu_img(*(cmd + [",".join(opts)]))
+    m = re.search(r"Run completed in ([0-9.]+) seconds", out)
+    return float(m.group(1)) if m else time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark overlay disk I/O profiles')
+    parser.add_argument('--image', help='base image, default a generated one')
+    parser.add_argument('--size', type=int, default=1024, help='size of the generated base image in MB')
+    parser.add_argument('--dir', action='append',
+                        help='directory to put the overlay in, like a tmpfs or a volume, default a temp dir')
+    parser.add_argument('--profile', action='append', choices=sorted(diskio.PROFILES),
+                        help='profile to benchmark, default all')
+    parser.add_argument('--count', type=int, default=4096, help='requests per pass')
+    parser.add_argument('--depth', type=int, default=8, help='requests in flight')
+    parser.add_argument('--drop-caches', action='store_true',
+                        help='drop the host page cache before every read pass (needs root)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="disk_io.")
+    base = args.image
+    if base is None:
+        base = os.path.join(work_dir, "base.qcow2")
+        print("creating %d MB base image %s" % (args.size, base))
+        create_base(base, args.size)
+    size = image_size(base)
+    base_format = image_format(base)
+
+    print("%-24s %-8s %10s %10s %10s" % ("directory", "profile", "read s", "write s", "reread s"))
+    for directory in args.dir or [work_dir]:
+        fs_type = diskio.filesystem_type(directory)
+        for name in args.profile or sorted(diskio.PROFILES):
+            overlay = os.path.join(directory, "bench-overlay.qcow2")
+            if os.path.exists(overlay):
+                os.remove(overlay)
+            qemu_img("create", "-q", "-f", "qcow2", "-F", base_format, "-b", os.path.abspath(base), overlay)
+            profile = diskio.DiskProfile(**diskio.PROFILES[name])
+            profile.check(overlay)
+            try:
+                results = []
+                for write in (False, True, False):
+                    if not write and args.drop_caches:
+                        drop_caches()
+                    results.append(bench(overlay, profile, size, args.count, args.depth, write))
+            finally:
+                os.remove(overlay)
+            print("%-24s %-8s %10.3f %10.3f %10.3f" % ("%s (%s)" % (directory, fs_type), name, *results))
+
+    if args.image is None:
+        os.remove(base)
+    os.rmdir(work_dir)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+""" Benchmark forwarding throughput of a running virtual router
+
+    Connects to two data NICs of a router like vr-xcon does (qemu listens on
+    port 10000 + NIC number, every packet is sent with its length in front),
+    sends UDP packets into one and counts those coming out of the other. The
+    router has to forward between the two, bridged or routed, so the frames
+    have to be addressed to suit: --dst-mac is the MAC of the ingress
+    interface when routing, the addresses have to be routed to the egress
+    interface.
+
+    Run it against the same router started with and without HUGEPAGES to
+    compare guest RAM on hugepages with normal memory. The NICs must not be
+    connected by vr-xcon, qemu accepts a single connection per NIC.
+"""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b"vrnetlab-fwd"
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    s = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
+
+
+def mac(addr):
+    return bytes(int(b, 16) for b in addr.split(":"))
+
+
+def frame(args, seq):
+    """ An Ethernet frame with a UDP packet of args.size bytes in total
+    """
+    payload = MAGIC + struct.pack("!Q", seq)
+    payload += b"\0" * max(0, args.size - 14 - 20 - 8 - len(payload))
+    udp = struct.pack("!HHHH", 5000, 5001, 8 + len(payload), 0) + payload
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), seq & 0xffff, 0, 64, socket.IPPROTO_UDP, 0,
+                     socket.inet_aton(args.src_ip), socket.inet_aton(args.dst_ip))
+    ip = ip[:10] + struct.pack("!H", checksum(ip)) + ip[12:]
+    return mac(args.dst_mac) + mac(args.src_mac) + b"\x08\x00" + ip + udp
+
+
+def connect(host, nic):
+    sock = socket.create_connection((host, 10000 + nic))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def receiver(sock, stats, stop):
+    buf = b""
+    sock.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            data = sock.recv(262144)
+        except socket.timeout:
+            continue
+        if not data:
+            break
+        buf += data
+        while len(buf) >= 4:
+            length = struct.unpack("!I", buf[:4])[0]
+            if len(buf) < 4 + length:
+                break
+            packet, buf = buf[4:4 + length], buf[4 + length:]
+            if MAGIC in packet:
+                stats['packets'] += 1
+                stats['bytes'] += length
+
+
+def run(args):
+    tx = connect(args.host, args.tx_nic)
+    rx = connect(args.host, args.rx_nic)
+    stats = {'packets': 0, 'bytes': 0}
+    stop = threading.Event()
+    t = threading.Thread(target=receiver, args=(rx, stats, stop), daemon=True)
+    t.start()
+
+    # the first packets wake up ARP and forwarding caches, not counted
+    for seq in range(args.warmup):
+        f = frame(args, seq)
+        tx.sendall(struct.pack("!I", len(f)) + f)
+    time.sleep(1)
+    stats['packets'] = stats['bytes'] = 0
+
+    batch = 64
+    frames = [frame(args, seq) for seq in range(batch)]
+    data = b"".join(struct.pack("!I", len(f)) + f for f in frames)
+    interval = batch / args.rate if args.rate else 0
+    sent = 0
+    start = time.monotonic()
+    next_send = start
+    while time.monotonic() - start < args.duration:
+        tx.sendall(data)
+        sent += batch
+        if interval:
+            next_send += interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.monotonic() - start
+    # let what is queued in the router drain
+    time.sleep(1)
+    stop.set()
+    t.join()
+    tx.close()
+    rx.close()
+    return sent, stats, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", required=True, help="address of the router container")
+    parser.add_argument("--tx-nic", type=int, default=1, help="NIC to send into")
+    parser.add_argument("--rx-nic", type=int, default=2, help="NIC to receive from")
+    parser.add_argument("--src-mac", default="02:00:00:00:00:01")
+    parser.add_argument("--dst-mac", default="ff:ff:ff:ff:ff:ff")
+    parser.add_argument("--src-ip", default="192.0.2.1")
+    parser.add_argument("--dst-ip", default="198.51.100.1")
+    parser.add_argument("--size", type=int, default=512, help="frame size in bytes")
+    parser.add_argument("--rate", type=int, default=0, help="packets per second to offer, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--label", default="", help="name of the run in the output, like hugepages")
+    args = parser.parse_args()
+
+    sent, stats, elapsed = run(args)
+    print("%-12s %12s %12s %10s %10s" % ("run", "offered pps", "fwd pps", "fwd Mb/s", "loss %"))
+    print("%-12s %12.0f %12.0f %10.1f %10.2f" % (
+        args.label or "-", sent / elapsed, stats['packets'] / elapsed,
+        stats['bytes'] * 8 / elapsed / 1e6, 100.0 * (sent - stats['packets']) / sent if sent else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+""" Benchmark the docker health check
+
+    Compares the cost of a single health check, as docker runs it every
+    interval in every container:
+
+      python - the old /healthcheck.py, a Python interpreter reading /health
+      shell  - the shell one-liner of the Dockerfiles reading /health
+      http   - asking the status server over its unix socket, for clients
+               wanting the details
+
+    CPU time is that of the child processes for python and shell, and of the
+    whole benchmark process (client and server) for http.
+"""
+
+import argparse
+import http.client
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import status
+import vrnetlab
+
+OLD_CHECK = """
+import sys
+
+try:
+    health_file = open(%r, "r")
+    # the first line is the status, the rest details for humans
+    health = health_file.readline()
+    health_file.close()
+except FileNotFoundError:
+    print("health status file not found")
+    sys.exit(2)
+
+exit_status, message = health.strip().split(" ", 1)
+
+if message != '':
+    print(message)
+
+sys.exit(int(exit_status))
+"""
+
+SHELL_CHECK = 'read s m < %s || exit 1; echo "$m"; exit $s'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def self_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_checks(cmd, count):
+    cpu = children_cpu()
+    start = time.perf_counter()
+    for _ in range(count):
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start, children_cpu() - cpu
+
+
+def run_http(path, count):
+    cpu = self_cpu()
+    start = time.perf_counter()
+    for _ in range(count):
+        conn = UnixHTTPConnection(path)
+        conn.request("GET", "/health")
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        if resp.status != 200:
+            raise RuntimeError("status server returned %d" % resp.status)
+    return time.perf_counter() - start, self_cpu() - cpu
+
+
+def health():
+    return {
+        'status': 0, 'message': "running", 'uptime': 3600.0,
+        'vms': {'VM[0]': {'running': True, 'status': "running", 'phase': "running", 'restarts': 0,
+                          'uptime': 3300.0, 'boot_duration': 300.0}},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the docker health check')
+    parser.add_argument('--count', type=int, default=200, help='health checks per method')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        health_file = os.path.join(tmp, "health")
+        with open(health_file, "w") as f:
+            f.write("0 running\n")
+        sock = os.path.join(tmp, "status.sock")
+        server = status.StatusServer(vrnetlab.event_loop(), None, health, lambda: [], sock)
+        server.start()
+
+        print("%-8s %8s %12s %12s" % ("check", "count", "ms/check", "cpu ms/check"))
+        for name, func in (("python", lambda: run_checks([sys.executable, "-c", OLD_CHECK % health_file], args.count)),
+                           ("shell", lambda: run_checks(["/bin/sh", "-c", SHELL_CHECK % health_file], args.count)),
+                           ("http", lambda: run_http(sock, args.count))):
+            duration, cpu = func()
+            print("%-8s %8d %12.2f %12.2f" % (name, args.count, duration * 1000 / args.count,
+                                               cpu * 1000 / args.count))
+        server.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+""" Benchmark management port forwarding, in-process forwarder vs socat
+
+    Starts an echo server (TCP and UDP), puts the forwarder under test in
+    front of it and measures:
+
+      tcp - connection rate and latency of short connections (connect, send
+            a request, wait for the echo, close) like NETCONF / gNMI polling
+      udp - latency of single datagrams from many peers like SNMP polling
+
+    The forwarder and the echo server run in their own processes, the CPU
+    time used by the forwarder (including forked children) is reported.
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+COMMON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+
+ECHO_PORT = 17000
+LISTEN_PORT = 18000
+
+
+def echo_server(port):
+    import asyncio
+
+    class EchoUDP(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, addr):
+            self.transport.sendto(data, addr)
+
+    async def echo_tcp(reader, writer):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        await asyncio.start_server(echo_tcp, "127.0.0.1", port)
+        await loop.create_datagram_endpoint(EchoUDP, local_addr=("127.0.0.1", port))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def builtin_forwarder(listen_port, dst_port):
+    sys.path.insert(0, COMMON)
+    import vrnetlab
+    import portfwd
+
+    forwarder = portfwd.PortForwarder(vrnetlab.event_loop())
+    for proto in ("tcp", "udp"):
+        forwarder.add(proto, listen_port, "127.0.0.1", dst_port)
+    while True:
+        time.sleep(3600)
+
+
+def start_forwarder(name, listen_port, dst_port):
+    if name == "direct":
+        return []
+    if name == "builtin":
+        return [subprocess.Popen([sys.executable, __file__, "--run-forwarder", str(listen_port), str(dst_port)])]
+    # the same as VR.start_socat()
+    return [subprocess.Popen(["socat", "%s6-LISTEN:%d,fork" % (proto, listen_port),
+                              "%s:127.0.0.1:%d" % (proto, dst_port)])
+            for proto in ("TCP", "UDP")]
+
+
+def cpu_seconds(procs):
+    """ User and system time of the processes and their reaped children
+    """
+    total = 0
+    for p in procs:
+        with open("/proc/%d/stat" % p.pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, cutime, cstime
+        total += sum(int(v) for v in fields[11:15])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_tcp(port, count, payload):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(payload)
+            received = 0
+            while received < len(payload):
+                received += len(s.recv(65536))
+        latencies.append(time.perf_counter() - t)
+    return count / (time.perf_counter() - start), latencies
+
+
+def bench_udp(port, count, payload):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        # a new socket means a new peer, like many SNMP pollers
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(5)
+            s.sendto(payload, ("127.0.0.1", port))
+            s.recvfrom(65536)
+        latencies.append(time.perf_counter() - t)
+    return count / (time.perf_counter() - start), latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark management port forwarding')
+    parser.add_argument('--forwarder', action='append', choices=['direct', 'builtin', 'socat'],
+                        help='forwarder to benchmark, default all (socat if installed); '
+                             'direct talks to the echo server without forwarder as baseline')
+    parser.add_argument('--count', type=int, default=2000, help='connections / datagrams per test')
+    parser.add_argument('--size', type=int, default=512, help='request size in bytes')
+    parser.add_argument('--echo', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--run-forwarder', type=int, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.echo:
+        echo_server(args.echo)
+        sys.exit(0)
+    if args.run_forwarder:
+        builtin_forwarder(*args.run_forwarder)
+        sys.exit(0)
+
+    forwarders = args.forwarder or ['direct', 'builtin', 'socat']
+    if 'socat' in forwarders and shutil.which("socat") is None:
+        print("socat is not installed, skipping it")
+        forwarders.remove('socat')
+
+    echo = subprocess.Popen([sys.executable, __file__, "--echo", str(ECHO_PORT)])
+    payload = b"x" * args.size
+    print("%-8s %-4s %10s %10s %10s %10s" % ("", "", "per sec", "p50 ms", "p99 ms", "cpu s"))
+    try:
+        wait_for_port(ECHO_PORT)
+        for i, name in enumerate(forwarders):
+            port = ECHO_PORT if name == "direct" else LISTEN_PORT + i
+            procs = start_forwarder(name, port, ECHO_PORT)
+            try:
+                wait_for_port(port)
+                for proto, func in (("tcp", bench_tcp), ("udp", bench_udp)):
+                    cpu = cpu_seconds(procs)
+                    rate, latencies = func(port, args.count, payload)
+                    # let socat reap its children so their CPU time is counted
+                    time.sleep(0.5)
+                    print("%-8s %-4s %10.0f %10.3f %10.3f %10.2f" % (
+                        name, proto, rate, percentile(latencies, 50) * 1000,
+                        percentile(latencies, 99) * 1000, cpu_seconds(procs) - cpu))
+            finally:
+                for p in procs:
+                    p.terminate()
+                    p.wait()
+    finally:
+        echo.terminate()
+        echo.wait()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+""" Benchmark base image prewarming on a cold page cache
+
+    Replays the reads of a boot, the extents of an access profile (see
+    common/prewarm.py) read in 64 kB pieces in random order like a guest
+    faulting in its disk, with the image evicted from the page cache:
+
+      cold     - without prewarming
+      prewarm  - with prewarm.read_extents() running concurrently, as it
+                 does while qemu starts
+
+    Without --profile a profile is made up, random extents covering
+    --fraction of the image. Eviction is done with posix_fadvise(DONTNEED),
+    which needs no privileges but only works on file systems passing it on
+    to the page cache (not on tmpfs, where the benchmark makes no sense).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import prewarm
+
+BLOCK = 64 * 1024
+
+
+def evict(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def make_image(path, size_mb):
+    chunk = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(chunk)
+
+
+def make_profile(size, fraction, extent_mb=4):
+    """ Random extents of up to extent_mb MB covering fraction of size
+    """
+    extents = []
+    covered = 0
+    while covered < size * fraction:
+        length = random.randint(1, extent_mb * 1024 * 1024 // BLOCK) * BLOCK
+        offset = random.randrange(0, max(1, size - length)) // BLOCK * BLOCK
+        extents.append((offset, length))
+        covered += length
+    return sorted(extents)
+
+
+def replay(path, extents, seed=0):
+    """ Read the extents in BLOCK sized pieces in random order
+    """
+    blocks = [off for offset, length in extents for off in range(offset, offset + length, BLOCK)]
+    random.Random(seed).shuffle(blocks)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for offset in blocks:
+            os.pread(fd, BLOCK, offset)
+    finally:
+        os.close(fd)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark page cache prewarming')
+    parser.add_argument('--image', help='image to use, default a generated one')
+    parser.add_argument('--size', type=int, default=1024, help='size of the generated image in MB')
+    parser.add_argument('--profile', help='access profile recorded by a boot (PREWARM_DIR)')
+    parser.add_argument('--fraction', type=float, default=0.2,
+                        help='part of the image the made up profile covers')
+    parser.add_argument('--runs', type=int, default=3, help='best of this many runs')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="prewarm.", dir=os.getcwd())
+    image = args.image
+    if image is None:
+        image = os.path.join(work_dir, "image.bin")
+        print("creating %d MB image %s" % (args.size, image))
+        make_image(image, args.size)
+    size = os.path.getsize(image)
+    if args.profile:
+        with open(args.profile) as f:
+            extents = [tuple(e) for e in json.load(f)['extents']]
+    else:
+        extents = make_profile(size, args.fraction)
+    total = sum(length for _, length in extents)
+    print("image %d MB, profile %d MB in %d extents" % (size // 2**20, total // 2**20, len(extents)))
+
+    evict(image)
+    cached = prewarm.cached_fraction(prewarm.residency(image))
+    if cached > 0.01:
+        print("unable to evict the image from the page cache (%.0f%% cached), results are meaningless" % (cached * 100))
+
+    cold, warm, prewarm_only = [], [], []
+    for _ in range(args.runs):
+        evict(image)
+        cold.append(timed(replay, image, extents))
+
+        evict(image)
+        prewarm_only.append(timed(prewarm.read_extents, image, extents))
+
+        evict(image)
+        start = time.perf_counter()
+        t = threading.Thread(target=prewarm.read_extents, args=(image, extents))
+        t.start()
+        replay(image, extents)
+        warm.append(time.perf_counter() - start)
+        t.join()
+
+    print("%-28s %8.2fs" % ("boot reads, cold", min(cold)))
+    print("%-28s %8.2fs" % ("prewarm alone", min(prewarm_only)))
+    print("%-28s %8.2fs" % ("boot reads with prewarm", min(warm)))
+    print("saved %.2fs (%.0f%%)" % (min(cold) - min(warm), 100 * (1 - min(warm) / min(cold))))
+
+    if args.image is None:
+        os.remove(image)
+    os.rmdir(work_dir)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+""" Check the qcow2 images written by common/qcow2.py with qemu-img
+
+    For an image without a backing file and for overlays on qcow2, vmdk and
+    raw base images, creates the image with qcow2.create() writing it itself
+    and with qemu-img create, then:
+
+      check  - qemu-img check of our image finds no errors
+      info   - qemu-img info --backing-chain shows the same for both images
+               (size, cluster size, compat level, refcount bits, backing
+               file and its format)
+      io     - data written with qemu-io to our image reads back, as does the
+               data of the base image, and qemu-img check still passes
+
+    Needs qemu-img and qemu-io (qemu-utils). Exits non-zero if any check
+    fails.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import qcow2
+
+# what qemu-img info has to agree on, per image of the chain
+INFO_FIELDS = ("format", "virtual-size", "cluster-size", "backing-filename", "backing-filename-format")
+SPECIFIC_FIELDS = ("compat", "refcount-bits", "lazy-refcounts", "corrupt")
+
+
+def run(*args):
+    return subprocess.run(list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+
+
+def info(path):
+    res = run("qemu-img", "info", "--backing-chain", "--output", "json", path)
+    if res.returncode != 0:
+        raise RuntimeError(res.stdout.strip())
+    chain = []
+    for image in json.loads(res.stdout):
+        entry = {field: image.get(field) for field in INFO_FIELDS}
+        # the name of the file differs, the directory it is in does not
+        entry['backing-filename'] = os.path.basename(entry['backing-filename'] or "")
+        specific = image.get('format-specific', {}).get('data', {})
+        entry.update({field: specific.get(field) for field in SPECIFIC_FIELDS})
+        chain.append(entry)
+    return chain
+
+
+def check(path):
+    res = run("qemu-img", "check", path)
+    return res.returncode == 0, res.stdout.strip().splitlines()[-1] if res.stdout.strip() else ""
+
+
+def io_check(path, base_pattern):
+    """ Write to the image at path and read it back, the base image has
+        base_pattern in its first MB if it is not None
+    """
+    cmds = ["write -P 0x5a 1M 64k", "read -P 0x5a 1M 64k"]
+    if base_pattern is not None:
+        cmds.append("read -P 0x%02x 0 64k" % base_pattern)
+    args = ["qemu-io", "-f", "qcow2"]
+    for cmd in cmds:
+        args += ["-c", cmd]
+    res = run(*(args + [path]))
+    if res.returncode != 0 or "Pattern verification failed" in res.stdout:
+        return False, res.stdout.strip()
+    return check(path)
+
+
+def make_base(directory, format, size):
+    """ A base image of format with 0xa5 in its first MB, the pattern is
+        None without a base image
+    """
+    if format is None:
+        return None, None
+    path = os.path.join(directory, "base." + format)
+    res = run("qemu-img", "create", "-q", "-f", format, path, str(size))
+    if res.returncode != 0:
+        raise RuntimeError(res.stdout.strip())
+    res = run("qemu-io", "-f", format, "-c", "write -P 0xa5 0 1M", path)
+    if res.returncode != 0:
+        raise RuntimeError(res.stdout.strip())
+    return os.path.basename(path), 0xa5
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check qcow2 images written by common/qcow2.py with qemu-img')
+    parser.add_argument('--size', default="64M", help='size of the images')
+    parser.add_argument('--keep', action='store_true', help='keep the images')
+    args = parser.parse_args()
+
+    for tool in ("qemu-img", "qemu-io"):
+        if shutil.which(tool) is None:
+            sys.exit("%s not found, install qemu-utils" % tool)
+
+    work_dir = tempfile.mkdtemp(prefix="qcow2.", dir=os.getcwd())
+    failed = False
+    print("%-10s %-8s %-8s %-8s  %s" % ("backing", "check", "info", "io", "details"))
+    for backing_format in (None, "qcow2", "vmdk", "raw"):
+        name = backing_format or "none"
+        case_dir = os.path.join(work_dir, name)
+        os.makedirs(case_dir)
+        details = []
+        try:
+            backing, pattern = make_base(case_dir, backing_format, qcow2.parse_size(args.size))
+            ours = os.path.join(case_dir, "ours.qcow2")
+            theirs = os.path.join(case_dir, "theirs.qcow2")
+            size = None if backing else args.size
+            qcow2.create(ours, size, backing, native_write=True)
+            qcow2.create(theirs, size, backing, native_write=False)
+
+            check_ok, msg = check(ours)
+            if not check_ok:
+                details.append("check: %s" % msg)
+            ours_info, theirs_info = info(ours), info(theirs)
+            info_ok = ours_info == theirs_info
+            if not info_ok:
+                details.append("info: %s != %s" % (ours_info, theirs_info))
+            io_ok, msg = io_check(ours, pattern)
+            if not io_ok:
+                details.append("io: %s" % msg)
+        except (RuntimeError, OSError, ValueError) as exc:
+            check_ok = info_ok = io_ok = False
+            details.append(str(exc))
+        failed = failed or not (check_ok and info_ok and io_ok)
+        print("%-10s %-8s %-8s %-8s  %s" % (name, *("ok" if ok else "FAILED" for ok in (check_ok, info_ok, io_ok)),
+                                            "; ".join(details)))
+
+    if args.keep:
+        print("images kept in %s" % work_dir)
+    else:
+        shutil.rmtree(work_dir)
+    sys.exit(1 if failed else 0)
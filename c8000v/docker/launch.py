@@ -5,22 +5,17 @@ import logging
 import os
 import re
 import signal
-import subprocess
 import sys
-import telnetlib
 import time
 
+import configdrive
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -33,6 +28,13 @@ logging.Logger.trace = trace
 
 
 class C8000v_vm(vrnetlab.VM):
+    config_drive = "iso"
+    config_drive_file = "iosxe_config.txt"
+    config_drive_newline = "\r\n"
+    disk_interfaces = ("ide", "virtio")
+    # hostname# or hostname(config-xx)#, see VM.cli_prompt
+    cli_prompt = rb"[\r\n][\w.-]+(\([\w-]+\))?[#>] ?\Z"
+
     def __init__(self, username, password, install_mode=False):
         disk_image = None
         for e in sorted(os.listdir("/")):
@@ -53,6 +55,8 @@ class C8000v_vm(vrnetlab.VM):
 
         if self.install_mode:
             logger.trace("install mode")
+            # the install ISO is attached instead
+            self.config_drive = None
             self.image_name = "config.iso"
             self.create_boot_image()
 
@@ -63,26 +67,26 @@ class C8000v_vm(vrnetlab.VM):
         """ Creates a iso image with a bootstrap configuration
         """
 
-        cfg_file = open('/iosxe_config.txt', 'w')
+        config = []
         if self.license:
-            cfg_file.write("do clock set 13:33:37 1 Jan 2010\r\n")
-            cfg_file.write("interface GigabitEthernet1\r\n")
-            cfg_file.write("ip address 10.0.0.15 255.255.255.0\r\n")
-            cfg_file.write("no shut\r\n")
-            cfg_file.write("exit\r\n")
-            cfg_file.write("license accept end user agreement\r\n")
-            cfg_file.write("yes\r\n")
-            cfg_file.write("do license install tftp://10.0.0.2/license.lic\r\n\r\n")
-        cfg_file.write("license boot level network-premier addon dna-premier\r\n")
-        cfg_file.write("platform console serial\r\n\r\n")
-        cfg_file.write("do clear platform software vnic-if nvtable\r\n")
-        cfg_file.write("do wr\r\n")
-        cfg_file.write("do reload\r\n")
-        cfg_file.close()
-
-        genisoimage_args = ["genisoimage", "-l", "-o", "/" + self.image_name, "/iosxe_config.txt"]
-
-        subprocess.Popen(genisoimage_args)
+            config.append("do clock set 13:33:37 1 Jan 2010")
+            config.append("interface GigabitEthernet1")
+            config.append("ip address 10.0.0.15 255.255.255.0")
+            config.append("no shut")
+            config.append("exit")
+            config.append("license accept end user agreement")
+            config.append("yes")
+            config.append("do license install tftp://10.0.0.2/license.lic")
+            config.append("")
+        config.append("license boot level network-premier addon dna-premier")
+        config.append("platform console serial")
+        config.append("")
+        config.append("do clear platform software vnic-if nvtable")
+        config.append("do wr")
+        config.append("do reload")
+
+        configdrive.make_iso("/" + self.image_name,
+                             {"iosxe_config.txt": "".join(line + "\r\n" for line in config)})
 
 
     def bootstrap_spin(self):
@@ -105,7 +109,8 @@ class C8000v_vm(vrnetlab.VM):
                     self.wait_write("", wait=None)
 
                     # run main config!
-                    self.bootstrap_config()
+                    if not self.bootstrap_config():
+                        return
                     # close telnet connection
                     self.tn.close()
                     # startup time?
@@ -126,7 +131,7 @@ class C8000v_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -135,41 +140,63 @@ class C8000v_vm(vrnetlab.VM):
         return
 
 
-    def bootstrap_config(self):
-        """ Do the actual bootstrap config
+    def gen_bootstrap_config(self):
+        """ Bootstrap configuration, picked up from the config drive at boot
         """
-        self.logger.info("applying bootstrap configuration")
+        config = ["hostname c8000v",
+                  "username %s privilege 15 password %s" % (self.username, self.password)]
+        if int(self.version.split('.')[0]) >= 16:
+            config.append("ip domain name example.com")
+        else:
+            config.append("ip domain-name example.com")
+        config.extend([
+            "crypto key generate rsa modulus 2048",
+            "interface GigabitEthernet1",
+            "ip address %s %s" % (self.mgmt_address.ip, self.mgmt_address.netmask),
+            "no shut",
+            "exit",
+            "restconf",
+            "netconf-yang",
+            "netconf max-sessions 16",
+            # I did not find any documentation about this, but is seems like a good idea!?
+            "netconf detailed-error",
+            "ip ssh server algorithm mac hmac-sha2-512",
+            "ip ssh maxstartups 128",
+            "line vty 0 4",
+            "login local",
+            "transport input all",
+            "exit",
+        ])
+        config.extend(self.extra_config)
+        config.append("do write memory")
+        return config
+
 
+    def bootstrap_config(self):
+        """ Make sure the bootstrap config is applied
+
+            It is normally picked up from the config drive while booting, if
+            that did not happen it is typed on the serial console instead.
+            Returns False if it is not applied either way, after restarting
+            the VM.
+        """
         self.wait_write("", None)
         self.wait_write("enable", wait=">")
-        self.wait_write("configure terminal", wait=">")
+        if self.wait_config("show running-config | include ^username", "username %s " % self.username, spins=1):
+            self.logger.info("bootstrap configuration applied from config drive")
+            return True
 
-        self.wait_write("hostname c8000v")
-        self.wait_write("username %s privilege 15 password %s" % (self.username, self.password))
-        if int(self.version.split('.')[0]) >= 16:
-           self.wait_write("ip domain name example.com")
-        else:
-           self.wait_write("ip domain-name example.com")
-        self.wait_write("crypto key generate rsa modulus 2048")
-
-        self.wait_write("interface GigabitEthernet1")
-        self.wait_write("ip address 10.0.0.15 255.255.255.0")
-        self.wait_write("no shut")
-        self.wait_write("exit")
-        self.wait_write("restconf")
-        self.wait_write("netconf-yang")
-        self.wait_write("netconf max-sessions 16")
-        # I did not find any documentation about this, but is seems like a good idea!?
-        self.wait_write("netconf detailed-error")
-        self.wait_write("ip ssh server algorithm mac hmac-sha2-512")
-        self.wait_write("ip ssh maxstartups 128")
-
-        self.wait_write("line vty 0 4")
-        self.wait_write("login local")
-        self.wait_write("transport input all")
-        self.wait_write("end")
-        self.wait_write("copy running-config startup-config")
-        self.wait_write("\r", "Destination")
+        self.logger.warning("bootstrap configuration not applied from config drive, applying it on the serial console")
+        # wait_config() read the last prompt
+        self.wait_write("", None)
+        self.wait_write("configure terminal", timeout=30)
+        self.send_config(self.gen_bootstrap_config())
+        self.wait_write("end", timeout=30)
+        if not self.wait_config("show running-config | include ^username", "username %s " % self.username,
+                                spins=3):
+            self.restart("bootstrap configuration not applied")
+            return False
+        return True
 
 
 class C8000v(vrnetlab.VR):
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+""" Host wide admission control for booting virtual routers
+
+    Starting a large topology boots every router at once. They all compete
+    for the CPUs, every boot takes several times as long and many hit the
+    spin limit of their platform and start over, adding to the load. Booting
+    at most a few routers at a time gets all of them up sooner.
+
+    Containers on a host coordinate through a directory bind mounted into all
+    of them (BOOT_SLOTS_DIR). It has a file per boot slot (BOOT_SLOTS of them),
+    a container booting holds an exclusive flock on one. Locks go away with
+    the process holding them, so a container that dies does not leak its
+    slot.
+
+    Containers waiting for a slot put a file in the queue/ subdirectory named
+    after their priority (BOOT_PRIORITY, higher boots first) and when they
+    started waiting, locked as long as they wait. A slot is only taken by a
+    container that has no one waiting before it beyond the number of free
+    slots. Queue files that are not locked belong to containers that are gone
+    and are removed.
+"""
+
+import fcntl
+import logging
+import os
+import socket
+import threading
+import time
+
+POLL_INTERVAL = 0.5
+
+
+class Admission:
+    """ Boot slots in directory shared by all containers on the host, slots
+        at most booting at once
+
+        All VMs of a virtual router boot in the same slot, it is held while
+        any of them is booting.
+    """
+    def __init__(self, directory, slots, priority=0):
+        self.logger = logging.getLogger()
+        self.directory = directory
+        self.slots = slots
+        self.priority = priority
+        self.queue_dir = os.path.join(directory, "queue")
+        os.makedirs(self.queue_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.slot_fd = None
+        self.slot = None
+        # the VMs booting in our slot
+        self.holders = set()
+        self.waited = 0.0
+
+    @classmethod
+    def from_env(cls):
+        """ Admission control as configured by BOOT_SLOTS, BOOT_SLOTS_DIR and
+            BOOT_PRIORITY, None if it is off
+        """
+        slots = int(os.getenv("BOOT_SLOTS", "0"))
+        if slots <= 0:
+            return None
+        directory = os.getenv("BOOT_SLOTS_DIR", "/boot-slots")
+        try:
+            return cls(directory, slots, int(os.getenv("BOOT_PRIORITY", "0")))
+        except OSError as exc:
+            logging.getLogger().warning("Unable to use boot slots in %s, booting without admission control: %s"
+                                        % (directory, exc))
+            return None
+
+    def slot_file(self, i):
+        return os.path.join(self.directory, "slot-%d" % i)
+
+    def acquire(self, holder):
+        """ Wait for a boot slot for holder (a VM), returns the seconds
+            waited
+        """
+        with self.lock:
+            if self.slot_fd is not None:
+                self.holders.add(holder)
+                return 0.0
+            start = time.monotonic()
+            entry = self._enqueue()
+            try:
+                logged = False
+                while True:
+                    if self._take_slot(entry):
+                        break
+                    if not logged:
+                        self.logger.info("Waiting for one of %d boot slots for %s" % (self.slots, holder))
+                        logged = True
+                    time.sleep(POLL_INTERVAL)
+            finally:
+                self._dequeue(entry)
+            self.holders.add(holder)
+            waited = time.monotonic() - start
+            self.waited += waited
+            self.logger.info("Got boot slot %d for %s after %.1fs" % (self.slot, holder, waited))
+            return waited
+
+    def release(self, holder):
+        """ holder is done booting, give back the slot once no VM of ours is
+            booting
+        """
+        with self.lock:
+            self.holders.discard(holder)
+            if self.holders or self.slot_fd is None:
+                return
+            os.close(self.slot_fd)
+            self.logger.info("Released boot slot %d" % self.slot)
+            self.slot_fd = None
+            self.slot = None
+
+    @property
+    def held(self):
+        return self.slot_fd is not None
+
+    def _enqueue(self):
+        # priority first (higher first), then in order of arrival
+        name = "%06d-%.6f-%s-%d" % (999999 - min(max(self.priority, 0), 999999), time.time(),
+                                    socket.gethostname(), os.getpid())
+        tmp = os.path.join(self.directory, "." + name)
+        fd = os.open(tmp, os.O_CREAT | os.O_RDWR, 0o644)
+        # locked before it shows up in the queue, so it is never mistaken
+        # for one left behind
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(tmp, os.path.join(self.queue_dir, name))
+        return name, fd
+
+    def _dequeue(self, entry):
+        name, fd = entry
+        try:
+            os.remove(os.path.join(self.queue_dir, name))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def _waiting_before(self, name):
+        """ Number of live containers waiting before the queue entry name
+        """
+        res = 0
+        for other in sorted(os.listdir(self.queue_dir)):
+            if other >= name:
+                break
+            path = os.path.join(self.queue_dir, other)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                res += 1
+            else:
+                # nobody holds it, left behind by a container that is gone
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            finally:
+                os.close(fd)
+        return res
+
+    def _take_slot(self, entry):
+        free = []
+        for i in range(self.slots):
+            fd = os.open(self.slot_file(i), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            free.append((i, fd))
+        # keep the first free slot if there are more free slots than
+        # containers waiting before us
+        taken = None
+        if free and self._waiting_before(entry[0]) < len(free):
+            taken = free.pop(0)
+        for _, fd in free:
+            os.close(fd)
+        if taken is None:
+            return False
+        self.slot, self.slot_fd = taken
+        return True
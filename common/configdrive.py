@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+""" Config drives for delivering the bootstrap configuration
+
+    Instead of typing the bootstrap configuration on the serial console one
+    line at a time, waiting for the prompt after each line, it is handed to
+    the NOS as a file it picks up by itself:
+
+      * iso  - an ISO 9660 image attached as CD-ROM (needs genisoimage)
+      * usb  - a FAT image attached as USB stick (needs dosfstools and mtools)
+      * tftp - a file on the TFTP server of the qemu user mode networking,
+               reachable from the router at tftp://10.0.0.2/<file>
+
+    Which one to use depends on what the NOS supports, see VM.config_drive.
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+
+METHODS = ("iso", "usb", "tftp")
+
+TFTP_DIR = "/tftpboot"
+
+
+def write_files(directory, files):
+    for name, content in files.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(content)
+
+
+def make_iso(path, files, label=None):
+    """ Create an ISO image at path containing files
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_files(tmp_dir, files)
+        cmd = ["genisoimage", "-quiet", "-l", "-iso-level", "2", "-o", path]
+        if label:
+            cmd.extend(["-V", label])
+        subprocess.run(cmd + [tmp_dir], check=True)
+
+
+def make_usb(path, files, label=None, size_kb=16384):
+    """ Create a FAT formatted disk image at path containing files
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    subprocess.run(["mkfs.vfat", "-C", "-n", label or "CONFIG", path, str(size_kb)],
+                   check=True, stdout=subprocess.DEVNULL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_files(tmp_dir, files)
+        for name in files:
+            subprocess.run(["mcopy", "-i", path, os.path.join(tmp_dir, name), "::" + name], check=True)
+
+
+def qemu_args(method, path):
+    """ qemu arguments to attach a config drive
+    """
+    if method == "iso":
+        return ["-drive", "file=%s,media=cdrom,readonly=on" % path]
+    if method == "usb":
+        return ["-usb", "-drive", "id=config_usb,media=disk,format=raw,file=%s,if=none" % path,
+                "-device", "usb-storage,drive=config_usb"]
+    if method == "tftp":
+        return []
+    raise ValueError("Unknown config drive method %s, must be one of %s" % (method, ", ".join(METHODS)))
+
+
+def build(method, path, files, label=None):
+    """ Build a config drive holding files, a dict of file name to content
+    """
+    logging.getLogger().debug("Building %s config drive with %s" % (method, ", ".join(sorted(files))))
+    if method == "iso":
+        make_iso(path, files, label)
+    elif method == "usb":
+        make_usb(path, files, label)
+    elif method == "tftp":
+        os.makedirs(TFTP_DIR, exist_ok=True)
+        write_files(TFTP_DIR, files)
+    else:
+        raise ValueError("Unknown config drive method %s, must be one of %s" % (method, ", ".join(METHODS)))
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+""" Serial console engine built on asyncio streams
+
+    Console is a drop-in replacement for the parts of telnetlib.Telnet that
+    are used to talk to the qemu serial console and monitor: expect(),
+    read_until(), read_very_eager(), write() and close(). telnetlib is gone
+    in Python 3.13 and is not very efficient for what we do with it; it
+    compiles the expect patterns on every call and scans the entire buffer
+    for every pattern each time new data arrives.
+
+    Reading is done by a task on a shared asyncio event loop running in a
+    background thread, the (synchronous) launch scripts wait for data on a
+    condition variable. Received data is kept in a bounded window, older
+    data is dropped if nobody consumes it. Expect patterns are compiled once
+    into a single regex and only the new data (plus some lookback for
+    matches spanning reads) is searched when more data arrives.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import re
+import threading
+import time
+
+# telnet protocol bytes, see RFC 854
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# telnetlib drops these from the data stream, so do we
+_DROP = re.compile(b"[\x00\x11]")
+
+# default size of the receive window, qemu consoles are slow and patterns are
+# matched as data arrives so this only matters if nobody is reading
+WINDOW = 1024 * 1024
+# how far back from the end of the already searched data to start searching
+# when more data arrives; a match that does not start at the beginning of the
+# data must not be longer than this
+LOOKBACK = 256
+
+
+# flags of compiled patterns that can be applied to a part of a regex
+_SCOPED_FLAGS = ((re.IGNORECASE, b"i"), (re.MULTILINE, b"m"), (re.DOTALL, b"s"),
+                 (re.VERBOSE, b"x"))
+
+
+def _to_bytes(pattern):
+    if isinstance(pattern, str):
+        return pattern.encode()
+    return pattern
+
+
+class PatternSet:
+    """ A list of expect patterns compiled into one regex
+
+        The combined regex finds out in one pass over new data whether any of
+        the patterns matches and where, the pattern that matched is then
+        found by trying them at that position only. The alternatives are not
+        capturing groups, as that would stop the regex engine from skipping
+        ahead to possible first characters. Patterns anchored to the start
+        of the data ("^...") go into a second combined regex that is only
+        tried at the start.
+
+        As with telnetlib the first pattern in the list that matches wins,
+        which is not necessarily the one matching first in the data, so
+        patterns listed before the one that matched are checked separately.
+    """
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.regexes = []
+        self.anchored = []
+        alternatives = {False: [], True: []}
+        for pattern in patterns:
+            flags = b""
+            if isinstance(pattern, re.Pattern):
+                flags = b"".join(c for flag, c in _SCOPED_FLAGS if pattern.flags & flag)
+                pattern = pattern.pattern
+            pattern = _to_bytes(pattern)
+            anchored = pattern.startswith((b"^", b"\\A")) and b"m" not in flags
+            if flags:
+                pattern = b"(?%s:%s)" % (flags, pattern)
+            self.regexes.append(re.compile(pattern))
+            self.anchored.append(anchored)
+            alternatives[anchored].append(b"(?:%s)" % pattern)
+        self.search_regex = None
+        self.match_regex = None
+        if alternatives[False]:
+            self.search_regex = re.compile(b"|".join(alternatives[False]))
+        if alternatives[True]:
+            self.match_regex = re.compile(b"|".join(alternatives[True]))
+
+    def _which(self, data, m, anchored):
+        for i, regex in enumerate(self.regexes):
+            if self.anchored[i] == anchored and regex.match(data, m.start()):
+                return i
+
+    def find(self, data, pos=0):
+        """ Return the index of the pattern matching data or -1
+
+            Only matches ending after pos are found, unless they are anchored
+            to the start of the data.
+        """
+        found = []
+        if self.match_regex is not None:
+            m = self.match_regex.match(data)
+            if m is not None:
+                found.append(self._which(data, m, True))
+        if self.search_regex is not None:
+            m = self.search_regex.search(data, pos)
+            if m is not None:
+                found.append(self._which(data, m, False))
+        if not found:
+            return -1
+        idx = min(found)
+        for i in range(idx):
+            if self.regexes[i].search(data, 0 if self.anchored[i] else pos):
+                return i
+        return idx
+
+    def search(self, data, pos=0):
+        """ Return (index, match) of the pattern matching data or (-1, None)
+        """
+        idx = self.find(data, pos)
+        if idx == -1:
+            return -1, None
+        return idx, self.regexes[idx].search(data, 0 if self.anchored[idx] else pos)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_patterns(patterns):
+    """ Compile a tuple of patterns, cached as the launch scripts use the same
+        few pattern lists over and over
+    """
+    return PatternSet(patterns)
+
+
+class TelnetFilter:
+    """ Strip telnet negotiation from a byte stream
+
+        Every option the other side offers or asks for is refused, the same
+        way telnetlib does. State is kept across chunks as an IAC sequence
+        may be split over two reads.
+    """
+    def __init__(self):
+        self.pending = b""
+        self.replies = []
+
+    def feed(self, data):
+        data = self.pending + data
+        self.pending = b""
+        if IAC not in data:
+            return _DROP.sub(b"", data)
+
+        out = bytearray()
+        i = 0
+        n = len(data)
+        while i < n:
+            j = data.find(IAC, i)
+            if j == -1:
+                out += data[i:]
+                break
+            out += data[i:j]
+            if j + 1 >= n:
+                self.pending = data[j:]
+                break
+            cmd = data[j + 1]
+            if cmd == IAC:
+                out.append(IAC)
+                i = j + 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if j + 2 >= n:
+                    self.pending = data[j:]
+                    break
+                opt = data[j + 2]
+                reply = WONT if cmd in (DO, DONT) else DONT
+                self.replies.append(bytes([IAC, reply, opt]))
+                i = j + 3
+            elif cmd == SB:
+                end = data.find(bytes([IAC, SE]), j + 2)
+                if end == -1:
+                    self.pending = data[j:]
+                    break
+                i = end + 2
+            else:
+                # NOP, GA and friends carry no data
+                i = j + 2
+        return _DROP.sub(b"", bytes(out))
+
+    def take_replies(self):
+        replies, self.replies = b"".join(self.replies), []
+        return replies
+
+
+class Console:
+    """ Connection to a qemu character device
+
+        Connects to host and port over TCP or to a unix socket at path. With
+        telnet=True the telnet protocol is spoken, which is what qemu uses
+        for "-serial telnet:...", raw connections (like the monitor on
+        "tcp:...") work either way as long as no 0xff bytes are sent.
+
+        timeout is the default for all waits, None waits forever like
+        telnetlib does.
+    """
+    def __init__(self, host=None, port=0, timeout=None, path=None, loop=None,
+                 telnet=True, window=WINDOW, connect_timeout=10):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.telnet = telnet
+        self.window = window
+        self.loop = loop
+        self.eof = False
+
+        # received data that has not been consumed yet
+        self._buf = bytearray()
+        # how much of _buf has been searched with _searched_for
+        self._searched = 0
+        self._searched_for = None
+        self._cond = threading.Condition()
+        self._filter = TelnetFilter()
+        self._writer = None
+        self._task = None
+        # callables receiving all data read from the console
+        self.observers = []
+
+        if host is not None or path is not None:
+            self.open(connect_timeout)
+
+    def __repr__(self):
+        if self.path:
+            return "Console(%s)" % self.path
+        return "Console(%s:%s)" % (self.host, self.port)
+
+    def open(self, timeout=10):
+        """ Connect, raises OSError if the connection could not be opened
+        """
+        if self.loop is None:
+            import vrnetlab
+            self.loop = vrnetlab.event_loop()
+        fut = asyncio.run_coroutine_threadsafe(self._open(), self.loop)
+        try:
+            fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            raise
+
+    async def _open(self):
+        if self.path is not None:
+            reader, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._task = asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if self.telnet:
+                    data = self._filter.feed(data)
+                    replies = self._filter.take_replies()
+                    if replies:
+                        self._writer.write(replies)
+                if data:
+                    self.feed(data)
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            with self._cond:
+                self.eof = True
+                self._cond.notify_all()
+
+    def feed(self, data):
+        """ Add data received from the console
+        """
+        for observer in self.observers:
+            observer(data)
+        with self._cond:
+            self._buf += data
+            if len(self._buf) > self.window:
+                drop = len(self._buf) - self.window
+                del self._buf[:drop]
+                self._searched = max(0, self._searched - drop)
+            self._cond.notify_all()
+
+    def _consume(self, end):
+        data = bytes(self._buf[:end])
+        del self._buf[:end]
+        self._searched = 0
+        self._searched_for = None
+        return data
+
+    def _match(self, pattern_set):
+        start = 0
+        if self._searched_for is pattern_set:
+            start = max(0, self._searched - LOOKBACK)
+        idx = pattern_set.find(self._buf, start)
+        if idx != -1:
+            # match again on an immutable copy, the match object we return
+            # has to stay valid after the data is consumed
+            data = bytes(self._buf)
+            m = pattern_set.regexes[idx].search(data, 0 if pattern_set.anchored[idx] else start)
+            self._consume(m.end())
+            return idx, m, data[:m.end()]
+        self._searched = len(self._buf)
+        self._searched_for = pattern_set
+        return None
+
+    def match(self, patterns):
+        """ Check the data received so far for one of the patterns
+
+            Returns the same as expect() if one of the patterns matches,
+            otherwise None and nothing is consumed. Never blocks.
+        """
+        pattern_set = compile_patterns(tuple(patterns))
+        with self._cond:
+            return self._match(pattern_set)
+
+    def expect(self, patterns, timeout=None):
+        """ Wait until one of the patterns matches
+
+            Same semantics as telnetlib.Telnet.expect(); returns a tuple of the
+            index of the pattern that matched, the match object and the data
+            up to and including the match. On timeout (-1, None, data) is
+            returned with whatever data was received. EOFError is raised if
+            the connection is closed and there is no data left.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pattern_set = compile_patterns(tuple(patterns))
+
+        with self._cond:
+            while True:
+                res = self._match(pattern_set)
+                if res is not None:
+                    return res
+                if self.eof:
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            data = self._consume(len(self._buf))
+        if self.eof and not data:
+            raise EOFError("telnet connection closed")
+        return -1, None, data
+
+    def read_until(self, expected, timeout=None):
+        """ Read until expected is found or until timeout
+
+            Returns the data up to and including expected, or whatever was
+            received if it was not found.
+        """
+        return self.expect([re.escape(_to_bytes(expected))], timeout)[2]
+
+    def read_very_eager(self):
+        """ Return all data received so far without blocking
+        """
+        with self._cond:
+            data = self._consume(len(self._buf))
+            if self.eof and not data:
+                raise EOFError("telnet connection closed")
+        return data
+
+    def write(self, data):
+        """ Send data, IAC bytes are escaped when speaking telnet
+        """
+        if self._writer is None:
+            raise OSError("console is not connected")
+        if self.telnet:
+            data = data.replace(bytes([IAC]), bytes([IAC, IAC]))
+        self.loop.call_soon_threadsafe(self._writer.write, data)
+
+    def close(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self.loop.call_soon_threadsafe(writer.close)
+        if self._task is not None:
+            self.loop.call_soon_threadsafe(self._task.cancel)
+            self._task = None
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+""" Capture of the serial console of a VM
+
+    The launch code only reads the serial console while the VM boots and
+    closes it once the router runs, so the output of a router crashing later
+    on (a kernel panic, a process dumping core) is gone unless somebody
+    happened to be connected. Tracing every line the boot prints costs more
+    than it is worth, too.
+
+    qemu writes everything the guest sends to the serial port to a log file
+    (the logfile option of the chardev) whether anybody is connected or not.
+    We make that log file a FIFO read on the shared event loop, so the
+    console is captured from the first byte until qemu exits, without being
+    in the way of the launch code or people connecting to it on port 50xx.
+    The pipe is enlarged so a burst of output does not stall qemu while the
+    event loop is busy. We keep a writer end of the FIFO open ourselves so a
+    restarted qemu finds a reader and the reader never sees end of file.
+
+    The output goes into a ring of the last CONSOLE_LOG_KB per VM, served by
+    the status server as /console. It is also written to gzip compressed
+    segments of about CONSOLE_LOG_SEGMENT_KB of output in CONSOLE_LOG_DIR
+    (empty to keep it in memory only), of which the newest
+    CONSOLE_LOG_SEGMENTS are kept. Memory use is bounded by the ring and one
+    segment.
+"""
+
+import fcntl
+import gzip
+import logging
+import os
+import re
+import threading
+import time
+
+# F_SETPIPE_SZ is only in the fcntl module of Python 3.10 and later
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+PIPE_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class ConsoleLog:
+    """ The last size bytes of the console output of a VM, spilled to
+        compressed segments in directory if it is not None
+    """
+    def __init__(self, name, size=256 * 1024, directory=None, segment_size=256 * 1024, segments=8):
+        self.logger = logging.getLogger()
+        self.name = name
+        self.size = size
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.ring = bytearray()
+        # output not spilled to a segment yet
+        self.pending = bytearray()
+        self.total = 0
+        self.spilled = 0
+        self.last_output = None
+        self.seq = 0
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                # carry on after the segments of an earlier run
+                self.seq = max((seq for seq, _ in self.segment_files()), default=0)
+            except OSError as exc:
+                self.logger.warning("Unable to write console log to %s: %s" % (self.directory, exc))
+                self.directory = None
+
+    @classmethod
+    def from_env(cls, name):
+        """ Console log as configured by CONSOLE_LOG_KB, CONSOLE_LOG_DIR,
+            CONSOLE_LOG_SEGMENT_KB and CONSOLE_LOG_SEGMENTS
+        """
+        return cls(name, int(os.getenv("CONSOLE_LOG_KB", "256")) * 1024,
+                   os.getenv("CONSOLE_LOG_DIR", "/console-log") or None,
+                   int(os.getenv("CONSOLE_LOG_SEGMENT_KB", "256")) * 1024,
+                   int(os.getenv("CONSOLE_LOG_SEGMENTS", "8")))
+
+    def segment_files(self):
+        """ (sequence number, path) of our segments, oldest first
+        """
+        res = []
+        for entry in os.listdir(self.directory):
+            m = re.match(r"%s-(\d+)\.log\.gz$" % re.escape(self.name), entry)
+            if m:
+                res.append((int(m.group(1)), os.path.join(self.directory, entry)))
+        return sorted(res)
+
+    def append(self, data):
+        with self.lock:
+            self.total += len(data)
+            self.last_output = time.monotonic()
+            self.ring += data
+            if len(self.ring) > self.size:
+                # cheap, bytearray only moves its start when deleting from
+                # the front
+                del self.ring[:len(self.ring) - self.size]
+            if self.directory is None:
+                return
+            self.pending += data
+            if len(self.pending) >= self.segment_size:
+                self._spill()
+
+    def flush(self):
+        """ Write the output not spilled yet to a segment, when qemu exited
+        """
+        with self.lock:
+            if self.directory is not None and self.pending:
+                self._spill()
+
+    def _spill(self):
+        self.seq += 1
+        path = os.path.join(self.directory, "%s-%06d.log.gz" % (self.name, self.seq))
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(gzip.compress(bytes(self.pending), compresslevel=1))
+            os.replace(path + ".tmp", path)
+            self.spilled += os.path.getsize(path)
+            for _, old in self.segment_files()[:-self.segments]:
+                os.remove(old)
+        except OSError as exc:
+            self.logger.warning("Unable to write console log to %s, keeping it in memory only: %s"
+                                % (self.directory, exc))
+            self.directory = None
+        self.pending = bytearray()
+
+    def tail(self, nbytes):
+        """ The last nbytes of output, from the segments on disk if the ring
+            does not go back that far
+        """
+        with self.lock:
+            if nbytes <= len(self.ring) or self.directory is None:
+                return bytes(self.ring[-nbytes:]) if nbytes > 0 else b""
+            parts = [bytes(self.pending)]
+            have = len(self.pending)
+            for _, path in reversed(self.segment_files()):
+                if have >= nbytes:
+                    break
+                try:
+                    with gzip.open(path) as f:
+                        parts.append(f.read())
+                except (OSError, EOFError):
+                    break
+                have += len(parts[-1])
+        res = b"".join(reversed(parts))
+        return res[-nbytes:]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'bytes': self.total,
+                'buffered_bytes': len(self.ring),
+                'spilled_bytes': self.spilled,
+                'last_output': round(time.monotonic() - self.last_output, 1) if self.last_output is not None else None,
+            }
+
+
+class ConsoleTap:
+    """ Read the FIFO at path qemu logs the serial console to into log, on
+        the event loop loop
+    """
+    def __init__(self, loop, path, log):
+        self.logger = logging.getLogger()
+        self.loop = loop
+        self.path = path
+        self.log = log
+        self.fd = None
+        self.writer_fd = None
+
+    def open(self):
+        """ Create the FIFO and start reading it, before qemu opens it for
+            writing, as opening a FIFO without a reader blocks
+        """
+        if self.fd is not None:
+            return
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.mkfifo(self.path, 0o600)
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self.writer_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            fcntl.fcntl(self.fd, F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError:
+            # above /proc/sys/fs/pipe-max-size, the default 64 kB will do
+            pass
+        self.loop.call_soon_threadsafe(self.loop.add_reader, self.fd, self.read)
+
+    def read(self):
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            self.log.append(data)
+
+    def flush(self, timeout=5):
+        """ Read what qemu wrote so far and spill it, from another thread
+            than the event loop
+        """
+        if self.fd is None:
+            return
+        done = threading.Event()
+
+        def flush():
+            self.read()
+            self.log.flush()
+            done.set()
+        self.loop.call_soon_threadsafe(flush)
+        done.wait(timeout)
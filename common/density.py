@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+""" Give the memory of idle VMs back to the host
+
+    A lab router boots, gets its configuration and then mostly sits there,
+    but keeps all of its RAM. Density mode (DENSITY_MODE) gets some of it
+    back in three ways:
+
+      KSM          - qemu marks guest RAM mergeable by default, the kernel
+                     merges identical pages of all VMs on the host once KSM
+                     runs (/sys/kernel/mm/ksm/run), which we switch on
+      balloon      - a virtio-balloon device, on platforms whose guest has a
+                     driver for it, with free page reporting where the guest
+                     kernel supports it (Linux 5.7 and later) so pages the
+                     guest frees are handed back right away
+      shrinking    - with DENSITY_SHRINK the balloon is inflated once the VM
+                     is running, down to the memory floor of the platform
+
+    KSM does not work with hugepages, which are never merged.
+"""
+
+import logging
+import os
+
+KSM_DIR = "/sys/kernel/mm/ksm"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def enable_ksm():
+    """ Make sure KSM is running, returns False if it is not and we cannot
+        start it (a read-only /sys, without --privileged)
+    """
+    logger = logging.getLogger()
+    run = _read_int(os.path.join(KSM_DIR, "run"))
+    if run is None:
+        logger.warning("KSM is not available on this host")
+        return False
+    if run == 1:
+        return True
+    try:
+        with open(os.path.join(KSM_DIR, "run"), "w") as f:
+            f.write("1")
+    except OSError as exc:
+        logger.warning("Unable to start KSM, identical pages of VMs will not be merged: %s" % exc)
+        return False
+    logger.info("Started KSM")
+    return True
+
+
+def ksm_merged_bytes(pid):
+    """ Memory of process pid merged by KSM, None if the kernel does not
+        tell (before 5.19)
+    """
+    pages = _read_int("/proc/%d/ksm_merging_pages" % pid)
+    return pages * PAGE_SIZE if pages is not None else None
+
+
+def ksm_stats():
+    """ Host wide KSM counters in bytes: shared is the memory the merged
+        pages take, sharing how much they would take unmerged
+    """
+    shared = _read_int(os.path.join(KSM_DIR, "pages_shared"))
+    sharing = _read_int(os.path.join(KSM_DIR, "pages_sharing"))
+    if shared is None or sharing is None:
+        return None
+    return {'shared_bytes': shared * PAGE_SIZE, 'sharing_bytes': sharing * PAGE_SIZE}
+
+
+def balloon_args(free_page_reporting=False):
+    """ qemu arguments adding a virtio-balloon device
+    """
+    opts = "virtio-balloon-pci,id=balloon0"
+    if free_page_reporting:
+        opts += ",free-page-reporting=on"
+    return ["-device", opts]
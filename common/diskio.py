@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+""" Disk I/O profile of the overlay disk image of a VM
+
+    By default the overlay is attached as IDE disk with the qemu defaults
+    (cache=writeback, aio=threads), which every NOS boots from. Where the NOS
+    supports it the disk can be attached as virtio-blk or virtio-scsi, and
+    cache mode, AIO backend, qcow2 metadata caches and discard can be tuned,
+    through a named profile and / or individual environment variables:
+
+      DISK_PROFILE             - one of PROFILES, the base for the rest
+      DISK_INTERFACE           - ide, virtio or virtio-scsi
+      DISK_CACHE               - writeback, writethrough, none, directsync or unsafe
+      DISK_AIO                 - threads, native or io_uring
+      DISK_L2_CACHE_SIZE       - qcow2 L2 table cache, like 8M
+      DISK_REFCOUNT_CACHE_SIZE - qcow2 refcount block cache, like 1M
+      DISK_DISCARD             - pass discards from the guest on to the image
+
+    The overlay is written next to the base image in the container's
+    writable layer, which is an overlay file system on the host itself. Set
+    OVERLAY_DIR to a tmpfs or a volume to avoid that, see VM.overlay_disk_image.
+"""
+
+import logging
+import os
+
+INTERFACES = ("ide", "virtio", "virtio-scsi")
+CACHE_MODES = ("writeback", "writethrough", "none", "directsync", "unsafe")
+AIO_MODES = ("threads", "native", "io_uring")
+
+PROFILES = {
+    # what we always did, the qemu defaults
+    "default": {},
+    # bypass the host page cache, the guest has its own. aio=native needs
+    # O_DIRECT, which is what cache=none does
+    "direct": {'cache': "none", 'aio': "native", 'l2_cache_size': "8M"},
+    # ignore flushes from the guest, a lab router does not survive a crash of
+    # the host anyway
+    "fast": {'cache': "unsafe", 'aio': "io_uring", 'l2_cache_size': "8M", 'discard': True},
+}
+
+
+def filesystem_type(path):
+    """ Type of the file system path is on, like "tmpfs" or "overlay"
+    """
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                if ((path == mount_point or path.startswith(mount_point.rstrip("/") + "/"))
+                        and len(mount_point) >= len(best)):
+                    best, fs_type = mount_point, fields[2]
+    except OSError:
+        pass
+    return fs_type
+
+
+class DiskProfile:
+    def __init__(self, interface="ide", cache=None, aio=None, l2_cache_size=None,
+                 refcount_cache_size=None, discard=False):
+        self.logger = logging.getLogger()
+        self.interface = interface
+        self.cache = cache
+        self.aio = aio
+        self.l2_cache_size = l2_cache_size
+        self.refcount_cache_size = refcount_cache_size
+        self.discard = discard
+
+    def __repr__(self):
+        return "DiskProfile(%s)" % ", ".join("%s=%s" % (k, v) for k, v in self.as_dict().items())
+
+    def as_dict(self):
+        return {k: v for k, v in vars(self).items() if k != "logger"}
+
+    @classmethod
+    def from_env(cls, interfaces=("ide",), default_interface="ide"):
+        """ Build the profile from the environment
+
+            interfaces are the disk interfaces the NOS is known to boot from,
+            others are refused.
+        """
+        logger = logging.getLogger()
+        name = os.getenv("DISK_PROFILE", "default")
+        if name not in PROFILES:
+            logger.error("Unknown DISK_PROFILE %s, must be one of %s, using default" % (name, ", ".join(PROFILES)))
+            name = "default"
+        settings = dict(PROFILES[name])
+        settings.setdefault('interface', default_interface)
+        for key, choices in (('interface', INTERFACES), ('cache', CACHE_MODES), ('aio', AIO_MODES)):
+            value = os.getenv("DISK_" + key.upper())
+            if value is None:
+                continue
+            if value not in choices:
+                logger.error("Invalid DISK_%s %s, must be one of %s" % (key.upper(), value, ", ".join(choices)))
+                continue
+            settings[key] = value
+        for key in ('l2_cache_size', 'refcount_cache_size'):
+            if os.getenv("DISK_" + key.upper()):
+                settings[key] = os.getenv("DISK_" + key.upper())
+        if os.getenv("DISK_DISCARD"):
+            settings['discard'] = os.getenv("DISK_DISCARD").lower() in ("1", "true", "yes", "on")
+
+        if settings['interface'] not in interfaces:
+            logger.warning("This NOS does not boot from a %s disk, using %s" % (settings['interface'], default_interface))
+            settings['interface'] = default_interface
+        return cls(**settings)
+
+    def check(self, path):
+        """ Fall back to what works if the settings do not fit the file system
+            the image is on
+        """
+        direct = self.cache in ("none", "directsync")
+        if direct and filesystem_type(os.path.dirname(path) or ".") == "tmpfs":
+            self.logger.warning("%s is on tmpfs which does not support O_DIRECT, using cache=writeback" % path)
+            self.cache = "writeback"
+            direct = False
+        if self.aio == "native" and not direct:
+            self.logger.warning("aio=native needs cache=none or cache=directsync, using aio=threads")
+            self.aio = "threads"
+
+    def drive_options(self, path):
+        """ Tuning options for the -drive of the qcow2 image at path
+        """
+        self.check(path)
+        opts = []
+        if self.cache:
+            opts.append("cache=%s" % self.cache)
+        if self.aio:
+            opts.append("aio=%s" % self.aio)
+        if self.discard:
+            opts.extend(["discard=unmap", "detect-zeroes=unmap"])
+        if self.l2_cache_size:
+            opts.append("l2-cache-size=%s" % self.l2_cache_size)
+        if self.refcount_cache_size:
+            opts.append("refcount-cache-size=%s" % self.refcount_cache_size)
+        return opts
+
+    def qemu_args(self, path, drive_id="disk0"):
+        """ qemu arguments to attach the qcow2 image at path
+        """
+        opts = ["file=%s" % path]
+        tuning = self.drive_options(path)
+        if tuning:
+            # qcow2 options need the format driver to be known up front
+            opts.append("format=qcow2")
+            opts.extend(tuning)
+        opts = ",".join(opts)
+        if self.interface == "virtio-scsi":
+            return ["-device", "virtio-scsi-pci,id=scsi0",
+                    "-drive", "if=none,id=%s,%s" % (drive_id, opts),
+                    "-device", "scsi-hd,drive=%s,bus=scsi0.0" % drive_id]
+        return ["-drive", "if=%s,%s" % (self.interface, opts)]
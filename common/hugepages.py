@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+""" Guest RAM backed by hugepages
+
+    With 4 kB pages a guest with several GB of RAM needs far more TLB entries
+    than the CPU has, and every miss costs a page walk through both the guest
+    and the host page tables. Data plane VMs touching packet buffers all over
+    their memory forward noticeably more with guest RAM on 2 MB or 1 GB
+    hugepages.
+
+    Hugepages are reserved by the host (vm.nr_hugepages, or hugepages= on the
+    kernel command line for 1 GB pages) and shared by all containers, so
+    there may be fewer free than we need. We check before starting qemu and
+    fall back to normal memory if they do not suffice. qemu preallocates all
+    of guest RAM, so a VM losing the race for the last free pages to another
+    one fails at start (and falls back on the next one) instead of dying
+    from SIGBUS later on.
+
+    Hugepages are never swapped, merged by KSM or given back by a balloon,
+    they do not go together with density mode.
+"""
+
+import os
+import subprocess
+
+HUGEPAGES_DIR = "/sys/kernel/mm/hugepages"
+NODE_HUGEPAGES_DIR = "/sys/devices/system/node/node%d/hugepages"
+# where we mount hugetlbfs if the container has none
+MOUNT_DIR = "/dev/hugepages-%dkB"
+
+
+def parse_page_size(size):
+    """ Page size in kB of a size like 2M or 1G
+    """
+    size = size.strip().upper().rstrip("B")
+    units = {'K': 1, 'M': 1024, 'G': 1024 * 1024}
+    if size and size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def page_sizes():
+    """ Hugepage sizes in kB the host supports, largest first
+    """
+    try:
+        dirs = os.listdir(HUGEPAGES_DIR)
+    except OSError:
+        return []
+    return sorted((int(d[len("hugepages-"):-len("kB")]) for d in dirs
+                   if d.startswith("hugepages-") and d.endswith("kB")), reverse=True)
+
+
+def free_pages(page_size, node=None):
+    """ Hugepages of page_size kB nobody has allocated or reserved yet, on
+        NUMA node node or all of them
+    """
+    def read(directory, name):
+        with open(os.path.join(directory, "hugepages-%dkB" % page_size, name)) as f:
+            return int(f.read())
+    try:
+        free = read(HUGEPAGES_DIR, "free_hugepages") - read(HUGEPAGES_DIR, "resv_hugepages")
+        if node is not None:
+            # reservations are not accounted per node
+            free = min(free, read(NODE_HUGEPAGES_DIR % node, "free_hugepages"))
+        return free
+    except (OSError, ValueError):
+        return 0
+
+
+def default_page_size():
+    """ Size in kB of the hugepages of a hugetlbfs mounted without pagesize
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("Hugepagesize:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def mount_point(page_size):
+    """ A hugetlbfs mount with page_size kB pages, mounted by us if there is
+        none (needs --privileged), None if there is none and we cannot mount
+        it
+    """
+    default = default_page_size()
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4 or fields[2] != "hugetlbfs":
+                    continue
+                size = default
+                for opt in fields[3].split(","):
+                    if opt.startswith("pagesize="):
+                        size = parse_page_size(opt[len("pagesize="):])
+                if size == page_size:
+                    return fields[1]
+    except OSError:
+        return None
+
+    path = MOUNT_DIR % page_size
+    try:
+        os.makedirs(path, exist_ok=True)
+        subprocess.run(["mount", "-t", "hugetlbfs", "-o", "pagesize=%dK" % page_size, "none", path],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return path
+
+
+class Unavailable(Exception):
+    """ Hugepages for guest RAM cannot be had, the message says why
+    """
+
+
+def find(ram, size=None, node=None):
+    """ Find hugepages for ram MB of guest RAM, returns the page size in kB
+        and the hugetlbfs mount to use
+
+        size is the page size (like 2M or 1G), by default the largest the
+        host has enough free pages of, on NUMA node node if given. Raises
+        Unavailable otherwise.
+    """
+    sizes = page_sizes()
+    if not sizes:
+        raise Unavailable("the host has no hugepages")
+    if size is not None:
+        wanted = parse_page_size(size)
+        if wanted not in sizes:
+            raise Unavailable("the host has no %dkB hugepages" % wanted)
+        sizes = [wanted]
+
+    reasons = []
+    for page_size in sizes:
+        needed = -(-ram * 1024 // page_size)
+        free = free_pages(page_size, node)
+        if free < needed:
+            reasons.append("%d of %d %dkB hugepages free%s"
+                           % (free, needed, page_size, "" if node is None else " on node %d" % node))
+            continue
+        path = mount_point(page_size)
+        if path is None:
+            reasons.append("no hugetlbfs mounted for %dkB pages" % page_size)
+            continue
+        return page_size, path
+    raise Unavailable(", ".join(reasons))
+
+
+def memory_args(ram, path, node=None):
+    """ qemu arguments for ram MB of guest RAM on the hugetlbfs at path,
+        bound to NUMA node node if given
+
+        The backend is called pc.ram like the default one, so saved states
+        can be loaded with and without hugepages.
+    """
+    opts = "size=%dM,mem-path=%s,share=off,prealloc=on" % (ram, path)
+    if node is not None:
+        opts += ",host-nodes=%d,policy=bind" % node
+    return ["-object", "memory-backend-file,id=pc.ram," + opts, "-machine", "memory-backend=pc.ram"]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+""" Hot-plug data NICs of a VM when their link is connected
+
+    Normally qemu listens on port 10000+i for the link (vr-xcon) of data
+    NIC i, for every NIC the platform supports, whether it is used or not.
+    With NIC hot-plug we listen on those ports instead and the VM boots
+    without the NICs. When a link connects, the connection is handed to qemu
+    over QMP (getfd) and the NIC is added on top of it (netdev_add socket,fd
+    and device_add), at the same PCI address it would have had otherwise.
+"""
+
+import logging
+import socket
+
+import portfwd
+
+
+class NicListener:
+    """ Listen on the ports of data NICs nics and call plug(nic, conn) in
+        the default executor for every connection, plug owns conn
+    """
+    def __init__(self, loop, nics, plug, base_port=10000):
+        self.logger = logging.getLogger()
+        self.loop = loop
+        self.nics = list(nics)
+        self.plug = plug
+        self.base_port = base_port
+        self.sockets = {}
+
+    def start(self):
+        """ Start listening, ports that are in use are logged and skipped
+        """
+        self.loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        for nic in self.nics:
+            port = self.base_port + nic
+            try:
+                sock = portfwd.listen_socket(socket.SOCK_STREAM, port)
+            except OSError as exc:
+                self.logger.error("Unable to listen for the link of NIC %d on port %d: %s" % (nic, port, exc))
+                continue
+            self.sockets[nic] = sock
+            self.loop.add_reader(sock, self._accept, nic)
+        self.logger.info("Listening for links of hot-plug NICs %s" % ", ".join(str(n) for n in sorted(self.sockets)))
+
+    def _accept(self, nic):
+        try:
+            conn, addr = self.sockets[nic].accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self.logger.warning("Unable to accept link of NIC %d: %s" % (nic, exc))
+            return
+        self.logger.info("Link of NIC %d connected from %s" % (nic, addr[0]))
+        conn.setblocking(True)
+        self.loop.run_in_executor(None, self._plug, nic, conn)
+
+    def _plug(self, nic, conn):
+        try:
+            self.plug(nic, conn)
+        except Exception:
+            self.logger.exception("Unable to hot-plug NIC %d" % nic)
+            conn.close()
+
+    def close(self):
+        def _close():
+            for sock in self.sockets.values():
+                self.loop.remove_reader(sock)
+                sock.close()
+            self.sockets = {}
+        self.loop.call_soon_threadsafe(_close)
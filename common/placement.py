@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+""" Placement of VMs on host CPUs and NUMA nodes
+
+    By default the vCPU threads of every qemu float over all CPUs of the
+    host, so dozens of routers booting at once keep migrating between cores
+    and their memory ends up on whatever NUMA node the page was first
+    touched from. With CPU pinning each VM gets its own CPUs out of those the
+    container may use (its cpuset, narrowed down with VR_CPUS, a cpulist like
+    "8-15,40-47", or VR_NUMA_NODE), preferably all on one NUMA node:
+
+      * every vCPU thread is pinned to one of them, found through QMP
+      * the other qemu threads (main loop, I/O threads, workers) get the
+        rest, or share them with the vCPUs if there are not more CPUs than
+        vCPUs
+      * guest RAM is bound to the NUMA node of the CPUs on hosts with more
+        than one node
+
+    VR_CPUS and VR_NUMA_NODE are meant for an orchestrator partitioning the
+    host between containers. The VMs of one container share its CPUs, each
+    claims the least used ones.
+
+    Containers that all see the CPUs of the whole host have to know about
+    each other's claims, or they all pick the same lowest numbered CPUs.
+    They coordinate through a directory bind mounted into all of them
+    (CPU_CLAIMS_DIR), like the boot slots of admission.py: a VM holds an
+    exclusive flock on a file cpuN-K for every CPU N it claimed, K being the
+    first free one, so the use of a CPU is the number of its locked files and
+    claims go away with the process holding them. Without the directory and
+    without a placement hint, pinning is refused when the cpuset is the
+    whole host.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import threading
+
+NODE_DIR = "/sys/devices/system/node"
+CPU_ONLINE = "/sys/devices/system/cpu/online"
+
+
+def parse_cpulist(cpulist):
+    """ The CPUs of a cpulist like 0-3,8,10-11 as a set
+    """
+    cpus = set()
+    for part in cpulist.strip().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """ The shortest cpulist of the set cpus
+    """
+    res = []
+    for cpu in sorted(cpus):
+        if res and res[-1][1] == cpu - 1:
+            res[-1][1] = cpu
+        else:
+            res.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "%d-%d" % (a, b) for a, b in res)
+
+
+def numa_nodes():
+    """ The CPUs of every NUMA node of the host by node number
+    """
+    nodes = {}
+    try:
+        entries = os.listdir(NODE_DIR)
+    except OSError:
+        return nodes
+    for entry in entries:
+        m = re.match(r"node(\d+)$", entry)
+        if not m:
+            continue
+        try:
+            with open(os.path.join(NODE_DIR, entry, "cpulist")) as f:
+                nodes[int(m.group(1))] = parse_cpulist(f.read())
+        except (OSError, ValueError):
+            continue
+    return nodes
+
+
+def host_cpus():
+    """ The online CPUs of the host
+    """
+    try:
+        with open(CPU_ONLINE) as f:
+            return parse_cpulist(f.read())
+    except (OSError, ValueError):
+        return set(range(os.cpu_count() or 1))
+
+
+def smp_count(args):
+    """ The number of vCPUs of a qemu command line
+    """
+    count = 1
+    for i, arg in enumerate(args[:-1]):
+        if arg != "-smp":
+            continue
+        opts = {}
+        for opt in args[i + 1].split(","):
+            key, _, value = opt.partition("=")
+            if value:
+                opts[key] = value
+            elif key:
+                opts['cpus'] = key
+        if 'cpus' in opts:
+            count = int(opts['cpus'])
+        else:
+            count = 1
+            for key in ('sockets', 'dies', 'cores', 'threads'):
+                count *= int(opts.get(key, 1))
+    return count
+
+
+class Placement:
+    """ The CPUs VMs may be placed on, and how many VMs use each of them
+
+        With a directory, the use is that of all containers sharing it.
+    """
+    def __init__(self, cpus, nodes, directory=None):
+        self.logger = logging.getLogger()
+        self.cpus = set(cpus)
+        self.nodes = {node: node_cpus & self.cpus for node, node_cpus in nodes.items() if node_cpus & self.cpus}
+        self.use = {cpu: 0 for cpu in self.cpus}
+        self.lock = threading.Lock()
+        self.directory = directory
+        # the locked claim files, held until we exit
+        self.claim_fds = []
+
+    @classmethod
+    def from_env(cls):
+        """ Placement on the CPUs of our cpuset, narrowed down by VR_CPUS and
+            VR_NUMA_NODE, claims shared through CPU_CLAIMS_DIR if it exists
+
+            Returns None if there is nothing to tell our CPUs from those of
+            the other containers on the host.
+        """
+        logger = logging.getLogger()
+        cpus = os.sched_getaffinity(0)
+        nodes = numa_nodes()
+        directory = os.getenv("CPU_CLAIMS_DIR", "/cpu-claims")
+        if not os.path.isdir(directory):
+            if not os.getenv("VR_CPUS") and not os.getenv("VR_NUMA_NODE") and cpus >= host_cpus():
+                logger.warning("Not pinning CPUs: our cpuset is the whole host and without VR_CPUS, VR_NUMA_NODE"
+                               " or a shared CPU_CLAIMS_DIR every container would pin to the same CPUs")
+                return None
+            directory = None
+        if os.getenv("VR_CPUS"):
+            wanted = parse_cpulist(os.getenv("VR_CPUS"))
+            if wanted & cpus:
+                cpus = cpus & wanted
+            else:
+                logger.warning("None of VR_CPUS %s are in our cpuset %s, ignoring it"
+                               % (os.getenv("VR_CPUS"), format_cpulist(cpus)))
+        if os.getenv("VR_NUMA_NODE"):
+            node = int(os.getenv("VR_NUMA_NODE"))
+            if nodes.get(node, set()) & cpus:
+                cpus = cpus & nodes[node]
+            else:
+                logger.warning("None of our CPUs are on NUMA node %d, ignoring VR_NUMA_NODE" % node)
+        return cls(cpus, nodes, directory)
+
+    def claim(self, count):
+        """ CPUs for a VM with count vCPUs, the least used ones and all on the
+            same NUMA node if that works out
+
+            With fewer CPUs than needed all of them are returned.
+        """
+        with self.lock:
+            if self.directory is None:
+                return self._claim(count, self.use)
+            # one container at a time, so no two pick the same free CPUs
+            fd = os.open(os.path.join(self.directory, "lock"), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                chosen = self._claim(count, self._host_use())
+                for cpu in chosen:
+                    self.claim_fds.append(self._lock_claim(cpu))
+                return chosen
+            finally:
+                os.close(fd)
+
+    def _claim(self, count, use):
+        if count >= len(self.cpus):
+            chosen = set(self.cpus)
+        else:
+            def node_score(node):
+                # the node with most CPUs of the lowest use
+                cpus = self.nodes[node]
+                low = min(use[c] for c in cpus)
+                return low, -sum(1 for c in cpus if use[c] == low), node
+            node = min(self.nodes, key=node_score) if self.nodes else None
+            local = self.nodes.get(node, set())
+            chosen = set(sorted(self.cpus, key=lambda c: (use[c], c not in local, c))[:count])
+        for cpu in chosen:
+            self.use[cpu] += 1
+        return chosen
+
+    def _host_use(self):
+        """ The number of VMs on the host using each of our CPUs, from the
+            locked claim files
+        """
+        use = {cpu: 0 for cpu in self.cpus}
+        for name in os.listdir(self.directory):
+            m = re.match(r"cpu(\d+)-\d+$", name)
+            if not m or int(m.group(1)) not in use:
+                continue
+            try:
+                fd = os.open(os.path.join(self.directory, name), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                use[int(m.group(1))] += 1
+            finally:
+                os.close(fd)
+        return use
+
+    def _lock_claim(self, cpu):
+        """ Lock the first free claim file of cpu, returns its fd
+        """
+        i = 0
+        while True:
+            fd = os.open(os.path.join(self.directory, "cpu%d-%d" % (cpu, i)), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+                i += 1
+
+    def node_of(self, cpus):
+        """ The NUMA node most of cpus are on, None on hosts with a single
+            node
+        """
+        if len(self.nodes) < 2:
+            return None
+        return max(self.nodes, key=lambda node: len(self.nodes[node] & set(cpus)))
+
+
+_placement = None
+_placement_done = False
+_placement_lock = threading.Lock()
+
+
+def placement():
+    """ The Placement shared by all VMs of the container, None if VMs are
+        not to be pinned
+    """
+    global _placement, _placement_done
+    with _placement_lock:
+        if not _placement_done:
+            _placement = Placement.from_env()
+            _placement_done = True
+        return _placement
+
+
+def pin(pid, vcpu_threads, cpus):
+    """ Pin the vCPU threads of qemu process pid to one CPU of cpus each,
+        and its other threads to the remaining ones
+
+        Returns the CPU of every vCPU thread.
+    """
+    cpus = sorted(cpus)
+    if len(cpus) > len(vcpu_threads):
+        vcpu_cpus = cpus[len(cpus) - len(vcpu_threads):]
+        other_cpus = cpus[:len(cpus) - len(vcpu_threads)]
+    else:
+        vcpu_cpus = other_cpus = cpus
+    for tid in os.listdir("/proc/%d/task" % pid):
+        if int(tid) not in vcpu_threads:
+            try:
+                os.sched_setaffinity(int(tid), other_cpus)
+            except OSError:
+                # exited in the meantime
+                pass
+    res = {}
+    for i, tid in enumerate(vcpu_threads):
+        cpu = vcpu_cpus[i % len(vcpu_cpus)]
+        os.sched_setaffinity(tid, {cpu})
+        res[tid] = cpu
+    return res
+
+
+def memory_args(ram, node):
+    """ qemu arguments for ram MB of guest RAM bound to NUMA node node
+    """
+    return ["-object", "memory-backend-ram,id=pc.ram,size=%dM,host-nodes=%d,policy=bind" % (ram, node),
+            "-machine", "memory-backend=pc.ram"]
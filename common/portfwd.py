@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+""" In-process TCP and UDP port forwarding
+
+    Forwards the management ports of the container (HOST_FWDS) to the qemu
+    user mode networking host forwards of the virtual router. This used to be
+    done with one "socat ... fork" process per port, which forks for every
+    TCP connection and every UDP peer. Here all ports are served by a single
+    asyncio event loop.
+
+    Every forwarded port keeps counters of connections (UDP: sessions, one
+    per peer address), bytes in each direction and failures, see stats().
+"""
+
+import asyncio
+import logging
+import socket
+import time
+
+# UDP sessions without traffic for this long are forgotten
+UDP_IDLE_TIMEOUT = 120
+# how much to read from a socket at a time
+READ_SIZE = 65536
+
+
+class Counters:
+    def __init__(self):
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        # bytes from the outside to the virtual router and back
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def listen_socket(sock_type, port):
+    """ Create a socket listening on port for both IPv4 and IPv6
+
+        Same as socat TCP6-LISTEN / UDP6-LISTEN, falls back to IPv4 only if
+        IPv6 is not available in the container.
+    """
+    try:
+        sock = socket.socket(socket.AF_INET6, sock_type)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        addr = ("::", port)
+    except OSError:
+        sock = socket.socket(socket.AF_INET, sock_type)
+        addr = ("0.0.0.0", port)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(addr)
+        if sock_type == socket.SOCK_STREAM:
+            sock.listen(128)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class TCPForward:
+    def __init__(self, listen_port, dst_host, dst_port):
+        self.logger = logging.getLogger()
+        self.listen_port = listen_port
+        self.dst_host = dst_host
+        self.dst_port = dst_port
+        self.counters = Counters()
+        self.server = None
+        # the event loop only keeps weak references to tasks
+        self.tasks = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, sock=listen_socket(socket.SOCK_STREAM, self.listen_port))
+
+    async def handle(self, client_reader, client_writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            await self.forward(client_reader, client_writer)
+        finally:
+            self.tasks.discard(task)
+
+    async def forward(self, client_reader, client_writer):
+        self.counters.connections += 1
+        try:
+            dst_reader, dst_writer = await asyncio.open_connection(self.dst_host, self.dst_port)
+        except OSError as exc:
+            self.counters.failed += 1
+            self.logger.debug("tcp/%d: unable to connect to %s:%d: %s" % (self.listen_port, self.dst_host, self.dst_port, exc))
+            client_writer.close()
+            return
+
+        self.counters.active += 1
+        try:
+            await asyncio.gather(self.pipe(client_reader, dst_writer, inbound=True),
+                                 self.pipe(dst_reader, client_writer, inbound=False))
+        finally:
+            self.counters.active -= 1
+            client_writer.close()
+            dst_writer.close()
+
+    async def pipe(self, reader, writer, inbound):
+        """ Copy data until EOF, which is passed on as a half close
+        """
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                if inbound:
+                    self.counters.bytes_in += len(data)
+                else:
+                    self.counters.bytes_out += len(data)
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            # connection reset, the other direction will notice as well
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+class UDPSession(asyncio.DatagramProtocol):
+    """ Datagrams from one outside peer, sent from our own socket so that
+        replies from the virtual router can be told apart
+    """
+    def __init__(self, forward, peer):
+        self.forward = forward
+        self.peer = peer
+        self.transport = None
+        # datagrams received before the session socket was set up
+        self.pending = []
+        self.last_used = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.last_used = time.monotonic()
+        self.forward.counters.bytes_out += len(data)
+        self.forward.transport.sendto(data, self.peer)
+
+    def error_received(self, exc):
+        # nothing listening on the other end (yet), like socat we carry on
+        self.forward.counters.failed += 1
+
+
+class UDPForward(asyncio.DatagramProtocol):
+    def __init__(self, listen_port, dst_host, dst_port, idle_timeout=UDP_IDLE_TIMEOUT):
+        self.logger = logging.getLogger()
+        self.listen_port = listen_port
+        self.dst_host = dst_host
+        self.dst_port = dst_port
+        self.idle_timeout = idle_timeout
+        self.counters = Counters()
+        self.transport = None
+        self.sessions = {}
+        self.tasks = set()
+        self.loop = None
+        self.expire_handle = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, sock=listen_socket(socket.SOCK_DGRAM, self.listen_port))
+        self.expire_handle = self.loop.call_later(self.idle_timeout / 4, self.expire)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.counters.bytes_in += len(data)
+        session = self.sessions.get(addr)
+        if session is None:
+            session = UDPSession(self, addr)
+            self.sessions[addr] = session
+            self.counters.connections += 1
+            self.counters.active += 1
+            session.pending.append(data)
+            task = asyncio.ensure_future(self.connect(session))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+        session.last_used = time.monotonic()
+        if session.transport is None:
+            session.pending.append(data)
+        else:
+            session.transport.sendto(data)
+
+    async def connect(self, session):
+        try:
+            await self.loop.create_datagram_endpoint(lambda: session, remote_addr=(self.dst_host, self.dst_port))
+        except OSError as exc:
+            self.counters.failed += 1
+            self.logger.debug("udp/%d: unable to connect to %s:%d: %s" % (self.listen_port, self.dst_host, self.dst_port, exc))
+            self.drop(session)
+            return
+        for data in session.pending:
+            session.transport.sendto(data)
+        session.pending = []
+
+    def drop(self, session):
+        if self.sessions.pop(session.peer, None) is not None:
+            self.counters.active -= 1
+        if session.transport is not None:
+            session.transport.close()
+
+    def expire(self):
+        """ Forget sessions that have been idle for too long
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        for session in [s for s in self.sessions.values() if s.last_used < deadline]:
+            self.drop(session)
+        self.expire_handle = self.loop.call_later(self.idle_timeout / 4, self.expire)
+
+    def close(self):
+        if self.expire_handle is not None:
+            self.expire_handle.cancel()
+        for session in list(self.sessions.values()):
+            self.drop(session)
+        if self.transport is not None:
+            self.transport.close()
+
+
+class PortForwarder:
+    """ Forward a set of ports on an asyncio event loop running in another
+        thread, all methods are to be called from outside of the loop
+    """
+    def __init__(self, loop):
+        self.logger = logging.getLogger()
+        self.loop = loop
+        self.forwards = {}
+
+    def add(self, proto, listen_port, dst_host, dst_port):
+        """ Start forwarding proto ("tcp" or "udp") listen_port to dst_host:dst_port
+
+            Returns False if the port could not be forwarded.
+        """
+        cls = TCPForward if proto == 'tcp' else UDPForward
+        forward = cls(listen_port, dst_host, dst_port)
+        try:
+            asyncio.run_coroutine_threadsafe(forward.start(), self.loop).result()
+        except OSError as exc:
+            self.logger.error("Unable to forward %s/%d to %s:%d: %s" % (proto, listen_port, dst_host, dst_port, exc))
+            return False
+        self.logger.debug("Forwarding %s/%d to %s:%d" % (proto, listen_port, dst_host, dst_port))
+        self.forwards["%s/%d" % (proto, listen_port)] = forward
+        return True
+
+    def stats(self):
+        """ Counters of all forwarded ports, keyed by "<proto>/<port>"
+        """
+        return {name: dict(forward.counters.as_dict(), destination="%s:%d" % (forward.dst_host, forward.dst_port))
+                for name, forward in self.forwards.items()}
+
+    def close(self):
+        for forward in self.forwards.values():
+            self.loop.call_soon_threadsafe(forward.close)
+        self.forwards = {}
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+""" Prewarm the page cache with the base image of a VM
+
+    A booting NOS reads its base image mostly at random, and every read that
+    misses the page cache stalls the guest. Reading the parts it is going to
+    need in the background while qemu starts up, in file order, turns those
+    random reads into a fast sequential one.
+
+    Which parts are needed is learnt from a previous boot: once the VM is
+    running, the pages of the base image in the page cache (mincore) that
+    were not there when it started make up the access profile of the image,
+    which is stored in PREWARM_DIR. The boot that records it reads nothing
+    ahead, anything read for it would end up in the profile. Without a
+    profile the start of the image can be read sequentially instead, up to
+    PREWARM_SEQUENTIAL_MB, but then no profile is recorded.
+
+    Profiles are only recorded from a cold page cache, if most of the image
+    was cached already (another container using the same image on the host)
+    we cannot tell what the boot read.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+# how much to read at a time
+READ_SIZE = 1024 * 1024
+# extents in the profile closer than this are merged, reading a little more
+# is cheaper than another seek
+MERGE_GAP = 256 * 1024
+# don't record a profile if more than this part of the image was cached
+# before the VM started
+COLD_THRESHOLD = 0.1
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _libc.mmap.restype = ctypes.c_void_p
+        _libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+                               ctypes.c_int, ctypes.c_long]
+        _libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+    return _libc
+
+
+def residency(path):
+    """ Which pages of the file at path are in the page cache, as bytes with
+        one byte per page, the lowest bit set if the page is cached
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return b""
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vec = ctypes.create_string_buffer(pages)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        addr = libc().mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), "mmap of %s failed" % path)
+        try:
+            if libc().mincore(addr, size, vec) != 0:
+                raise OSError(ctypes.get_errno(), "mincore of %s failed" % path)
+        finally:
+            libc().munmap(addr, size)
+    finally:
+        os.close(fd)
+    return vec.raw
+
+
+def cached_fraction(vec):
+    if not vec:
+        return 0.0
+    # the other bits of the mincore() vector are reserved and always zero
+    return (len(vec) - vec.count(0)) / len(vec)
+
+
+def extents(vec, exclude=None):
+    """ Merged (offset, length) extents of the cached pages in vec, leaving
+        out the pages that are also cached in exclude
+    """
+    res = []
+    gap_pages = MERGE_GAP // mmap.PAGESIZE
+    start = last = None
+    for page, b in enumerate(vec):
+        if not b & 1 or (exclude is not None and exclude[page] & 1):
+            continue
+        if start is not None and page - last <= gap_pages:
+            last = page
+            continue
+        if start is not None:
+            res.append((start * mmap.PAGESIZE, (last - start + 1) * mmap.PAGESIZE))
+        start = last = page
+    if start is not None:
+        res.append((start * mmap.PAGESIZE, (last - start + 1) * mmap.PAGESIZE))
+    return res
+
+
+def read_extents(path, extent_list):
+    """ Read extents of the file at path into the page cache, returns the
+        number of bytes read
+    """
+    total = 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # let the kernel start on all of it while we go through it in order
+        for offset, length in extent_list:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        for offset, length in extent_list:
+            end = offset + length
+            while offset < end:
+                data = os.pread(fd, min(READ_SIZE, end - offset), offset)
+                if not data:
+                    break
+                offset += len(data)
+                total += len(data)
+    finally:
+        os.close(fd)
+    return total
+
+
+class Prewarmer:
+    """ Prewarm the page cache with the image at path in a background thread
+        and record its access profile once the VM is running
+    """
+    def __init__(self, path, profile_dir, sequential_mb=0, record=False, done=None):
+        self.logger = logging.getLogger()
+        self.path = path
+        self.profile_dir = profile_dir
+        self.sequential = sequential_mb * 1024 * 1024
+        # record a new profile even if there is one
+        self.record_new = record
+        # called with the stats once prewarming is done
+        self.done = done
+        self.stat = os.stat(path)
+        self.before = None
+        self.mode = None
+        self.stats = {}
+        self.thread = None
+
+    @property
+    def profile_file(self):
+        return os.path.join(self.profile_dir, "%s-%d.json" % (os.path.basename(self.path), self.stat.st_size))
+
+    def load_profile(self):
+        try:
+            with open(self.profile_file) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if profile.get('size') != self.stat.st_size or profile.get('mtime') != int(self.stat.st_mtime):
+            self.logger.info("Prewarm profile %s is for another image, ignoring it" % self.profile_file)
+            return None
+        return profile
+
+    def start(self):
+        """ Start prewarming, to be called right before qemu is started
+        """
+        try:
+            self.before = residency(self.path)
+        except OSError as exc:
+            self.logger.warning("Unable to check page cache residency of %s: %s" % (self.path, exc))
+            self.before = None
+        self.thread = threading.Thread(target=self.run, name="prewarm %s" % os.path.basename(self.path), daemon=True)
+        self.thread.start()
+
+    def run(self):
+        start = time.monotonic()
+        profile = None if self.record_new else self.load_profile()
+        if profile is not None:
+            self.mode = "profile"
+            extent_list = [tuple(e) for e in profile['extents']]
+        elif self.sequential:
+            self.mode = "sequential"
+            extent_list = [(0, min(self.sequential, self.stat.st_size))]
+        else:
+            # the boot reads on its own and we record what it read
+            self.mode = "record"
+            extent_list = []
+        try:
+            read = read_extents(self.path, extent_list)
+        except OSError as exc:
+            self.logger.warning("Prewarming %s failed: %s" % (self.path, exc))
+            return
+        self.stats = {
+            'mode': self.mode,
+            'bytes': read,
+            'seconds': round(time.monotonic() - start, 3),
+            'cached_before': round(cached_fraction(self.before), 3) if self.before is not None else None,
+        }
+        if self.mode == "record":
+            self.logger.info("No prewarm profile for %s, recording what the boot reads" % self.path)
+        else:
+            self.logger.info("Prewarmed %d MB of %s (%s) in %.1fs, %.0f%% was cached before" % (
+                read // 2**20, self.path, self.mode, self.stats['seconds'], 100 * (self.stats['cached_before'] or 0)))
+        if self.done is not None:
+            self.done(self.stats)
+
+    def record(self):
+        """ Record what the boot read as the access profile of the image
+
+            Only done if nothing was read ahead for the boot, a boot
+            prewarmed from a profile or sequentially reads all of that.
+        """
+        if self.before is None or self.mode != "record":
+            return
+        if cached_fraction(self.before) > COLD_THRESHOLD:
+            self.logger.debug("Not recording prewarm profile, the page cache was not cold")
+            return
+        try:
+            extent_list = extents(residency(self.path), exclude=self.before)
+            os.makedirs(self.profile_dir, exist_ok=True)
+            tmp_file = self.profile_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump({'image': os.path.basename(self.path), 'size': self.stat.st_size,
+                           'mtime': int(self.stat.st_mtime), 'extents': extent_list}, f)
+            os.rename(tmp_file, self.profile_file)
+        except OSError as exc:
+            self.logger.warning("Unable to record prewarm profile of %s: %s" % (self.path, exc))
+            return
+        self.logger.info("Recorded prewarm profile %s, %d MB in %d extents" % (
+            self.profile_file, sum(length for _, length in extent_list) // 2**20, len(extent_list)))
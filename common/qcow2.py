@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+""" Read and write qcow2 image headers without qemu-img
+
+    Creating the overlay disk image of a VM took two qemu-img runs on every
+    start, one to find the format of the base image and one to create the
+    overlay, and some platforms run a few more for their data disks. An
+    empty qcow2 image is nothing more than a header, a refcount table, one
+    refcount block and an empty L1 table, so we write those ourselves.
+
+    The images written are qcow2 version 3 with 64k clusters and 16 bit
+    refcounts, like qemu-img creates them by default, see
+    docs/interop/qcow2.txt in the qemu source. Base image formats we cannot
+    find the size of ourselves are left to qemu-img.
+
+    Writing images ourselves is off unless QCOW2_NATIVE=1, until the images
+    have been checked with qemu-img check and booted from by qemu, see
+    benchmark/qcow2_check.py. By default create() runs qemu-img.
+"""
+
+import functools
+import logging
+import math
+import os
+import struct
+import subprocess
+
+QCOW_MAGIC = b"QFI\xfb"
+QCOW2_VERSION = 3
+HEADER_LENGTH = 104
+# 64k, the qemu default
+CLUSTER_BITS = 16
+# 16 bit refcounts, the qemu default
+REFCOUNT_ORDER = 4
+
+EXT_END = 0x00000000
+EXT_BACKING_FORMAT = 0xE2792ACA
+
+# magic at the start of the image files of other formats we recognise
+MAGICS = (
+    (b"QED\x00", "qed"),
+    (b"KDMV", "vmdk"),
+    (b"# Disk DescriptorFile", "vmdk"),
+    (b"vhdxfile", "vhdx"),
+    (b"conectix", "vpc"),
+)
+# vdi has its signature after a text header
+VDI_SIGNATURE_OFFSET = 64
+VDI_SIGNATURE = struct.pack("<I", 0xbeda107f)
+
+# magic, version, backing_file_offset, backing_file_size, cluster_bits, size,
+# crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters, nb_snapshots, snapshots_offset
+HEADER_V2 = struct.Struct(">4sIQIIQIIQQIIQ")
+# incompatible_features, compatible_features, autoclear_features,
+# refcount_order, header_length
+HEADER_V3 = struct.Struct(">QQQII")
+
+SIZE_SUFFIXES = {"": 1, "b": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+
+
+class Header:
+    """ The parts of an image header we care about
+    """
+    def __init__(self, format, size, version=None, cluster_bits=None, backing_file=None):
+        self.format = format
+        self.size = size
+        self.version = version
+        self.cluster_bits = cluster_bits
+        self.backing_file = backing_file
+
+    def __repr__(self):
+        return "Header(format=%s, size=%s, version=%s, backing_file=%s)" % (
+            self.format, self.size, self.version, self.backing_file)
+
+
+def parse_size(size):
+    """ Size in bytes of size, an int or a string like "40G" as qemu-img
+        takes it
+    """
+    if isinstance(size, int):
+        return size
+    size = size.strip().lower()
+    suffix = size[-1:] if size[-1:] in SIZE_SUFFIXES else ""
+    try:
+        return int(float(size[:len(size) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+    except ValueError:
+        raise ValueError("invalid image size %s" % size) from None
+
+
+def _read_header(f):
+    data = f.read(512)
+    if data[:4] == QCOW_MAGIC and len(data) >= HEADER_V2.size:
+        fields = HEADER_V2.unpack_from(data)
+        version = fields[1]
+        if version == 1:
+            # qcow version 1 keeps the size at the same offset, but has no
+            # cluster_bits where version 2 has it
+            size = struct.unpack_from(">Q", data, 24)[0]
+            return Header("qcow", size, version)
+        backing_file = None
+        if fields[2] and fields[3]:
+            f.seek(fields[2])
+            backing_file = f.read(fields[3]).decode(errors="replace")
+        return Header("qcow2", fields[5], version, fields[4], backing_file)
+    for magic, format in MAGICS:
+        if data.startswith(magic):
+            size = None
+            if magic == b"KDMV" and len(data) >= 20:
+                # sparse extent header, capacity in sectors
+                size = struct.unpack_from("<Q", data, 12)[0] * 512
+            return Header(format, size)
+    if data[VDI_SIGNATURE_OFFSET:VDI_SIGNATURE_OFFSET + 4] == VDI_SIGNATURE:
+        return Header("vdi", None)
+    # what qemu-img falls back to as well
+    return Header("raw", os.fstat(f.fileno()).st_size)
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_header(path, mtime_ns, size):
+    with open(path, "rb") as f:
+        return _read_header(f)
+
+
+def header(path):
+    """ Header of the image at path
+
+        Cached until the file changes, base images are looked at on every
+        start of a VM but never change.
+    """
+    st = os.stat(path)
+    return _cached_header(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def image_format(path):
+    """ Format of the image at path, like "qcow2" or "raw"
+    """
+    return header(path).format
+
+
+def virtual_size(path):
+    """ Size of the disk in the image at path in bytes, None if unknown
+    """
+    return header(path).size
+
+
+def _header_extension(ext_type, data=b""):
+    padding = -len(data) % 8
+    return struct.pack(">II", ext_type, len(data)) + data + b"\x00" * padding
+
+
+def qcow2_image(size, backing_file=None, backing_format=None, cluster_bits=CLUSTER_BITS):
+    """ The contents of an empty qcow2 image of size bytes, as bytes
+
+        Layout, one cluster each: header, refcount table, refcount block and
+        the L1 table, which may take more clusters for very large images.
+    """
+    cluster_size = 1 << cluster_bits
+    # qemu works in 512 byte sectors
+    size = (size + 511) // 512 * 512
+    # every L2 table maps cluster_size / 8 clusters
+    l1_size = max(1, math.ceil(size / (cluster_size * (cluster_size // 8))))
+    l1_clusters = math.ceil(l1_size * 8 / cluster_size)
+    refcount_table_offset = cluster_size
+    refcount_block_offset = 2 * cluster_size
+    l1_table_offset = 3 * cluster_size
+    clusters = 3 + l1_clusters
+    refcounts_per_block = cluster_size * 8 // (1 << REFCOUNT_ORDER)
+    if clusters > refcounts_per_block:
+        raise ValueError("image size %d too large" % size)
+
+    extensions = b""
+    if backing_format:
+        extensions += _header_extension(EXT_BACKING_FORMAT, backing_format.encode())
+    extensions += _header_extension(EXT_END)
+    backing = backing_file.encode() if backing_file else b""
+    backing_file_offset = HEADER_LENGTH + len(extensions) if backing else 0
+    if HEADER_LENGTH + len(extensions) + len(backing) > cluster_size:
+        raise ValueError("backing file name %s too long" % backing_file)
+
+    hdr = HEADER_V2.pack(QCOW_MAGIC, QCOW2_VERSION, backing_file_offset, len(backing), cluster_bits,
+                         size, 0, l1_size, l1_table_offset, refcount_table_offset, 1, 0, 0)
+    hdr += HEADER_V3.pack(0, 0, 0, REFCOUNT_ORDER, HEADER_LENGTH)
+    cluster0 = hdr + extensions + backing
+
+    image = bytearray(clusters * cluster_size)
+    image[:len(cluster0)] = cluster0
+    struct.pack_into(">Q", image, refcount_table_offset, refcount_block_offset)
+    # all clusters of the image are in use once
+    struct.pack_into(">%dH" % clusters, image, refcount_block_offset, *([1] * clusters))
+    return bytes(image)
+
+
+def _qemu_img_create(path, size, backing_file, backing_format):
+    cmd = ["qemu-img", "create", "-q", "-f", "qcow2"]
+    if backing_file:
+        cmd += ["-b", backing_file]
+        if backing_format:
+            cmd += ["-F", backing_format]
+    cmd.append(path)
+    if size is not None:
+        cmd.append(str(size))
+    subprocess.run(cmd, check=True)
+
+
+def native():
+    """ Whether create() writes images itself rather than with qemu-img
+    """
+    return os.getenv("QCOW2_NATIVE", "0").lower() in ("1", "true", "yes")
+
+
+def create(path, size=None, backing_file=None, backing_format=None, native_write=None):
+    """ Create an empty qcow2 image at path, like qemu-img create -f qcow2
+
+        size is in bytes or a string like "40G" and defaults to the size of
+        the backing file, backing_format to its format. The image is written
+        by qemu-img unless native_write, which defaults to native(), is set.
+    """
+    logger = logging.getLogger()
+    if native_write is None:
+        native_write = native()
+    if backing_file:
+        # a relative backing file is relative to the image, not to us
+        backing_path = os.path.join(os.path.dirname(path), backing_file)
+        if backing_format is None:
+            backing_format = image_format(backing_path)
+        if size is None:
+            hdr = header(backing_path)
+            if hdr.format != backing_format or hdr.size is None:
+                logger.info("Unable to tell the size of %s image %s, using qemu-img"
+                            % (backing_format, backing_file))
+                _qemu_img_create(path, None, backing_file, backing_format)
+                return
+            size = hdr.size
+    if not native_write:
+        _qemu_img_create(path, size, backing_file, backing_format)
+        return
+    if size is None:
+        raise ValueError("size of %s must be given without a backing file" % path)
+    data = qcow2_image(parse_size(size), backing_file, backing_format)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.rename(tmp_path, path)
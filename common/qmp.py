@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+""" Client for the QEMU Machine Protocol (QMP)
+
+    QMP is the JSON flavour of the qemu monitor. Unlike the human monitor it
+    has structured replies and errors, tells us about state changes of the
+    VM through events, and over a unix socket it can pass file descriptors
+    to qemu along with a command (getfd).
+
+    The connection is handled on the shared asyncio event loop: commands are
+    sent as soon as they are issued and matched to their reply by id, events
+    are handed to listeners as they arrive. The synchronous methods are for
+    the VM threads and must not be called from the event loop itself.
+"""
+
+import array
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import socket
+
+# events kept until someone waits for them
+MAX_EVENTS = 100
+
+# keys that are not called what they type, see QKeyCode in the qemu QAPI
+# schema
+QCODES = {
+    ' ': 'spc', '-': 'minus', '=': 'equal', '[': 'bracket_left', ']': 'bracket_right',
+    ';': 'semicolon', "'": 'apostrophe', '`': 'grave_accent', '\\': 'backslash',
+    ',': 'comma', '.': 'dot', '/': 'slash', '\n': 'ret', '\t': 'tab',
+}
+# characters typed with shift and the key they are on (US layout)
+SHIFTED = dict(zip('~!@#$%^&*()_+{}:"|<>?', "`1234567890-=[];'\\,./"))
+
+
+class QMPError(Exception):
+    """ qemu returned an error for a QMP command
+    """
+    def __init__(self, command, error):
+        self.command = command
+        self.error_class = error.get('class')
+        self.desc = error.get('desc')
+        super().__init__("%s: %s" % (command, self.desc))
+
+
+def key_combos(text, key_map=None):
+    """ The key combinations, lists of qcodes, typing text
+
+        key_map maps characters to a qcode or a list of qcodes pressed
+        together, like {'\\x04': ["ctrl", "d"]}, before the default mapping.
+    """
+    res = []
+    for c in text:
+        if key_map and c in key_map:
+            combo = key_map[c]
+            res.append([combo] if isinstance(combo, str) else list(combo))
+        elif c in SHIFTED:
+            res.append(["shift", QCODES.get(SHIFTED[c], SHIFTED[c])])
+        elif c.isupper():
+            res.append(["shift", c.lower()])
+        else:
+            res.append([QCODES.get(c, c)])
+    return res
+
+
+def key_events(combo):
+    """ input-send-event events pressing and releasing combo
+    """
+    def event(key, down):
+        return {'type': "key", 'data': {'down': down, 'key': {'type': "qcode", 'data': key}}}
+    return [event(k, True) for k in combo] + [event(k, False) for k in reversed(combo)]
+
+
+class QMP:
+    """ Connection to the QMP socket of a qemu at path
+    """
+    def __init__(self, path, loop, timeout=10):
+        self.logger = logging.getLogger()
+        self.path = path
+        self.loop = loop
+        self.timeout = timeout
+        self.sock = None
+        self.buf = b""
+        self.greeting = None
+        self.reader = None
+        self.closed = None
+        self.next_id = 0
+        # futures waiting for the reply to a command by id
+        self.pending = {}
+        # events nobody waited for yet, and the futures of wait_event() calls
+        # as (name, data, future)
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self.waiters = []
+        # called with every event on the event loop
+        self.listeners = []
+
+    def _run(self, coro, timeout):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError("no reply from qemu on QMP within %ss" % timeout) from None
+
+    def connect(self):
+        """ Connect and leave capabilities negotiation mode
+        """
+        self._run(self._connect(), self.timeout)
+
+    async def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await self.loop.sock_connect(sock, self.path)
+            self.sock = sock
+            self.greeting = (await self._read_message()).get('QMP')
+        except BaseException:
+            sock.close()
+            self.sock = None
+            raise
+        self.closed = None
+        self.reader = self.loop.create_task(self._read_loop())
+        await self.execute("qmp_capabilities")
+
+    async def _read_message(self):
+        while b"\n" not in self.buf:
+            data = await self.loop.sock_recv(self.sock, 65536)
+            if not data:
+                raise EOFError("qemu closed the QMP connection")
+            self.buf += data
+        line, self.buf = self.buf.split(b"\n", 1)
+        return json.loads(line)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                msg = await self._read_message()
+                if 'event' in msg:
+                    self._dispatch(msg)
+                    continue
+                future = self.pending.pop(msg.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(msg)
+        except asyncio.CancelledError:
+            self.closed = EOFError("QMP connection closed")
+        except (OSError, EOFError, ValueError) as exc:
+            self.closed = exc if isinstance(exc, EOFError) else EOFError("QMP connection failed: %s" % exc)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(self.closed)
+        self.pending = {}
+
+    def _dispatch(self, event):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                self.logger.exception("QMP event listener failed")
+        for waiter in self.waiters:
+            name, data, future = waiter
+            if not future.done() and self._matches(event, name, data):
+                future.set_result(event)
+                self.waiters.remove(waiter)
+                return
+        self.events.append(event)
+
+    @staticmethod
+    def _matches(event, name, data):
+        return (event['event'] == name
+                and all(event.get('data', {}).get(k) == v for k, v in (data or {}).items()))
+
+    async def execute(self, name, args=None, fd=None):
+        """ Run command name with args (a dict), see command()
+        """
+        if self.sock is None or self.closed is not None:
+            raise self.closed or EOFError("not connected to QMP")
+        self.next_id += 1
+        msg = {'execute': name, 'id': self.next_id}
+        if args:
+            msg['arguments'] = args
+        self.logger.debug("QMP command: %s" % msg)
+        future = self.loop.create_future()
+        self.pending[msg['id']] = future
+        data = json.dumps(msg).encode() + b"\n"
+        try:
+            if fd is not None:
+                # a command is tiny, it fits in the socket buffer
+                self.sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [fd]))])
+            else:
+                await self.loop.sock_sendall(self.sock, data)
+            resp = await future
+        finally:
+            self.pending.pop(msg['id'], None)
+        if 'error' in resp:
+            raise QMPError(name, resp['error'])
+        return resp.get('return')
+
+    def command(self, name, args=None, fd=None, timeout=None):
+        """ Run command name with args (a dict) and return what it returned
+
+            fd is a file descriptor to pass along with the command, like for
+            getfd. Raises QMPError if qemu returned an error, EOFError if the
+            connection is gone and TimeoutError if qemu did not reply.
+        """
+        return self._run(self.execute(name, args, fd), timeout or self.timeout)
+
+    async def execute_batch(self, commands):
+        """ Run the (name, args) commands back to back without waiting for
+            each reply, returns the replies with the exception in place of
+            a command that failed
+        """
+        return await asyncio.gather(*(self.execute(name, args) for name, args in commands),
+                                    return_exceptions=True)
+
+    def batch(self, commands, timeout=None):
+        return self._run(self.execute_batch(commands), timeout or self.timeout)
+
+    def wait_event(self, name, timeout=10, data=None):
+        """ Wait for event name whose data includes data (a dict)
+
+            An event that arrived since the last wait for it counts as well.
+            Returns the event or None on timeout.
+        """
+        try:
+            return self._run(self._wait_event(name, timeout, data), timeout + 1)
+        except TimeoutError:
+            return None
+
+    async def _wait_event(self, name, timeout, data):
+        for event in self.events:
+            if self._matches(event, name, data):
+                self.events.remove(event)
+                return event
+        future = self.loop.create_future()
+        waiter = (name, data, future)
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def discard_events(self, name):
+        """ Forget the events name nobody waited for, like those of an
+            earlier migration
+        """
+        async def _discard():
+            for event in [e for e in self.events if e['event'] == name]:
+                self.events.remove(event)
+        self._run(_discard(), self.timeout)
+
+    def close(self):
+        def _close():
+            self.closed = EOFError("QMP connection closed")
+            if self.reader is not None:
+                self.reader.cancel()
+            if self.sock is not None:
+                self.sock.close()
+        self.loop.call_soon_threadsafe(_close)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+""" Host resources used by the VMs of a virtual router
+
+    Collected for the status server, so they have to be cheap: everything
+    comes from /proc, one batch of QMP queries per VM and one netlink
+    (sock_diag) dump for the links, no processes are started. The result is
+    cached for a few seconds (METRICS_CACHE_SECONDS), so a lab full of
+    routers can be scraped at a short interval.
+
+    The data NICs of a VM are TCP connections of qemu (see
+    VM.gen_nics), they have no host interface with counters. The kernel
+    keeps byte and segment counters of every TCP connection though, which
+    we read with sock_diag for the connections on the NIC ports. Bytes
+    include the 4 byte length qemu puts in front of every packet, and a
+    segment may carry several packets or part of one.
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import density
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+TCP_ESTABLISHED = 1
+
+NLMSGHDR = struct.Struct("=IHHII")
+# family, protocol, ext, pad, states, then the socket id: sport, dport (big
+# endian), src, dst, interface and cookie
+INET_DIAG_REQ_V2 = struct.Struct("=BBBBI" + "2s2s16s16sI8s")
+# family, state, timer, retrans, then the socket id, expires, rqueue,
+# wqueue, uid and inode
+INET_DIAG_MSG = struct.Struct("=BBBB" + "2s2s16s16sI8s" + "IIIII")
+RTATTR = struct.Struct("=HH")
+# bytes_acked, bytes_received, segs_out, segs_in of struct tcp_info
+TCP_INFO_COUNTERS = struct.Struct("=QQII")
+TCP_INFO_COUNTERS_OFFSET = 120
+
+
+def process_stats(pid):
+    """ CPU seconds used, resident memory in bytes and number of threads of
+        process pid
+    """
+    with open("/proc/%d/stat" % pid, "rb") as f:
+        data = f.read()
+    # the command name is in parentheses and may contain anything
+    fields = data[data.rindex(b")") + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return {
+        'cpu_seconds': (utime + stime) / CLOCK_TICKS,
+        'rss_bytes': int(fields[21]) * PAGE_SIZE,
+        'threads': int(fields[17]),
+    }
+
+
+def _diag_request(family, seq):
+    req = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0,
+                                1 << TCP_ESTABLISHED, b"", b"", b"", b"", 0, b"")
+    return NLMSGHDR.pack(NLMSGHDR.size + len(req), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + req
+
+
+def tcp_counters(ports):
+    """ Byte and segment counters of the established TCP connections with a
+        local port in ports, by local port
+
+        Counters of several connections on the same port are added up.
+    """
+    ports = set(ports)
+    res = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), 1):
+            sock.send(_diag_request(family, seq))
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + NLMSGHDR.size <= len(data):
+                    length, msg_type, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+                    if length < NLMSGHDR.size:
+                        done = True
+                        break
+                    if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                        done = True
+                        break
+                    _parse_diag_msg(data[offset + NLMSGHDR.size:offset + length], ports, res)
+                    offset += (length + 3) & ~3
+    return res
+
+
+def _parse_diag_msg(msg, ports, res):
+    if len(msg) < INET_DIAG_MSG.size:
+        return
+    sport = struct.unpack(">H", INET_DIAG_MSG.unpack_from(msg)[4])[0]
+    if sport not in ports:
+        return
+    offset = INET_DIAG_MSG.size
+    while offset + RTATTR.size <= len(msg):
+        length, attr_type = RTATTR.unpack_from(msg, offset)
+        if length < RTATTR.size:
+            return
+        if attr_type == INET_DIAG_INFO and length - RTATTR.size >= TCP_INFO_COUNTERS_OFFSET + TCP_INFO_COUNTERS.size:
+            sent, received, segs_out, segs_in = TCP_INFO_COUNTERS.unpack_from(
+                msg, offset + RTATTR.size + TCP_INFO_COUNTERS_OFFSET)
+            counters = res.setdefault(sport, {'sent_bytes': 0, 'received_bytes': 0,
+                                              'sent_segments': 0, 'received_segments': 0})
+            counters['sent_bytes'] += sent
+            counters['received_bytes'] += received
+            counters['sent_segments'] += segs_out
+            counters['received_segments'] += segs_in
+        offset += (length + 3) & ~3
+
+
+class ResourceCollector:
+    """ Collect the resources used by the VMs get_vms() returns, at most
+        every max_age seconds
+    """
+    def __init__(self, get_vms, max_age=None, base_port=10000):
+        self.logger = logging.getLogger()
+        self.get_vms = get_vms
+        if max_age is None:
+            max_age = float(os.getenv("METRICS_CACHE_SECONDS", "2"))
+        self.max_age = max_age
+        self.base_port = base_port
+        self.lock = threading.Lock()
+        self.collected = None
+        self.cache = {}
+
+    def collect(self):
+        """ Resources by VM name, see collect_vm()
+        """
+        with self.lock:
+            if self.collected is not None and time.monotonic() - self.collected < self.max_age:
+                return self.cache
+            vms = self.get_vms()
+            links = {}
+            try:
+                links = tcp_counters(self.base_port + i for vm in vms for i in vm.data_nics())
+            except OSError as exc:
+                self.logger.debug("Unable to read link counters: %s" % exc)
+            self.cache = {str(vm): self.collect_vm(vm, links) for vm in vms}
+            self.collected = time.monotonic()
+            return self.cache
+
+    def collect_vm(self, vm, links):
+        res = {
+            'ram_bytes': int(vm.ram) * 1024 * 1024,
+            'spins': vm.spins,
+            'process': None,
+            'balloon_bytes': None,
+            'ksm_bytes': None,
+            'block': {},
+            'nics': {},
+        }
+        if vm.p is not None and vm.p.poll() is None:
+            try:
+                res['process'] = process_stats(vm.p.pid)
+            except (OSError, ValueError, IndexError):
+                pass
+            res['ksm_bytes'] = density.ksm_merged_bytes(vm.p.pid)
+        qm = vm.qmp
+        if qm is not None:
+            try:
+                blockstats, balloon = qm.batch([("query-blockstats", None), ("query-balloon", None)])
+            except (OSError, EOFError):
+                blockstats, balloon = None, None
+            if isinstance(blockstats, list):
+                for dev in blockstats:
+                    name = dev.get('device') or dev.get('qdev') or dev.get('node-name')
+                    stats = dev.get('stats', {})
+                    res['block'][name] = {k: stats.get(k, 0) for k in
+                                          ('rd_bytes', 'wr_bytes', 'rd_operations', 'wr_operations')}
+            if isinstance(balloon, dict):
+                res['balloon_bytes'] = balloon.get('actual')
+        for i in vm.data_nics():
+            if self.base_port + i in links:
+                res['nics'][i] = links[self.base_port + i]
+        return res
+
+
+def memory_returned(res):
+    """ How much of the RAM of a VM, from what collect_vm() collected, the
+        host has back: what qemu does not have resident (never touched,
+        reported free or taken by the balloon) plus what KSM merged
+
+        qemu itself and its threads are part of the resident memory, so for
+        a VM using all its RAM this is slightly below zero, and rounded up.
+    """
+    if res['process'] is None:
+        return None
+    return max(0, res['ram_bytes'] - res['process']['rss_bytes'] + (res['ksm_bytes'] or 0))
+
+
+def metrics(resources):
+    """ Metrics for status.format_metrics() of what ResourceCollector
+        collected
+    """
+    cpu, rss, threads, ram, balloon, ksm, returned, spins = [], [], [], [], [], [], [], []
+    block = {k: [] for k in ('rd_bytes', 'wr_bytes', 'rd_operations', 'wr_operations')}
+    nics = {k: [] for k in ('sent_bytes', 'received_bytes', 'sent_segments', 'received_segments')}
+    for vm, res in sorted(resources.items()):
+        labels = {'vm': vm}
+        ram.append((labels, res['ram_bytes']))
+        spins.append((labels, res['spins']))
+        if res['process'] is not None:
+            cpu.append((labels, round(res['process']['cpu_seconds'], 2)))
+            rss.append((labels, res['process']['rss_bytes']))
+            threads.append((labels, res['process']['threads']))
+        if res['balloon_bytes'] is not None:
+            balloon.append((labels, res['balloon_bytes']))
+        if res['ksm_bytes'] is not None:
+            ksm.append((labels, res['ksm_bytes']))
+        if memory_returned(res) is not None:
+            returned.append((labels, memory_returned(res)))
+        for device, stats in sorted(res['block'].items()):
+            for key, value in stats.items():
+                block[key].append((dict(labels, device=device), value))
+        for nic, counters in sorted(res['nics'].items()):
+            for key, value in counters.items():
+                nics[key].append((dict(labels, nic=nic), value))
+
+    return [
+        ("vrnetlab_vm_cpu_seconds_total", "counter", "CPU time used by qemu", cpu),
+        ("vrnetlab_vm_resident_memory_bytes", "gauge", "resident memory of qemu", rss),
+        ("vrnetlab_vm_threads", "gauge", "threads of qemu", threads),
+        ("vrnetlab_vm_memory_bytes", "gauge", "RAM given to the VM", ram),
+        ("vrnetlab_vm_balloon_bytes", "gauge", "RAM the guest has according to the balloon", balloon),
+        ("vrnetlab_vm_ksm_merged_bytes", "gauge", "RAM of the VM merged with identical pages by KSM", ksm),
+        ("vrnetlab_vm_memory_returned_bytes", "gauge", "RAM of the VM the host does not have to back", returned),
+        ("vrnetlab_vm_bootstrap_spins", "gauge", "bootstrap spins without progress of the current boot", spins),
+        ("vrnetlab_vm_block_read_bytes_total", "counter", "bytes read from a disk", block['rd_bytes']),
+        ("vrnetlab_vm_block_written_bytes_total", "counter", "bytes written to a disk", block['wr_bytes']),
+        ("vrnetlab_vm_block_reads_total", "counter", "read requests to a disk", block['rd_operations']),
+        ("vrnetlab_vm_block_writes_total", "counter", "write requests to a disk", block['wr_operations']),
+        ("vrnetlab_vm_nic_sent_bytes_total", "counter", "bytes sent by a data NIC to its link", nics['sent_bytes']),
+        ("vrnetlab_vm_nic_received_bytes_total", "counter", "bytes received by a data NIC from its link",
+         nics['received_bytes']),
+        ("vrnetlab_vm_nic_sent_segments_total", "counter", "TCP segments sent by a data NIC to its link",
+         nics['sent_segments']),
+        ("vrnetlab_vm_nic_received_segments_total", "counter", "TCP segments received by a data NIC from its link",
+         nics['received_segments']),
+    ]
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+""" Saved VM state used for warm booting virtual routers
+
+    A snapshot consists of three files in the snapshot directory, all prefixed
+    with the name of the VM:
+
+      * <name>.state - the qemu migration stream (RAM and device state)
+      * <name>.qcow2 - a copy of the overlay disk image at the time of saving
+      * <name>.json  - metadata, the fingerprint of the VM and the qemu command
+                       line the snapshot was taken with
+
+    The metadata file is written last, so a snapshot is only ever considered
+    if it was completely written.
+
+    A fleet image is a snapshot of a "golden" VM that is shared by many
+    containers running the same router. Its RAM is kept in a separate
+    <name>.ram file that clones map copy-on-write, so the migration stream
+    only holds device state.
+
+    A persistent overlay is the overlay disk image of a VM kept on a volume
+    across container restarts, <name>.qcow2, with a stamp <name>.json saying
+    the bootstrap configuration was applied to it. There is no saved RAM, the
+    VM boots from it without being configured again.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+
+
+def image_identity(path):
+    """ Identify a disk image without reading all of it
+
+        Base images are multiple GB in size, so instead of hashing the content
+        we rely on the path, size and modification time.
+    """
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def secret_digest(*values):
+    """ Digest of secrets that we want to compare but not store in clear text
+    """
+    return hashlib.sha256("\0".join(str(v) for v in values).encode()).hexdigest()
+
+
+def normalize_args(args):
+    """ Normalize qemu arguments for comparison
+
+        MAC addresses are randomly generated on every start but are restored
+        from the snapshot together with the rest of the command line, so they
+        should not invalidate a snapshot.
+    """
+    return [re.sub(r'mac=[0-9a-fA-F:]+', 'mac=*', arg) for arg in args]
+
+
+class Snapshot:
+    def __init__(self, directory, name):
+        self.logger = logging.getLogger()
+        self.directory = directory
+        self.name = name
+
+    def __str__(self):
+        return os.path.join(self.directory, self.name)
+
+    @property
+    def state_file(self):
+        return os.path.join(self.directory, self.name + ".state")
+
+    @property
+    def overlay_file(self):
+        return os.path.join(self.directory, self.name + ".qcow2")
+
+    @property
+    def meta_file(self):
+        return os.path.join(self.directory, self.name + ".json")
+
+    def read_meta(self):
+        """ Read snapshot metadata, returns None if there is no (usable) snapshot
+        """
+        try:
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as exc:
+            self.logger.warning("Ignoring snapshot %s with unreadable metadata: %s" % (self, exc))
+            return None
+        if not (os.path.exists(self.state_file) and os.path.exists(self.overlay_file)):
+            self.logger.warning("Ignoring incomplete snapshot %s" % self)
+            return None
+        return meta
+
+    def matches(self, fingerprint):
+        """ Check if the snapshot was taken of a VM with the given fingerprint
+
+            Returns the metadata of the snapshot if it matches, otherwise None.
+        """
+        meta = self.read_meta()
+        if meta is None:
+            return None
+        for key, value in fingerprint.items():
+            if meta['fingerprint'].get(key) != value:
+                self.logger.info("Snapshot %s does not match, %s differs" % (self, key))
+                return None
+        return meta
+
+    def write_meta(self, fingerprint, cmd, **extra):
+        tmp_file = self.meta_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(dict(extra, fingerprint=fingerprint, cmd=cmd), f, indent=2)
+        os.rename(tmp_file, self.meta_file)
+
+    def files(self):
+        return [self.meta_file, self.state_file, self.overlay_file]
+
+    def discard(self):
+        """ Remove the snapshot, metadata first so it is never half valid
+        """
+        for path in self.files():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class PersistentOverlay(Snapshot):
+    """ Overlay disk image of a VM that outlives the container, and the stamp
+        of its bootstrap
+    """
+    def files(self):
+        return [self.meta_file, self.overlay_file]
+
+    def read_meta(self):
+        try:
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as exc:
+            self.logger.warning("Ignoring persistent overlay %s with unreadable stamp: %s" % (self, exc))
+            return None
+        if not os.path.exists(self.overlay_file):
+            self.logger.warning("Ignoring stamp of missing persistent overlay %s" % self.overlay_file)
+            return None
+        return meta
+
+
+def fingerprint_key(fingerprint):
+    """ Short stable key for a fingerprint, used to name fleet images
+    """
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class FleetImage(Snapshot):
+    """ Snapshot of a golden VM, shared by all clones on the host
+
+        Only one container may capture the golden VM, this is coordinated
+        through an exclusive lock on <name>.lock which is held from the start
+        of the golden VM until it has been captured. The lock is released by
+        the kernel if the container dies.
+    """
+    def __init__(self, directory, name):
+        super().__init__(directory, name)
+        self.lock_fd = None
+
+    @property
+    def ram_file(self):
+        return os.path.join(self.directory, self.name + ".ram")
+
+    @property
+    def ram_tmp_file(self):
+        return self.ram_file + ".tmp"
+
+    @property
+    def lock_file(self):
+        return os.path.join(self.directory, self.name + ".lock")
+
+    def files(self):
+        return super().files() + [self.ram_file]
+
+    def read_meta(self):
+        meta = super().read_meta()
+        if meta is not None and not os.path.exists(self.ram_file):
+            self.logger.warning("Ignoring fleet image %s without memory image" % self)
+            return None
+        return meta
+
+    def memory_args(self, ram, golden):
+        """ qemu arguments for guest RAM backed by the fleet memory image
+
+            The golden VM maps the file shared so that it ends up holding the
+            guest RAM. Clones map it private, pages are shared with all other
+            clones through the page cache until the guest writes to them.
+        """
+        if golden:
+            backend = "mem-path=%s,share=on" % self.ram_tmp_file
+        else:
+            backend = "mem-path=%s,share=off" % self.ram_file
+        return ["-object", "memory-backend-file,id=pc.ram,size=%dM,%s" % (ram, backend),
+                "-machine", "memory-backend=pc.ram"]
+
+    @property
+    def locked(self):
+        return self.lock_fd is not None
+
+    def lock(self):
+        """ Wait for exclusive access to the fleet image
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+
+    def unlock(self):
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
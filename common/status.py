@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+""" Status of the virtual router over HTTP
+
+    A minimal HTTP server on the shared event loop serving the health data of
+    the virtual router:
+
+      /health   - JSON, the state of every VM, its boot timeline, restarts
+                  and so on
+      /metrics  - the same in Prometheus text format
+      /console  - the last output of the serial console of a VM, like
+                  /console?vm=VM[0]&kb=16 (16 kB by default), only on the
+                  unix socket unless console_tcp is set
+
+    It listens on a TCP port and on a unix socket, the latter for local
+    clients without network access to the container. The TCP port is
+    reachable by anyone who can reach the container and there is no
+    authentication, while the console shows whatever the router echoes,
+    passwords of the bootstrap configuration included. Only GET is supported
+    and every request gets its own connection, which is all Prometheus and
+    curl need.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import socket
+import urllib.parse
+
+import portfwd
+
+# reading the request line and headers of a client may not take longer
+REQUEST_TIMEOUT = 10
+# console output served by /console unless asked for more or less, in kB
+CONSOLE_KB = 16
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_metrics(metrics):
+    """ Render metrics in the Prometheus text exposition format
+
+        metrics is a list of (name, type, help, samples) where samples is a
+        list of (labels, value) and labels a dict.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in metrics:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in samples:
+            if labels:
+                label_str = ",".join('%s="%s"' % (k, escape_label(v)) for k, v in sorted(labels.items()))
+                lines.append("%s{%s} %s" % (name, label_str, value))
+            else:
+                lines.append("%s %s" % (name, value))
+    return "\n".join(lines) + "\n"
+
+
+class StatusServer:
+    """ Serve health() (a dict) and metrics() (see format_metrics) of the
+        virtual router on port and the unix socket at path, either may be
+        None
+
+        console(vm, nbytes) returns the last nbytes of console output of a
+        VM, or None if there is none. It is served on the unix socket only,
+        unless console_tcp is True.
+    """
+    def __init__(self, loop, port, health, metrics, path=None, console=None, console_tcp=False):
+        self.logger = logging.getLogger()
+        self.loop = loop
+        self.port = port
+        self.path = path
+        self.health = health
+        self.metrics = metrics
+        self.console = console
+        self.console_tcp = console_tcp
+        self.servers = []
+        self.tasks = set()
+
+    def start(self):
+        """ Start serving, returns False if the port or socket could not be
+            opened
+        """
+        ok = True
+        if self.port:
+            try:
+                asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+                self.logger.info("Serving status on port %d" % self.port)
+            except OSError as exc:
+                self.logger.error("Unable to serve status on port %d: %s" % (self.port, exc))
+                ok = False
+        if self.path:
+            try:
+                asyncio.run_coroutine_threadsafe(self._start_unix(), self.loop).result()
+                self.logger.info("Serving status on %s" % self.path)
+            except OSError as exc:
+                self.logger.error("Unable to serve status on %s: %s" % (self.path, exc))
+                ok = False
+        return ok
+
+    async def _start(self):
+        self.servers.append(await asyncio.start_server(
+            functools.partial(self.handle, console=self.console_tcp), sock=portfwd.listen_socket(socket.SOCK_STREAM, self.port)))
+
+    async def _start_unix(self):
+        # left behind by an earlier run of the container
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.servers.append(await asyncio.start_unix_server(functools.partial(self.handle, console=True), path=self.path))
+
+    async def handle(self, reader, writer, console=False):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            method, path = request.split(b" ", 2)[:2]
+            path, _, query = path.partition(b"?")
+            if method != b"GET":
+                status, ctype, body = "405 Method Not Allowed", "text/plain", "only GET is supported\n"
+            elif path == b"/health":
+                # run in the default executor, collecting may take a lock
+                # held by a VM thread for a moment
+                health = await self.loop.run_in_executor(None, self.health)
+                status, ctype, body = "200 OK", "application/json", json.dumps(health) + "\n"
+            elif path == b"/metrics":
+                metrics = await self.loop.run_in_executor(None, self.metrics)
+                status, ctype, body = "200 OK", "text/plain; version=0.0.4", format_metrics(metrics)
+            elif path == b"/console" and self.console is not None and console:
+                params = urllib.parse.parse_qs(query.decode())
+                vm = params.get('vm', [""])[0]
+                try:
+                    nbytes = int(params.get('kb', [CONSOLE_KB])[0]) * 1024
+                except ValueError:
+                    nbytes = 0
+                if nbytes <= 0:
+                    status, ctype, body = "400 Bad Request", "text/plain", "kb must be a positive integer\n"
+                else:
+                    output = await self.loop.run_in_executor(None, self.console, vm, nbytes)
+                    if output is None:
+                        status, ctype, body = "404 Not Found", "text/plain", "no console of VM %r\n" % vm
+                    else:
+                        status, ctype, body = "200 OK", "text/plain; charset=utf-8", output.decode(errors="replace")
+            else:
+                status, ctype, body = "404 Not Found", "text/plain", "try /health, /metrics or /console\n"
+            body = body.encode()
+            writer.write(("HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                          % (status, ctype, len(body))).encode() + body)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        except Exception:
+            self.logger.exception("Unable to serve status request")
+        finally:
+            writer.close()
+            self.tasks.discard(task)
+
+    def close(self):
+        for server in self.servers:
+            self.loop.call_soon_threadsafe(server.close)
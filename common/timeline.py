@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+""" Boot timeline of a VM
+
+    Records when a VM reaches each step of booting, from spawning qemu to
+    running, so we can see where a platform spends its boot time. Every
+    (re)start of the VM is a new boot on the timeline along with what caused
+    it, the last few boots are kept.
+
+    The milestones of a boot, in order:
+
+      admitted         - got a boot slot (see admission.py)
+      spawn            - qemu started
+      monitor_connect  - connected to the qemu monitor
+      console_connect  - connected to the serial console
+      first_byte       - first output on the serial console
+      bootstrap_start  - bootstrap configuration started
+      bootstrap_end    - bootstrap configuration done
+      running          - the VM is up and running
+
+    Not every boot reaches every milestone, a VM resuming from saved state
+    for example never sees a bootstrap configuration. Every expect() pattern
+    that matches on the serial console is recorded as well, the first time
+    it matches.
+"""
+
+import collections
+import datetime
+import functools
+import threading
+import time
+
+MILESTONES = ("admitted", "spawn", "monitor_connect", "console_connect", "first_byte",
+              "bootstrap_start", "bootstrap_end", "running")
+
+# how many boots to keep
+HISTORY = 10
+# upper bound for the events of a single boot, in case a platform expects
+# lots of different patterns
+MAX_EVENTS = 200
+
+
+class Boot:
+    def __init__(self, kind="boot", cause=None):
+        self.kind = kind
+        self.cause = cause
+        self.started = time.monotonic()
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        # list of (seconds since started, event, detail)
+        self.events = []
+        self.seen = set()
+
+    def at(self, event):
+        """ Seconds from the start of the boot to event or None
+        """
+        for t, e, _ in self.events:
+            if e == event:
+                return t
+        return None
+
+    def phases(self):
+        """ Time taken to reach each milestone from the previous one
+        """
+        res = {}
+        prev = 0.0
+        for milestone in MILESTONES:
+            t = self.at(milestone)
+            if t is not None:
+                res[milestone] = round(t - prev, 3)
+                prev = t
+        return res
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'cause': self.cause,
+            'started': self.started_at.isoformat(),
+            'duration': self.at("running"),
+            'phases': self.phases(),
+            'events': [{'event': e, 'at': t, 'detail': d} if d is not None else {'event': e, 'at': t}
+                       for t, e, d in self.events],
+        }
+
+
+class Timeline:
+    """ Boots of a VM, thread-safe as the serial console is read in another
+        thread than the one driving the VM
+    """
+    def __init__(self, name, history=HISTORY):
+        self.name = name
+        self.lock = threading.Lock()
+        self.boots = collections.deque(maxlen=history)
+        # number of restarts by cause
+        self.restarts = collections.Counter()
+
+    @property
+    def current(self):
+        return self.boots[-1] if self.boots else None
+
+    def boot(self, kind="boot", cause=None):
+        """ Start recording a new boot, cause is what made us restart
+        """
+        with self.lock:
+            if self.boots:
+                self.restarts[cause or "unknown"] += 1
+            self.boots.append(Boot(kind, cause))
+
+    def mark(self, event, detail=None):
+        """ Record that the current boot reached event
+
+            Only the first occurrence of every event (and detail) is recorded.
+        """
+        with self.lock:
+            boot = self.current
+            if boot is None or (event, detail) in boot.seen or len(boot.events) >= MAX_EVENTS:
+                return
+            boot.seen.add((event, detail))
+            boot.events.append((round(time.monotonic() - boot.started, 3), event, detail))
+
+    def phase(self):
+        """ The last milestone the current boot reached, None before spawning
+            qemu
+        """
+        with self.lock:
+            boot = self.current
+            if boot is None:
+                return None
+            reached = [m for m in MILESTONES if boot.at(m) is not None]
+            return reached[-1] if reached else None
+
+    def reached(self, event):
+        with self.lock:
+            return self.current is not None and self.current.at(event) is not None
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'restarts': dict(self.restarts),
+                'boots': [boot.as_dict() for boot in self.boots],
+            }
+
+
+def recorded(func):
+    """ Decorator for VM.bootstrap_config() implementations, records start
+        and end of the bootstrap configuration on the timeline of the VM
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self, "_in_bootstrap_config", False):
+            # a platform calling the bootstrap_config() of its parent class
+            return func(self, *args, **kwargs)
+        self.timeline.mark("bootstrap_start")
+        self._in_bootstrap_config = True
+        try:
+            res = func(self, *args, **kwargs)
+        finally:
+            self._in_bootstrap_config = False
+        self.timeline.mark("bootstrap_end")
+        return res
+    return wrapper
+
+
+class RecordingConsole:
+    """ Serial console recording the first output and expect() matches on a
+        timeline, everything else is passed through to the console
+    """
+    def __init__(self, con, timeline):
+        self.con = con
+        self.timeline = timeline
+        self.seen_output = False
+        # the asyncio console engine tells us the moment data arrives
+        if hasattr(con, "observers"):
+            con.observers.append(self.observe)
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def observe(self, data):
+        if not self.seen_output:
+            self.seen_output = True
+            self.timeline.mark("first_byte")
+
+    def expect(self, patterns, timeout=None):
+        idx, match, data = self.con.expect(patterns, timeout)
+        if data:
+            self.timeline.mark("first_byte")
+        if match is not None:
+            pattern = patterns[idx]
+            pattern = getattr(pattern, "pattern", pattern)
+            if isinstance(pattern, bytes):
+                pattern = pattern.decode(errors="replace")
+            self.timeline.mark("expect", pattern)
+        return idx, match, data
+
+    def read_until(self, expected, timeout=None):
+        data = self.con.read_until(expected, timeout)
+        if data:
+            self.timeline.mark("first_byte")
+        return data
+
+    def read_very_eager(self):
+        data = self.con.read_very_eager()
+        if data:
+            self.timeline.mark("first_byte")
+        return data
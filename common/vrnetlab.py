@@ -1,17 +1,49 @@
 #!/usr/bin/env python3
 
+import asyncio
 import datetime
-import json
+import functools
+import ipaddress
 import logging
 import math
 import os
 import random
 import re
+import shutil
+import signal
 import subprocess
-import telnetlib
+import threading
 import time
 
+try:
+    import telnetlib
+except ImportError:
+    # removed in Python 3.13
+    telnetlib = None
+
+import admission
+import configdrive
+import consolelog
+import density
+import hugepages
+import console
+import diskio
+import portfwd
+import nichotplug
+import placement
+import prewarm
+import qcow2
+import qmp
+import resources
+import snapshot
+import status
+import timeline
+
 MAX_RETRIES=60
+# qemu failing at start this many times in a row is not going to get better
+MAX_ATTACH_FAILURES = 3
+# how much of the console output of a VM that failed to log
+CRASH_CONSOLE_BYTES = 2048
 
 # Global list of ports that we want to set up forwarding from container IP ->
 # mgmt IP of router (usually 10.0.0.15). Each entry consists of the protocol,
@@ -25,6 +57,17 @@ HOST_FWDS = [
     ('tcp', 443, 443),    # HTTPS
 ]
 
+# Output from qemu on STDERR that means the VM is dead even though qemu itself
+# may still be running
+QEMU_FATAL_ERRORS = re.compile(r"KVM internal error|kvm run failed|KVM: entry failed")
+
+# Background child processes (socat etc) that are reaped on SIGCHLD
+_children = []
+
+# asyncio event loop shared by the consoles, see event_loop()
+_loop = None
+_loop_lock = threading.Lock()
+
 def gen_mac(last_octet=None):
     """ Generate a random MAC address that is in the qemu OUI space and that
         has the given last octet.
@@ -42,6 +85,7 @@ def run_command(cmd, cwd=None, background=False):
     try:
         if background:
             p = subprocess.Popen(cmd, cwd=cwd)
+            _children.append(p)
         else:
             p = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=cwd)
             res = p.communicate()
@@ -50,6 +94,45 @@ def run_command(cmd, cwd=None, background=False):
     return res
 
 
+def handle_SIGCHLD(signal, frame):
+    """ Reap background child processes that have exited
+
+        Only the processes started by run_command() are reaped, each through
+        its own Popen object. Reaping any child with os.waitpid(-1) would
+        steal the exit status of qemu processes from their QemuWatcher.
+    """
+    for p in list(_children):
+        if p.poll() is not None:
+            _children.remove(p)
+
+
+def event_loop():
+    """ Return the shared asyncio event loop, starting it on first use
+
+        The loop runs in a daemon thread, the synchronous launch code hands
+        work to it with asyncio.run_coroutine_threadsafe().
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="event loop", daemon=True).start()
+        return _loop
+
+
+class LazyDecode:
+    """ Console output for a log message, only decoded if the message is
+        logged, as in logger.trace("OUTPUT: %s", LazyDecode(res))
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.decode(errors="replace")
+
+
 def bool_from_env(env_var: str, default: bool=False):
     """Convert environment variable to boolean
 
@@ -66,11 +149,110 @@ def list_from_env(env_var: str, default: list=[]):
     return os.getenv(env_var, ' '.join(default)).split()
 
 
+class QemuWatcher:
+    """ Event driven supervision of a qemu process
+
+        One thread per output stream logs qemu's output as it arrives and looks
+        for fatal KVM errors on STDERR, another one waits for the process to
+        exit. Either sets failure to a description of what happened and sets
+        the event, so nobody needs to poll the process.
+    """
+    def __init__(self, name, p):
+        self.logger = logging.getLogger()
+        self.name = name
+        self.p = p
+        self.failure = None
+        self.event = threading.Event()
+        for stream, stream_name in ((p.stdout, "STDOUT"), (p.stderr, "STDERR")):
+            threading.Thread(target=self.read, args=(stream, stream_name),
+                             name=f"{name} {stream_name}", daemon=True).start()
+        threading.Thread(target=self.wait, name=f"{name} qemu", daemon=True).start()
+
+    def read(self, stream, stream_name):
+        for line in stream:
+            line = line.rstrip()
+            self.logger.info("%s %s: %s" % (self.name, stream_name, line))
+            if stream_name == "STDERR" and QEMU_FATAL_ERRORS.search(line) and self.failure is None:
+                self.failure = line
+                self.event.set()
+
+    def fail(self, failure):
+        """ Report that the VM is dead while qemu may still be running
+        """
+        if self.failure is None:
+            self.failure = failure
+            self.event.set()
+
+    def wait(self):
+        returncode = self.p.wait()
+        if self.failure is None:
+            self.failure = "qemu exited with status %d" % returncode
+        self.event.set()
+
+
 class VM:
+    # platforms move over to the asyncio console engine by overriding this
+    default_console_engine = "telnetlib"
+
+    # how the bootstrap configuration is delivered: None to type it on the
+    # serial console, or one of configdrive.METHODS for platforms that can
+    # pick up gen_bootstrap_config() from a config drive by themselves
+    config_drive = None
+    # name of the configuration file on the config drive / TFTP server and
+    # the volume label of the drive
+    config_drive_file = "config.txt"
+    config_drive_label = None
+    config_drive_newline = "\n"
+
+    # output of the NOS meaning a configuration line was rejected, checked by
+    # send_config()
+    config_errors = [rb"% ?Invalid input", rb"% ?Incomplete command", rb"% ?Ambiguous command",
+                     rb"Error:", rb"ERROR:", rb"MINOR:", rb"MAJOR:", rb"CRITICAL:"]
+    # how many configuration lines send_config() sends ahead of their echo
+    config_window = 4
+    # longer configuration lines may be scrolled or wrapped by the CLI, of
+    # those send_config() only checks the echo of the first as many characters
+    config_echo_width = 60
+    # the CLI prompt at the end of the output, which tells wait_config() the
+    # output of a command is complete. Any line ending in #, > or ] is only a
+    # fallback, a line of output split by a read can end in one of them as
+    # well, so platforms polling with wait_config() set their actual prompt
+    cli_prompt = rb"[\r\n][^\r\n]*[#>\]] ?\Z"
+    # what the NOS shows on the serial console once it is up, which is all a
+    # VM booting from a persistent overlay waits for, and how many spins
+    # without any output it waits before booting from scratch instead
+    login_prompts = [rb"(?<!Last )[Ll]ogin:", rb"[Uu]sername:", rb"[Pp]ress (RETURN|[Ee]nter)"]
+    persist_spins = 300
+
+    # the interfaces the NOS boots from for the overlay disk image, the first
+    # one is used unless DISK_INTERFACE says otherwise (see diskio.py)
+    disk_interfaces = ("ide",)
+
+    # the NOS copes with data NICs being hot-plugged while it runs, so they
+    # can be added when their link connects instead of at boot, see
+    # NIC_HOTPLUG and nichotplug.py
+    nic_hotplug = False
+    # the data NICs a VM booting with NIC hot-plug gets at boot anyway
+    hotplug_min_nics = 0
+
+    # the guest has a virtio-balloon driver, and reports free pages to the
+    # host (Linux 5.7 and later), used in density mode, see density.py
+    has_balloon_driver = False
+    free_page_reporting = False
+    # RAM in MB the platform still runs fine with, what DENSITY_SHRINK shrinks
+    # a running VM to
+    memory_floor = None
+
     def __str__(self):
         # TODO: use this in the logger?!
         return f"{self.__class__.__name__}[{self.num}]"
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # record the bootstrap configuration of every platform on the timeline
+        if "bootstrap_config" in cls.__dict__:
+            cls.bootstrap_config = timeline.recorded(cls.__dict__["bootstrap_config"])
+
 
     def __init__(self, username, password, disk_image=None, num=0, ram=4096):
         self.logger = logging.getLogger()
@@ -82,12 +264,28 @@ class VM:
 
         self.num = num
         self.image = disk_image
+        self.ram = ram
 
         self.running = False
         self.spins = 0
+        # monotonic timestamp of the last (re)start and the time it took from
+        # there to reach the running state, reported by the VR supervisor
+        self.boot_started = None
+        self.boot_duration = None
+        # monotonic timestamp of when the VM last got running
+        self.running_since = None
+        # when the VM reached which step of booting, see timeline.py
+        self.timeline = timeline.Timeline(str(self))
+        # why the VM is being restarted, for the timeline
+        self.restart_cause = None
         self.p = None
+        self.qemu = None
         self.tn = None
-        self.qm = None
+        # how to talk to the serial console, "telnetlib" or "asyncio" (see
+        # console.py)
+        self.console_engine = os.getenv("CONSOLE_ENGINE", self.default_console_engine)
+        if telnetlib is None:
+            self.console_engine = "asyncio"
 
         #  various settings
         self.uuid = None
@@ -97,10 +295,143 @@ class VM:
         self.nics_per_pci_bus = 26 # tested to work with XRv
         self.smbios = []
 
+        # bootstrap configuration
+        self.mgmt_address = ipaddress.ip_interface("10.0.0.15/24")
+        # additional configuration lines from the file in BOOTSTRAP_EXTRA_CONFIG,
+        # appended to the bootstrap configuration by platforms that render it
+        self.extra_config = []
+        if os.getenv("BOOTSTRAP_EXTRA_CONFIG"):
+            with open(os.getenv("BOOTSTRAP_EXTRA_CONFIG")) as f:
+                self.extra_config = f.read().splitlines()
+
+        # warm boot: save the VM state once bootstrapped and resume from it on
+        # later starts instead of booting from scratch
+        self.warm_boot = bool_from_env("WARM_BOOT")
+        self.snapshot = snapshot.Snapshot(os.getenv("WARM_BOOT_DIR", "/snapshot"),
+                                          f"{self.__class__.__name__}-{self.num}")
+        # cleared by the VR if not all of its VMs can be restored
+        self.snapshot_restore = True
+        # fleet mode: clone this VM from a golden VM shared by all containers
+        # running the same router on this host
+        self.fleet = bool_from_env("FLEET")
+        self.fleet_image = None
+        self.fleet_meta = None
+        # the saved state (Snapshot or FleetImage) we are resuming from
+        self.restoring = None
+        self.qemu_cmd = None
+        # persistent mode: keep the overlay disk image on a volume, in a
+        # directory per container (PERSIST_ID, by default the hostname), and
+        # boot from it without the bootstrap configuration once it has that
+        self.persistent = bool_from_env("PERSISTENT")
+        if self.persistent and self.fleet:
+            # clones start from the overlay of the golden VM
+            self.logger.warning("Persistent overlays do not work with fleet mode, not using them")
+            self.persistent = False
+        self.persistent_overlay = snapshot.PersistentOverlay(
+            os.path.join(os.getenv("PERSIST_DIR", "/persist"), os.getenv("PERSIST_ID") or os.uname().nodename),
+            f"{self.__class__.__name__}-{self.num}")
+        # the stamp of the persistent overlay we are booting from
+        self.persisted = None
+        # starts in a row where qemu failed before we were connected
+        self.attach_failures = 0
+
+        # qemu is controlled over QMP (see qmp.py), the human monitor on port
+        # 40xx is left for people to poke at
+        self.qmp_socket = "/run/qmp%d.sock" % self.num
+        self.qmp = None
+        # the run state of the VM as reported by qemu, kept up to date by
+        # QMP events
+        self.vm_status = None
+
+        # NIC_HOTPLUG=1 boots platforms supporting it with only the mgmt NIC
+        # and hot-plugs data NICs once their link connects, NIC_HOTPLUG=force
+        # tries that on any platform
+        hotplug = os.getenv("NIC_HOTPLUG", "").lower()
+        self.nic_hotplug_enabled = hotplug == "force" or (self.nic_hotplug and bool_from_env("NIC_HOTPLUG"))
+        if bool_from_env("NIC_HOTPLUG") and not self.nic_hotplug:
+            self.logger.warning("%s does not support NIC hot-plug, use NIC_HOTPLUG=force to try anyway" % self.__class__.__name__)
+        if self.nic_hotplug_enabled and (self.warm_boot or self.fleet):
+            # the saved state only covers the NICs on the command line
+            self.logger.warning("NIC hot-plug does not work with warm boot or fleet mode, disabling it")
+            self.nic_hotplug_enabled = False
+        self.nic_listener = None
+        self.nic_lock = threading.Lock()
+        # hot-plug NICs with qemu and connections of the links of hot-plug
+        # NICs waiting for qemu to start
+        self.nics_plugged = set()
+        self.nics_pending = {}
+
+        # density mode: give the memory an idle VM does not need back to the
+        # host. DENSITY_BALLOON=force adds a balloon on any platform
+        self.density = bool_from_env("DENSITY_MODE")
+        density_balloon = os.getenv("DENSITY_BALLOON", "1").lower()
+        self.use_balloon = self.density and (density_balloon == "force"
+                                             or (self.has_balloon_driver and density_balloon in ("1", "true", "yes")))
+        self.density_shrink = self.density and bool_from_env("DENSITY_SHRINK")
+        self.memory_floor_mb = int(os.getenv("MEMORY_FLOOR_MB", "0")) or self.memory_floor
+        if self.density:
+            density.enable_ksm()
+
+        # guest RAM on hugepages, HUGEPAGES=1 for the largest size there are
+        # enough free of or the size like HUGEPAGES=1G, see hugepages.py
+        self.hugepage_size = os.getenv("HUGEPAGES", "").strip()
+        if self.hugepage_size.lower() in ("", "0", "false", "no"):
+            self.hugepage_size = None
+        elif self.hugepage_size.lower() in ("1", "true", "yes", "auto"):
+            self.hugepage_size = "auto"
+        if self.hugepage_size and self.fleet:
+            # clones share the RAM of the golden VM through the page cache
+            self.logger.warning("Hugepages do not work with fleet mode, not using them")
+            self.hugepage_size = None
+        if self.hugepage_size and self.density:
+            self.logger.warning("Memory on hugepages cannot be given back to the host in density mode")
+        # the size in kB of the hugepages guest RAM is on at the moment
+        self.hugepages_used = None
+
+        # CPU_PINNING=1, or a placement hint in VR_CPUS or VR_NUMA_NODE, pins
+        # the threads of qemu to CPUs of their own, see placement.py
+        self.cpu_pinning = (bool_from_env("CPU_PINNING") or bool(os.getenv("VR_CPUS"))
+                            or bool(os.getenv("VR_NUMA_NODE")))
+        # boot slots shared with the other containers on the host, set by the
+        # VR, see admission.py
+        self.admission = None
+
+        # the CPUs claimed for this VM, the NUMA node they are on and the CPU
+        # of every vCPU thread
+        self.cpus = None
+        self.numa_node = None
+        self.vcpu_pinning = None
+
+        # set after a block sent by send_config() failed, the rest of the
+        # configuration is then typed one line at a time
+        self.config_line_mode = bool_from_env("CONFIG_LINE_MODE")
+        # lines, seconds, mode and result of every send_config() block
+        self.config_timing = []
+
         self.qemu_args = ["qemu-system-x86_64", "-display", "none", "-machine", "pc" ]
         self.qemu_args.extend(["-monitor", "tcp:0.0.0.0:40%02d,server,nowait" % self.num])
-        self.qemu_args.extend(["-m", str(ram),
-                               "-serial", "telnet:0.0.0.0:50%02d,server,nowait" % self.num])
+        self.qemu_args.extend(["-qmp", "unix:%s,server,nowait" % self.qmp_socket])
+        # the serial console is captured from boot to exit through the log
+        # file of its chardev, CONSOLE_LOG=0 to disable, see consolelog.py
+        self.console_log = None
+        self.console_tap = None
+        self.qemu_args.extend(["-m", str(ram)])
+        if bool_from_env("CONSOLE_LOG", True):
+            self.console_log = consolelog.ConsoleLog.from_env(f"{self.__class__.__name__}-{self.num}")
+            self.console_tap = consolelog.ConsoleTap(event_loop(), "/run/console%d.fifo" % self.num,
+                                                     self.console_log)
+            self.qemu_args.extend(["-chardev", "socket,id=serial0,host=0.0.0.0,port=50%02d,telnet=on,server=on,"
+                                   "wait=off,logfile=%s,logappend=on" % (self.num, self.console_tap.path),
+                                   "-serial", "chardev:serial0"])
+        else:
+            self.qemu_args.extend(["-serial", "telnet:0.0.0.0:50%02d,server,nowait" % self.num])
+        self.disk_profile = diskio.DiskProfile.from_env(self.disk_interfaces, self.disk_interfaces[0])
+        # read the base image into the page cache while qemu starts, see
+        # prewarm.py. PREWARM=1 records a profile if there is none, without
+        # PREWARM it is only done if there is a profile in PREWARM_DIR
+        self.prewarm = bool_from_env("PREWARM") if os.getenv("PREWARM") else None
+        self.prewarmer = None
+        self.prewarm_stats = None
         self.pre_start_cmds, overlay_qemu_args = self.create_overlay_image()
         self.qemu_args.extend(overlay_qemu_args)
         # enable hardware assist if KVM is available
@@ -109,9 +440,9 @@ class VM:
 
 
 
-    def start(self):
-        self.logger.info("Starting %s" % self)
-
+    def gen_cmd(self):
+        """ Generate the full qemu command line for this VM
+        """
         cmd = list(self.qemu_args)
 
         # uuid
@@ -135,62 +466,482 @@ class VM:
         # generate normal NICs
         cmd.extend(self.gen_nics())
 
+        # after the NICs, so it does not take the PCI slot of one
+        if self.use_balloon:
+            cmd.extend(density.balloon_args(self.free_page_reporting))
+
+        if self.config_drive:
+            cmd.extend(configdrive.qemu_args(self.config_drive, self.config_drive_path))
+
+        return cmd
+
+    def snapshot_fingerprint(self, cmd):
+        """ Everything a saved VM state depends on
+        """
+        return {
+            'vm': str(self),
+            'image': snapshot.image_identity(self.image),
+            'version': os.getenv("VERSION"),
+            'ram': self.ram,
+            'num_nics': self.num_nics,
+            'qemu_args': snapshot.normalize_args(cmd),
+            'credentials': snapshot.secret_digest(self.username, self.password),
+        }
+
+    def persistent_fingerprint(self):
+        """ Everything the bootstrap configuration of a persistent overlay
+            depends on
+        """
+        return {
+            'vm': str(self),
+            'image': snapshot.image_identity(self.image),
+            'version': os.getenv("VERSION"),
+            'num_nics': self.num_nics,
+            'credentials': snapshot.secret_digest(self.username, self.password),
+            'extra_config': snapshot.secret_digest(*self.extra_config),
+        }
+
+    def fleet_fingerprint(self, cmd):
+        """ Everything a golden VM depends on
+
+            Credentials are not part of it, clones with other credentials than
+            the golden VM apply them in fleet_delta_config().
+        """
+        fingerprint = self.snapshot_fingerprint(cmd)
+        del fingerprint['credentials']
+        return fingerprint
+
+    def join_fleet(self, cmd):
+        """ Find the golden VM to clone this VM from
+
+            Returns the metadata of the fleet image if there is one, otherwise
+            we become the golden VM and hold the fleet image lock until it is
+            captured. Waits for another container capturing the golden VM.
+        """
+        fingerprint = self.fleet_fingerprint(cmd)
+        if self.fleet_image is None:
+            self.fleet_image = snapshot.FleetImage(os.getenv("FLEET_DIR", "/fleet"),
+                f"{self.__class__.__name__}-{self.num}-{snapshot.fingerprint_key(fingerprint)}")
+        if self.fleet_image.locked:
+            # we are the golden VM and are being restarted before capture
+            return None
+
+        self.logger.info("Waiting for fleet image %s" % self.fleet_image)
+        self.fleet_image.lock()
+        meta = self.fleet_image.matches(fingerprint)
+        if meta is not None:
+            self.fleet_image.unlock()
+            return meta
+
+        self.logger.info("No fleet image found, %s is the golden VM for %s" % (self, self.fleet_image))
+        self.fleet_image.discard()
+        if os.path.exists(self.fleet_image.ram_tmp_file):
+            os.remove(self.fleet_image.ram_tmp_file)
+        return None
+
+    def restorable_snapshot(self, cmd=None):
+        """ Return metadata of a saved state this VM can be resumed from
+        """
+        if not self.warm_boot:
+            return None
+        return self.snapshot.matches(self.snapshot_fingerprint(cmd or self.gen_cmd()))
+
+    def start(self):
+        self.logger.info("Starting %s" % self)
+        self.boot_started = time.monotonic()
+        self.boot_duration = None
+        cause = self.restart_cause
+        if cause is None and self.timeline.current is not None:
+            # a platform restarting the VM from its bootstrap_spin()
+            cause = "no progress after %d spins" % self.spins if self.spins else "restarted"
+        self.restart_cause = None
+
+        cmd = self.gen_cmd()
+        self.qemu_cmd = cmd
+        self.restoring = None
+        self.fleet_meta = None
+        snapshot_meta = None
+        if self.snapshot_restore:
+            snapshot_meta = self.restorable_snapshot(cmd)
+        if snapshot_meta is not None:
+            self.logger.info("Resuming %s from saved state %s" % (self, self.snapshot))
+            self.restoring = self.snapshot
+            # use the exact command line the state was saved with, MAC
+            # addresses and all
+            cmd = snapshot_meta['cmd'] + ["-incoming", "exec:cat %s" % self.snapshot.state_file]
+        elif self.fleet:
+            self.fleet_meta = self.join_fleet(cmd)
+            if self.fleet_meta is not None:
+                self.logger.info("Cloning %s from fleet image %s" % (self, self.fleet_image))
+                self.restoring = self.fleet_image
+                # the migration stream is loaded once the monitor is up, as
+                # ignoring shared memory has to be enabled first
+                cmd = (self.fleet_meta['cmd'] + self.fleet_image.memory_args(int(self.ram), golden=False)
+                       + ["-incoming", "defer"])
+            elif self.fleet_image.locked:
+                cmd = cmd + self.fleet_image.memory_args(int(self.ram), golden=True)
+        if self.cpu_pinning and self.cpus is None:
+            place = placement.placement()
+            if place is None:
+                self.cpu_pinning = False
+            else:
+                self.cpus = place.claim(placement.smp_count(self.qemu_args))
+                self.numa_node = place.node_of(self.cpus)
+                self.logger.info("Placing %s on CPUs %s%s" % (self, placement.format_cpulist(self.cpus),
+                    "" if self.numa_node is None else " of NUMA node %d" % self.numa_node))
+        self.hugepages_used = None
+        # guest RAM of fleet clones is the page cache of the fleet image,
+        # wherever it is
+        if not self.fleet:
+            memory_args = []
+            if self.hugepage_size:
+                memory_args = self.hugepage_args()
+            if not memory_args and self.numa_node is not None:
+                memory_args = placement.memory_args(int(self.ram), self.numa_node)
+            cmd = cmd + memory_args
+
+        self.persisted = None
+        if self.persistent and self.restoring is None:
+            self.persisted = self.persistent_overlay.matches(self.persistent_fingerprint())
+            if self.persisted is not None:
+                self.logger.info("Booting %s from persistent overlay %s, already configured"
+                                 % (self, self.persistent_overlay.overlay_file))
+            else:
+                # booting from scratch, a fresh overlay is created
+                self.persistent_overlay.discard()
+
+        kind = "boot"
+        if self.restoring is not None:
+            kind = "resume" if self.restoring is self.snapshot else "clone"
+        elif self.persisted is not None:
+            kind = "persistent"
+        self.timeline.boot(kind, cause)
         self.logger.debug(cmd)
 
+        # resuming saved state is cheap, booting is what needs a slot
+        if self.admission is not None and self.restoring is None:
+            self.admission.acquire(str(self))
+            self.timeline.mark("admitted")
+        # spins of the previous boot and time spent waiting for a slot do not
+        # count towards restarting
+        self.spins = 0
+
         # run pre-start-cmds before starting QEMU
         if self.pre_start_cmds:
             for pre_start_cmd in self.pre_start_cmds:
                 self.logger.info(f"Running pre-start-cmd: {pre_start_cmd}")
-                res = run_command(pre_start_cmd)
+                if callable(pre_start_cmd):
+                    res = pre_start_cmd()
+                else:
+                    res = run_command(pre_start_cmd)
                 self.logger.debug(f"Result: {res}")
 
+        if self.config_drive:
+            configdrive.build(self.config_drive, self.config_drive_path,
+                              self.gen_config_drive_files(), self.config_drive_label)
+
+        if self.restoring:
+            shutil.copyfile(self.restoring.overlay_file, self.overlay_disk_image)
+
+        if self.nic_hotplug_enabled and self.nic_listener is None:
+            self.nic_listener = nichotplug.NicListener(event_loop(), self.hotplug_nics(), self.plug_nic)
+            self.nic_listener.start()
+
+        if self.prewarm is not False and self.image and os.path.isfile(self.image):
+            self.prewarmer = prewarm.Prewarmer(self.image, os.getenv("PREWARM_DIR", "/prewarm"),
+                                               int(os.getenv("PREWARM_SEQUENTIAL_MB", "0")),
+                                               bool_from_env("PREWARM_RECORD"), done=self.prewarm_done)
+            if self.prewarm is None and self.prewarmer.load_profile() is None:
+                self.prewarmer = None
+            else:
+                self.prewarmer.start()
+
+        if self.console_tap is not None:
+            self.console_tap.open()
+            self.console_log.append(("\r\n[vrnetlab] %s %s%s\r\n" % (
+                kind, self, " (%s)" % cause if cause else "")).encode())
+
         self.p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                         stderr=subprocess.PIPE, universal_newlines=True)
+        self.qemu = QemuWatcher(str(self), self.p)
+        self.timeline.mark("spawn")
+        if self.cpus:
+            # threads started from here on inherit it, until pin_threads()
+            # sorts them out
+            try:
+                os.sched_setaffinity(self.p.pid, self.cpus)
+            except OSError:
+                pass
 
-        try:
-            outs, errs = self.p.communicate(timeout=2)
-            self.logger.info("STDOUT: %s" % outs)
-            self.logger.info("STDERR: %s" % errs)
-        except:
-            pass
-
-        for i in range(1, MAX_RETRIES+1):
+        if not self.attach():
+            # check_qemu() restarts it, unless it never gets anywhere
+            self.attach_failures += 1
+            if self.attach_failures >= MAX_ATTACH_FAILURES:
+                raise QemuBroken("qemu of %s failed %d times in a row before we could connect: %s"
+                                 % (self, self.attach_failures, self.qemu.failure))
+            return
+        self.attach_failures = 0
+        if self.cpus:
+            self.pin_threads()
+
+        if self.fleet_meta is not None:
+            # guest RAM comes from the fleet memory image, the migration
+            # stream only carries the device state
+            self.set_migrate_capability("x-ignore-shared")
+            self.qmp.command("migrate-incoming", {'uri': "exec:cat %s" % self.fleet_image.state_file})
+
+    def retry_connect(self, what, connect):
+        """ Call connect until it succeeds and return what it returned
+
+            qemu opens its sockets a moment after it started, we probe with a
+            pause growing from 10ms to 100ms. Returns None as soon as qemu
+            failed, raises QemuBroken after MAX_RETRIES seconds.
+        """
+        start = time.monotonic()
+        delay = 0.01
+        attempts = 0
+        while True:
+            attempts += 1
             try:
-                self.qm = telnetlib.Telnet("127.0.0.1", 4000 + self.num)
+                res = connect()
                 break
-            except:
-                self.logger.info("Unable to connect to qemu monitor (port {}), retrying in a second (attempt {})".format(4000 + self.num, i))
-                time.sleep(1)
-            if i == MAX_RETRIES:
-                raise QemuBroken("Unable to connect to qemu monitor on port {}".format(4000 + self.num))
+            except (OSError, EOFError, ValueError) as exc:
+                # the traceback references this frame and would keep the
+                # connection we return open until the garbage collector
+                # runs, vsr1000 needs it closed as soon as it drops it to
+                # connect to the console again
+                error = exc.with_traceback(None)
+            if self.qemu.failure is not None:
+                self.logger.error("Unable to connect to %s of %s: %s" % (what, self, self.qemu.failure))
+                return None
+            if time.monotonic() - start > MAX_RETRIES:
+                raise QemuBroken("Unable to connect to %s of %s: %s" % (what, self, error))
+            self.qemu.event.wait(delay)
+            delay = min(delay * 2, 0.1)
+        self.logger.debug("Connected to %s of %s in %.2fs (%d attempts)"
+                          % (what, self, time.monotonic() - start, attempts))
+        return res
+
+    def attach(self):
+        """ Connect to QMP and the serial console of qemu, both at once
+
+            Returns False if qemu failed before we got there.
+        """
+        res = {}
 
-        for i in range(1, MAX_RETRIES+1):
+        def attach_console():
             try:
-                self.tn = telnetlib.Telnet("127.0.0.1", 5000 + self.num)
-                break
-            except:
-                self.logger.info("Unable to connect to qemu monitor (port {}), retrying in a second (attempt {})".format(5000 + self.num, i))
-                time.sleep(1)
-            if i == MAX_RETRIES:
-                raise QemuBroken("Unable to connect to qemu monitor on port {}".format(5000 + self.num))
+                res['console'] = self.retry_connect("serial console on port %d" % (5000 + self.num),
+                                                    lambda: self.open_console(5000 + self.num))
+            except BaseException as exc:
+                res['error'] = exc
+
+        t = threading.Thread(target=attach_console, name="%s console" % self, daemon=True)
+        t.start()
         try:
-            outs, errs = self.p.communicate(timeout=2)
-            self.logger.info("STDOUT: %s" % outs)
-            self.logger.info("STDERR: %s" % errs)
-        except:
-            pass
+            connected = self.connect_qmp()
+        finally:
+            t.join()
+        if 'error' in res:
+            raise res['error']
+        if res['console'] is None or not connected:
+            if res['console'] is not None:
+                res['console'].close()
+            return False
+        self.tn = timeline.RecordingConsole(res['console'], self.timeline)
+        self.timeline.mark("console_connect")
+        return True
+
+    def connect_qmp(self):
+        """ Connect to QMP and hot-plug the NICs whose link connected while
+            qemu was not running
+
+            Returns False if qemu failed before we got there.
+        """
+        qm = qmp.QMP(self.qmp_socket, event_loop())
+        qm.listeners.append(self.qmp_event)
+        if self.retry_connect("QMP on %s" % self.qmp_socket, lambda: qm.connect() or qm) is None:
+            return False
+        self.vm_status = qm.command("query-status")['status']
+        self.timeline.mark("monitor_connect")
+        with self.nic_lock:
+            self.qmp = qm
+            self.nics_plugged = set()
+            pending, self.nics_pending = self.nics_pending, {}
+        for nic, conn in sorted(pending.items()):
+            self.plug_nic(nic, conn)
+        return True
+
+    def qmp_event(self, event):
+        """ Handle a QMP event, called on the event loop
+        """
+        name = event['event']
+        if name == "STOP":
+            self.vm_status = "paused"
+        elif name == "RESUME":
+            self.vm_status = "running"
+        elif name == "SHUTDOWN":
+            self.vm_status = "shutdown"
+        elif name == "GUEST_PANICKED":
+            self.vm_status = "guest-panicked"
+            if self.qemu is not None:
+                self.qemu.fail("guest panicked")
+        elif name == "BALLOON_CHANGE":
+            return
+        self.logger.debug("QMP event of %s: %s" % (self, event))
+
+    def query_status(self):
+        """ Run state of the VM, like "running" or "paused", from qemu
+        """
+        self.vm_status = self.qmp.command("query-status")['status']
+        return self.vm_status
+
+    def query_stats(self, target="vm"):
+        """ Statistics of the VM (target "vm") or its vCPUs ("vcpu") from
+            query-stats, None if qemu is too old to have it (before 7.1)
+        """
+        try:
+            return self.qmp.command("query-stats", {'target': target})
+        except qmp.QMPError as exc:
+            if exc.error_class == "CommandNotFound":
+                return None
+            raise
+
+    def balloon(self, ram_mb):
+        """ Ask the guest to shrink (or grow back) to ram_mb of RAM through
+            the virtio balloon
+        """
+        self.qmp.command("balloon", {'value': ram_mb * 1024 * 1024})
+
+    def query_balloon(self):
+        """ RAM the guest has in bytes according to the virtio balloon, None
+            if the VM has no balloon
+        """
+        try:
+            return self.qmp.command("query-balloon")['actual']
+        except qmp.QMPError as exc:
+            if exc.error_class in ("DeviceNotActive", "KVMMissingCap"):
+                return None
+            raise
+
+    def device_add(self, driver, device_id, **props):
+        props.update({'driver': driver, 'id': device_id})
+        self.qmp.command("device_add", props)
+
+    def device_del(self, device_id, timeout=10):
+        """ Remove device device_id, returns False if the guest did not
+            release it within timeout
+        """
+        self.qmp.command("device_del", {'id': device_id})
+        return self.qmp.wait_event("DEVICE_DELETED", timeout=timeout, data={'device': device_id}) is not None
+
+    def savevm(self, name):
+        """ Save an internal snapshot of the VM in its qcow2 overlay
+
+            There is no QMP command for this before qemu 6.0, so it goes
+            through the human monitor.
+        """
+        res = self.monitor_command("savevm %s" % name, timeout=600)
+        if res.strip():
+            raise qmp.QMPError("savevm", {'class': "GenericError", 'desc': res.strip()})
+
+    def send_keys(self, text, key_map=None, batch=1, hold=0.05, pause=0.05):
+        """ Type text on the keyboard of the VM
+
+            key_map maps characters to keys, see qmp.key_combos(). By default
+            every key is held down for hold seconds and followed by a pause,
+            about the pace of the sendkey monitor command, as guests drop keys
+            typed faster. With a batch of more keys, those are pressed and
+            released in a single input-send-event, without a hold time, and
+            pause follows every batch; only for guests known to keep up.
+        """
+        combos = qmp.key_combos(text, key_map)
+        if batch > 1:
+            for i in range(0, len(combos), batch):
+                events = []
+                for combo in combos[i:i+batch]:
+                    events.extend(qmp.key_events(combo))
+                self.qmp.command("input-send-event", {'events': events})
+                time.sleep(pause)
+            return
+        for combo in combos:
+            events = qmp.key_events(combo)
+            self.qmp.command("input-send-event", {'events': events[:len(combo)]})
+            time.sleep(hold)
+            self.qmp.command("input-send-event", {'events': events[len(combo):]})
+            time.sleep(pause)
+
+    def hugepage_args(self):
+        """ qemu arguments putting guest RAM on hugepages, none if the host
+            does not have enough free
+        """
+        try:
+            page_size, path = hugepages.find(int(self.ram), None if self.hugepage_size == "auto" else self.hugepage_size,
+                                             self.numa_node)
+        except hugepages.Unavailable as exc:
+            self.logger.warning("Not using hugepages for %s, falling back to normal memory: %s" % (self, exc))
+            return []
+        self.logger.info("Guest RAM of %s on %dkB hugepages from %s" % (self, page_size, path))
+        self.hugepages_used = page_size
+        return hugepages.memory_args(int(self.ram), path, self.numa_node)
+
+    def pin_threads(self):
+        """ Pin the vCPU threads of qemu to a CPU of self.cpus each and its
+            other threads to the rest
+        """
+        try:
+            vcpus = self.qmp.command("query-cpus-fast")
+            self.vcpu_pinning = placement.pin(self.p.pid, [cpu['thread-id'] for cpu in vcpus], self.cpus)
+        except (qmp.QMPError, OSError, EOFError, TimeoutError) as exc:
+            self.logger.warning("Unable to pin the threads of %s: %s" % (self, exc))
+            return
+        self.logger.info("Pinned vCPUs of %s to CPUs %s"
+                         % (self, ",".join(str(cpu) for cpu in self.vcpu_pinning.values())))
+
+    def shrink_memory(self):
+        """ Inflate the balloon of a running VM down to its memory floor
+        """
+        if not self.use_balloon:
+            self.logger.info("%s has no balloon, not shrinking it" % self)
+            return
+        if not self.memory_floor_mb or self.memory_floor_mb >= int(self.ram):
+            self.logger.info("No memory floor below %s MB for %s, not shrinking it" % (self.ram, self))
+            return
+        self.logger.info("Shrinking %s from %s MB to %d MB" % (self, self.ram, self.memory_floor_mb))
+        try:
+            self.balloon(self.memory_floor_mb)
+        except (qmp.QMPError, OSError, EOFError) as exc:
+            self.logger.warning("Unable to shrink %s: %s" % (self, exc))
+
+    def set_migrate_capability(self, capability, state=True):
+        self.qmp.command("migrate-set-capabilities",
+                         {'capabilities': [{'capability': capability, 'state': state}]})
+
+    def prewarm_done(self, stats):
+        self.prewarm_stats = stats
+        self.timeline.mark("prewarm_done")
+
+    def open_console(self, port):
+        """ Connect to a qemu chardev (serial console or monitor) on port
+
+            Returns a telnetlib.Telnet or console.Console depending on the
+            console engine, both have the same interface.
+        """
+        if self.console_engine == "asyncio":
+            return console.Console("127.0.0.1", port, loop=event_loop())
+        return telnetlib.Telnet("127.0.0.1", port)
 
     def gen_host_forwards(self, mgmt_ip='10.0.0.15', offset=2000):
         """Generate the host forward argument for qemu
         HOST_FWDS contain the ports we want to forward and allows mapping a
         container (source) port to a different destination port on the VR/VM.
-        We do a straight mapping here and let socat do the port mapping. Since
-        multiple source ports can be mapped to the same destination port, we
-        first unique the set of ports.
+        We do a straight mapping here and let the port forwarder of the VR do
+        the port mapping. Since multiple source ports can be mapped to the
+        same destination port, we first unique the set of ports.
         """
         fwd_ports = {(proto, dst_port) for proto, src_port, dst_port in HOST_FWDS}
         # hostfwd=tcp::2022-10.0.0.15:22,...
-        return ",".join("hostfwd=%s::%d-%s:%d" % (proto, port + offset, mgmt_ip, port) for proto, port in fwd_ports)
+        return ",".join("hostfwd=%s::%d-%s:%d" % (proto, port + offset, mgmt_ip, port) for proto, port in sorted(fwd_ports))
 
 
     def gen_mgmt(self):
@@ -212,19 +963,39 @@ class VM:
         return res
 
 
-    def gen_nics(self):
-        """ Generate qemu args for the normal traffic carrying interface(s)
+    def data_nics(self):
+        """ Numbers of the normal traffic carrying interface(s)
         """
-        res = []
         # vEOS-lab requires its Ma1 interface to be the first in the bus, so start normal nics at 2
         if 'vEOS-lab' in self.image:
             range_start = 2
         else:
             range_start = 1
-        for i in range(range_start, self.num_nics+1):
+        return range(range_start, self.num_nics+1)
+
+    def hotplug_nics(self):
+        """ Numbers of the data NICs that are hot-plugged instead of being
+            there at boot
+        """
+        if not self.nic_hotplug_enabled:
+            return []
+        return [i for i in self.data_nics() if i > self.hotplug_min_nics]
+
+    def nic_location(self, i):
+        """ PCI bus and address on that bus of data NIC i
+        """
+        return math.floor(i/self.nics_per_pci_bus) + 1, (i % self.nics_per_pci_bus) + 1
+
+    def gen_nics(self):
+        """ Generate qemu args for the normal traffic carrying interface(s)
+        """
+        res = []
+        hotplug_nics = self.hotplug_nics()
+        for i in self.data_nics():
+            if i in hotplug_nics:
+                continue
             # calc which PCI bus we are on and the local add on that PCI bus
-            pci_bus = math.floor(i/self.nics_per_pci_bus) + 1
-            addr = (i % self.nics_per_pci_bus) + 1
+            pci_bus, addr = self.nic_location(i)
 
             res.append("-device")
             res.append("%(nic_type)s,netdev=p%(i)02d,mac=%(mac)s,bus=pci.%(pci_bus)s,addr=0x%(addr)x" % {
@@ -239,6 +1010,55 @@ class VM:
                        % { 'i': i, 'j': i + 10000 })
         return res
 
+    def plug_nic(self, i, conn):
+        """ Hot-plug data NIC i on top of conn, the connected socket of its
+            link
+
+            Until qemu is up the connection is kept for connect_qmp(). A NIC
+            that is plugged already had its link connect again, which happens
+            when vr-xcon restarts, it is unplugged first. conn is closed once
+            qemu has its own copy.
+        """
+        netdev = "p%02d" % i
+        device = "nic%02d" % i
+        with self.nic_lock:
+            old = self.nics_pending.pop(i, None)
+            if old is not None:
+                old.close()
+            if self.qmp is None:
+                self.logger.info("Link of NIC %d connected before qemu is up, hot-plugging it once it is" % i)
+                self.nics_pending[i] = conn
+                return
+            try:
+                if i in self.nics_plugged:
+                    self.logger.info("Link of NIC %d connected again, unplugging it first" % i)
+                    if not self.device_del(device):
+                        self.logger.warning("%s did not release NIC %d, leaving its link down" % (self, i))
+                        conn.close()
+                        return
+                    self.qmp.command("netdev_del", {'id': netdev})
+                    self.nics_plugged.discard(i)
+                hotplug_start = time.monotonic()
+                self.qmp.command("getfd", {'fdname': netdev}, fd=conn.fileno())
+                self.qmp.command("netdev_add", {'type': "socket", 'id': netdev, 'fd': netdev})
+                pci_bus, addr = self.nic_location(i)
+                try:
+                    self.device_add(self.nic_type, device, netdev=netdev, mac=gen_mac(i),
+                                    bus="pci.%d" % pci_bus, addr="0x%x" % addr)
+                except qmp.QMPError:
+                    self.qmp.command("netdev_del", {'id': netdev})
+                    raise
+                self.nics_plugged.add(i)
+                self.logger.info("Hot-plugged NIC %d in %.3fs" % (i, time.monotonic() - hotplug_start))
+            except (OSError, EOFError):
+                # qemu went away, plug it into the next one
+                self.logger.warning("Unable to hot-plug NIC %d, qemu is not running" % i)
+                self.nics_pending[i] = conn
+                return
+            except qmp.QMPError as exc:
+                self.logger.error("Unable to hot-plug NIC %d: %s" % (i, exc))
+            conn.close()
+
     @property
     def overlay_disk_image(self) -> str:
         """Generate the overlay disk image name for VM instance
@@ -247,16 +1067,23 @@ class VM:
         attribute (unique per VM instance).  For example the SROS_lc(slot=1)
         first linecard uses the name sros-1-overlay.qcow2. This ensures that
         each VM gets its own overlay.
+
+        The overlay is put in OVERLAY_DIR if set, like a tmpfs or a volume,
+        instead of next to the base image. Persistent overlays are in the
+        directory of the container in PERSIST_DIR.
         """
-        return re.sub(r'(\.[^.]+$)', fr'-{self.num}-overlay\1', self.image)
+        if self.persistent:
+            return self.persistent_overlay.overlay_file
+        overlay = re.sub(r'(\.[^.]+$)', fr'-{self.num}-overlay\1', self.image)
+        if os.getenv("OVERLAY_DIR"):
+            overlay = os.path.join(os.getenv("OVERLAY_DIR"), os.path.basename(overlay))
+        return overlay
 
     def _overlay_disk_image_format(self) -> str:
-        res = run_command(["qemu-img", "info", "--output", "json", self.image])
-        if res is not None:
-            image_info = json.loads(res[0])
-            if "format" in image_info:
-                return image_info["format"]
-        raise ValueError(f"Could not read image format for {self.image}")
+        try:
+            return qcow2.image_format(self.image)
+        except OSError as exc:
+            raise ValueError(f"Could not read image format for {self.image}: {exc}") from exc
 
     def create_overlay_image(self):
         """Creates an overlay disk image
@@ -264,57 +1091,84 @@ class VM:
         *Always* create the overlay image. Return a tuple of pre-start-cmds and
         an array of parameters to extend qemu_args. A subclass may want to
         override this for using specific drive id. If the overlay image already
-        exists raise an exception.
+        exists raise an exception, unless it is a persistent one.
+
+        The overlay is created by qcow2.create(), with qemu-img unless
+        QCOW2_NATIVE=1, a pre-start-cmd can be a function as well as a
+        command.
         """
-        if os.path.exists(self.overlay_disk_image):
+        if os.path.exists(self.overlay_disk_image) and not self.persistent:
             raise Exception(f"Overlay image {self.overlay_disk_image} already exists for base {self.image}")
         self.logger.debug(f"Adding creation of overlay disk image {self.overlay_disk_image} with base {self.image} to pre_start_cmds")
         format = self._overlay_disk_image_format()
-        pre_start_cmds = ["qemu-img", "create", "-f", "qcow2", "-F", format, "-b", self.image, self.overlay_disk_image]
-        return [pre_start_cmds], ["-drive", "if=ide,file=%s" % self.overlay_disk_image]
+        os.makedirs(os.path.dirname(self.overlay_disk_image), exist_ok=True)
+        pre_start_cmds = functools.partial(self.create_overlay, format)
+        self.logger.info("Overlay disk image %s with %s" % (self.overlay_disk_image, self.disk_profile))
+        return [pre_start_cmds], self.disk_profile.qemu_args(self.overlay_disk_image)
+
+    def create_overlay(self, backing_format):
+        """ Create a fresh overlay before qemu starts, the pre-start-cmd of
+            create_overlay_image()
+
+            A persistent overlay the VM boots from is kept.
+        """
+        if self.persisted is not None:
+            return
+        qcow2.create(self.overlay_disk_image, backing_file=self.image, backing_format=backing_format)
 
     def stop(self):
         """ Stop this VM
         """
         self.running = False
+        self.running_since = None
+        if self.admission is not None:
+            self.admission.release(str(self))
+
+        with self.nic_lock:
+            if self.qmp is not None:
+                self.qmp.close()
+                self.qmp = None
+        self.vm_status = None
 
         try:
             self.p.terminate()
         except ProcessLookupError:
             return
 
+        # the output of qemu is consumed by the QemuWatcher threads, so only
+        # wait for the process here
         try:
-            self.p.communicate(timeout=10)
-        except:
-            try:
-                # this construct is included as an example at
-                # https://docs.python.org/3.6/library/subprocess.html but has
-                # failed on me so wrapping in another try block. It was this
-                # communicate() that failed with:
-                # ValueError: Invalid file object: <_io.TextIOWrapper name=3 encoding='ANSI_X3.4-1968'>
-                self.p.kill()
-                self.p.communicate(timeout=10)
-            except:
-                # just assume it's dead or will die?
-                self.p.wait(timeout=10)
-
-    def restart(self):
+            self.p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.p.kill()
+            self.p.wait(timeout=10)
+        # the last words of the VM go to disk
+        if self.console_tap is not None:
+            self.console_tap.flush()
+
+    def restart(self, cause=None):
         """ Restart this VM
 
         Also removes the overlay disk image, effectively restoring the state of
-        the VM to initial image.
+        the VM to initial image. cause is recorded on the timeline.
         """
+        self.restart_cause = cause
         self.stop()
+        if self.persistent:
+            # not to be booted from without the bootstrap configuration
+            self.persistent_overlay.discard()
         if os.path.exists(self.overlay_disk_image):
             os.remove(self.overlay_disk_image)
         self.start()
 
 
-    def wait_write(self, cmd, wait='#', con=None):
+    def wait_write(self, cmd, wait='#', con=None, timeout=None):
         """ Wait for something on the serial port and then send command
 
             Defaults to using self.tn as connection but this can be overridden
-            by passing a telnetlib.Telnet object in the con argument.
+            by passing a telnetlib.Telnet or console.Console object in the con
+            argument. With a timeout, the command is sent after timeout
+            seconds even if we did not see what we were waiting for.
         """
         con_name = 'custom con'
         if con is None:
@@ -322,75 +1176,429 @@ class VM:
 
         if con == self.tn:
             con_name = 'serial console'
-        if con == self.qm:
-            con_name = 'qemu monitor'
 
         if wait:
             self.logger.trace("waiting for '%s' on %s" % (wait, con_name))
-            res = con.read_until(wait.encode())
-            self.logger.trace("read from %s: %s" % (con_name, res.decode()))
+            res = con.read_until(wait.encode(), timeout)
+            self.logger.trace("read from %s: %s", con_name, LazyDecode(res))
         self.logger.debug("writing to %s: %s" % (con_name, cmd))
         con.write("{}\r".format(cmd).encode())
 
 
+    def send_config(self, lines, wait='#', timeout=30, errors=None):
+        """ Send a block of configuration lines without waiting for the
+            prompt after every line
+
+            Like wait_write(), waits for the prompt before sending and leaves
+            the prompt after the last line for the next wait_write(). Instead
+            of a prompt round trip per line, lines are streamed with up to
+            config_window lines in flight, the echo of each line from the
+            router is the flow control. Once all lines are echoed we wait for
+            a single prompt and scan all of the output for errors, a list of
+            regexes which defaults to config_errors.
+
+            The echo of a line has to follow a line break or the prompt and,
+            unless the line is longer than config_echo_width, be followed by
+            a line break, so lines sharing their start do not stand in for
+            each other. If an echo does not show up within timeout, which
+            happens when a slow console drops input, or an error is found,
+            the block is sent again one line at a time with wait_write() and
+            this and all later blocks use line mode. As parsers of IOS-like
+            CLIs fall back to the parent mode for commands they do not know in
+            a sub mode, a block of lines within one configuration mode can be
+            sent again from the start.
+
+            Returns True if the block was applied without errors in bulk mode.
+        """
+        lines = list(lines)
+        start = time.monotonic()
+        if self.config_line_mode:
+            for line in lines:
+                self.wait_write(line, wait, timeout=timeout)
+            self._log_config_timing(lines, start, "line", True)
+            return False
+
+        con = self.tn
+        if wait:
+            con.read_until(wait.encode(), timeout)
+        if errors is None:
+            errors = self.config_errors
+        errors = [re.compile(e) for e in errors]
+        # the echo is preceded by a line break or the prompt, or by nothing
+        # when they were read with the echo of the line before
+        echo_start = rb"(?:\A|[\r\n]|%s) ?" % re.escape(wait.encode()) if wait else rb"(?:\A|[\r\n])"
+        output = []
+        sent = 0
+        ok = True
+        for echoed, line in enumerate(lines):
+            while sent < len(lines) and sent - echoed < self.config_window:
+                self.logger.debug("writing to serial console: %s" % lines[sent])
+                con.write("{}\r".format(lines[sent]).encode())
+                sent += 1
+            echo = line.strip().encode()
+            if not echo:
+                continue
+            if len(echo) > self.config_echo_width:
+                # long lines may be scrolled or wrapped by the router, only
+                # the start of the echo is reliable
+                echo = echo_start + re.escape(echo[:self.config_echo_width])
+            else:
+                echo = echo_start + re.escape(echo) + rb"[ \t]*[\r\n]"
+            _, match, res = con.expect([echo], timeout)
+            output.append(res)
+            if match is None:
+                self.logger.warning("no echo of '%s' within %ss" % (line, timeout))
+                ok = False
+                break
+        if ok:
+            res = con.read_until(wait.encode(), timeout) if wait else con.read_very_eager()
+            output.append(res)
+            if wait and not res.endswith(wait.encode()):
+                self.logger.warning("no prompt after configuration block within %ss" % timeout)
+                ok = False
+        output = b"".join(output)
+        self.logger.trace("OUTPUT: %s", LazyDecode(output))
+        for regex in errors:
+            for m in regex.finditer(output):
+                line_start = output.rfind(b"\n", 0, m.start()) + 1
+                line_end = output.find(b"\n", m.end())
+                self.logger.warning("configuration error: %s" % output[line_start:line_end if line_end != -1 else None].decode(errors="replace").strip())
+                ok = False
+
+        if ok:
+            if wait:
+                # a prompt for the next wait_write()
+                con.write(b"\r")
+            self._log_config_timing(lines, start, "bulk", True)
+            return True
+
+        self._log_config_timing(lines, start, "bulk", False)
+        self.logger.warning("falling back to sending configuration one line at a time")
+        self.config_line_mode = True
+        start = time.monotonic()
+        self.wait_write("", wait=None)
+        for line in lines:
+            self.wait_write(line, wait, timeout=timeout)
+        self._log_config_timing(lines, start, "line", True)
+        return False
+
+    def _log_config_timing(self, lines, start, mode, ok):
+        duration = time.monotonic() - start
+        self.config_timing.append({'lines': len(lines), 'seconds': round(duration, 3),
+                                   'mode': mode, 'ok': ok})
+        self.logger.info("sent %d configuration lines in %s mode in %.2fs%s" %
+                         (len(lines), mode, duration, "" if ok else ", failed"))
+
+
     def work(self):
         self.check_qemu()
+        if self.qemu.failure is not None:
+            # failed while starting, restarted on the next round
+            return
         if not self.running:
             try:
-                self.bootstrap_spin()
+                if self.restoring:
+                    self.restore_spin()
+                elif self.persisted is not None:
+                    self.persist_spin()
+                else:
+                    self.bootstrap_spin()
             except EOFError:
                 self.logger.error("Telnet session was disconnected, restarting")
-                self.restart()
+                self.restart("console disconnected")
+                return
+            if self.running:
+                self.timeline.mark("running")
+                if self.prewarmer is not None:
+                    self.prewarmer.record()
+                    self.prewarmer = None
+            if self.running and not self.restoring:
+                if self.fleet_image is not None and self.fleet_image.locked:
+                    self.capture_golden()
+                elif self.warm_boot:
+                    self.save_snapshot()
+            if self.running and self.persistent and self.persisted is None:
+                self.stamp_overlay()
+            if self.running and self.density_shrink:
+                self.shrink_memory()
+            if self.running and self.admission is not None:
+                self.admission.release(str(self))
 
     def bootstrap_spin(self):
         raise NotImplementedError()
 
+    def gen_bootstrap_config(self):
+        """ Bootstrap configuration as a list of lines
+
+            Rendered from the username, password, self.mgmt_address and
+            self.extra_config. Platforms using a config drive implement this.
+        """
+        raise NotImplementedError()
+
+    @property
+    def config_drive_path(self):
+        if self.config_drive == "tftp":
+            return os.path.join(configdrive.TFTP_DIR, self.config_drive_file)
+        return "/config-drive%d.%s" % (self.num, "iso" if self.config_drive == "iso" else "img")
+
+    def gen_config_drive_files(self):
+        """ Files to put on the config drive, a dict of file name to content
+        """
+        config = "".join(line + self.config_drive_newline for line in self.gen_bootstrap_config())
+        return {self.config_drive_file: config}
+
+    def restore_spin(self):
+        """ Wait for a VM resuming from saved state to be running again
+
+            The saved state was taken after the bootstrap configuration was
+            applied, so there is nothing to do on the console.
+        """
+        if self.query_status() == "running":
+            if self.fleet_meta is not None:
+                try:
+                    self.fleet_delta_config()
+                except NotImplementedError as exc:
+                    self.logger.warning("Unable to clone %s from the golden VM (%s), booting from scratch" % (self, exc))
+                    self.fleet = False
+                    self.restart("fleet clone not supported: %s" % exc)
+                    return
+            self.tn.close()
+            startup_time = datetime.datetime.now() - self.start_time
+            self.logger.info("Resumed from saved state, startup complete in: %s" % startup_time)
+            self.running = True
+            return
+
+        if time.monotonic() - self.boot_started > 300:
+            self.logger.warning("%s did not resume from %s, discarding it and restarting" % (self, self.restoring))
+            self.restoring.discard()
+            self.restart("resume from saved state timed out")
+            return
+
+        time.sleep(1)
+
+    def persist_spin(self):
+        """ Wait for a VM booting from its persistent overlay to come up
+
+            The overlay has the bootstrap configuration already, the VM is up
+            once the NOS shows one of login_prompts on the serial console. A
+            VM that does not get there boots from scratch.
+        """
+        if self.spins > self.persist_spins:
+            self.logger.warning("%s did not come up from persistent overlay %s, booting from scratch"
+                                % (self, self.persistent_overlay.overlay_file))
+            self.restart("no login prompt booting from persistent overlay")
+            return
+
+        (ridx, match, res) = self.tn.expect(self.login_prompts, 1)
+        if match:
+            self.tn.close()
+            startup_time = datetime.datetime.now() - self.start_time
+            self.logger.info("Up from persistent overlay, startup complete in: %s" % startup_time)
+            self.running = True
+            return
+
+        if res != b'':
+            self.logger.trace("OUTPUT: %s", LazyDecode(res))
+            self.spins = 0
+        elif self.spins % 10 == 9:
+            # the prompt may have gone by before we were connected
+            self.wait_write("", wait=None)
+        self.spins += 1
+
+    def stamp_overlay(self):
+        """ Record that the persistent overlay has the bootstrap configuration
+        """
+        self.persistent_overlay.write_meta(self.persistent_fingerprint(), self.qemu_cmd)
+        self.logger.info("Stamped persistent overlay %s, %s boots from it without configuring it again"
+                         % (self.persistent_overlay.overlay_file, self))
+
+    def fleet_delta_config(self):
+        """ Apply the per-instance configuration to a fleet clone
+
+            Clones resume with the configuration of the golden VM, which may
+            have been bootstrapped with another username / password, the
+            username is in self.fleet_meta['username'], and has the hostname
+            of the golden VM. Platforms that support fleet mode implement
+            this to apply the hostname and credentials of the clone and raise
+            NotImplementedError to boot it from scratch instead. By default
+            clones keep the configuration of the golden VM, so only clones
+            with the same credentials are supported.
+        """
+        if self.fleet_meta['credentials'] != snapshot.secret_digest(self.username, self.password):
+            raise NotImplementedError(f"{self.__class__.__name__} clones must use the credentials of the golden VM")
+
+    def migrate_to_file(self, path, timeout=600):
+        """ Migrate the state of the (stopped) VM to a file
+
+            Returns True if the migration completed. The file is written under
+            a temporary name and only renamed into place once complete.
+        """
+        migrate_start = time.monotonic()
+        tmp_path = path + ".tmp"
+        # get MIGRATION events rather than polling query-migrate
+        self.set_migrate_capability("events")
+        self.qmp.discard_events("MIGRATION")
+        self.qmp.command("migrate", {'uri': "exec:cat > %s" % tmp_path})
+        status = None
+        while time.monotonic() - migrate_start < timeout:
+            event = self.qmp.wait_event("MIGRATION", timeout=timeout - (time.monotonic() - migrate_start))
+            if event is None:
+                break
+            status = event['data']['status']
+            if status in ("completed", "failed", "cancelled"):
+                break
+        if status != "completed":
+            self.logger.warning("Migrating state of %s to %s failed (migration status: %s)" % (self, path, status))
+            self.qmp.command("migrate_cancel")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.rename(tmp_path, path)
+        return True
+
+    def save_snapshot(self):
+        """ Save the complete state of the VM for later warm boots
+
+            The VM is paused while its RAM and device state is migrated to a
+            file and the overlay disk image is copied, then it is resumed.
+        """
+        self.logger.info("Saving state of %s to %s" % (self, self.snapshot))
+        save_start = time.monotonic()
+        os.makedirs(self.snapshot.directory, exist_ok=True)
+        self.snapshot.discard()
+        self.qmp.command("stop")
+        try:
+            if not self.migrate_to_file(self.snapshot.state_file):
+                return
+            shutil.copyfile(self.overlay_disk_image, self.snapshot.overlay_file)
+            self.snapshot.write_meta(self.snapshot_fingerprint(self.qemu_cmd), self.qemu_cmd)
+            self.snapshot_restore = True
+            self.logger.info("Saved state of %s in %.1fs" % (self, time.monotonic() - save_start))
+        finally:
+            self.qmp.command("cont")
+
+    def capture_golden(self):
+        """ Capture the golden VM into the fleet image and become a clone
+
+            The guest RAM is already in the fleet memory image, so only the
+            device state is migrated. The golden VM must not touch its memory
+            after that, so rather than resuming it we restart it as a clone.
+        """
+        self.logger.info("Capturing golden VM %s to %s" % (self, self.fleet_image))
+        capture_start = time.monotonic()
+        self.qmp.command("stop")
+        self.set_migrate_capability("x-ignore-shared")
+        try:
+            captured = self.migrate_to_file(self.fleet_image.state_file)
+            if captured:
+                shutil.copyfile(self.overlay_disk_image, self.fleet_image.overlay_file)
+                os.rename(self.fleet_image.ram_tmp_file, self.fleet_image.ram_file)
+                self.fleet_image.write_meta(self.fleet_fingerprint(self.qemu_cmd), self.qemu_cmd,
+                    username=self.username,
+                    credentials=snapshot.secret_digest(self.username, self.password))
+                self.logger.info("Captured golden VM %s in %.1fs" % (self, time.monotonic() - capture_start))
+        finally:
+            self.fleet_image.unlock()
+
+        if captured:
+            self.restart("golden VM captured, restarting as a clone")
+        else:
+            # keep running as a plain VM, the next container gets to try
+            self.fleet = False
+            self.qmp.command("cont")
+
+    def monitor_command(self, cmd, timeout=10):
+        """ Run a human monitor command and return its output
+
+            For the odd command without a QMP equivalent, use self.qmp for
+            everything else.
+        """
+        self.logger.debug("human monitor command: %s" % cmd)
+        return self.qmp.command("human-monitor-command", {'command-line': cmd}, timeout=timeout)
+
     def check_qemu(self):
-        """ Check health of qemu. This is mostly just seeing if there's error
-            output on STDOUT from qemu which means we restart it.
+        """ Check health of qemu, restart it if it has exited or reported a
+            fatal error.
+
+            This never blocks, the QemuWatcher has already done the waiting.
         """
         if self.p is None:
             self.logger.debug("VM not started; starting!")
             self.start()
 
-        # check for output
-        try:
-            outs, errs = self.p.communicate(timeout=1)
-        except subprocess.TimeoutExpired:
+        if self.qemu.failure is None:
             return
-        self.logger.info("STDOUT: %s" % outs)
-        self.logger.info("STDERR: %s" % errs)
 
-        if errs != "":
-            self.logger.debug("KVM error, restarting")
-            self.stop()
-            self.start()
+        if self.restoring:
+            self.logger.warning("Resuming from saved state failed, discarding %s" % self.restoring)
+            self.restoring.discard()
+        self.logger.error("%s: %s, restarting" % (self, self.qemu.failure))
+        self.restart_cause = self.qemu.failure
+        self.stop()
+        if self.console_log is not None:
+            self.logger.info("Last console output of %s:\n%s"
+                             % (self, self.console_log.tail(CRASH_CONSOLE_BYTES).decode(errors="replace")))
+        self.start()
 
-    def wait_config(self, show_cmd, expect, spins=90):
+    def wait_config(self, show_cmd, expect, spins=90, events=None):
         """ Some configuration takes some time to "show up".
             To make sure the device is really ready, wait here.
+
+            show_cmd is run until expect shows up in its output, which is
+            matched as it arrives. Once the prompt is back without it, the
+            command is run again after a short pause that grows from 0.5s up
+            to 10s. Prefer commands filtering their output down to what we
+            are after over full configuration dumps. If expect is part of
+            show_cmd, like with "| include", it has to start a line of the
+            output so the echo of the command does not match.
+
+            events are patterns of console messages, like the syslog of an
+            interface coming up, that mean the same as expect. Gives up after
+            spins * 10 seconds.
         """
         self.logger.debug('waiting for {} to appear in {}'.format(expect, show_cmd))
-        wait_spins = 0
-        # 10s * 90 = 900s = 15min timeout
-        while wait_spins < spins:
+        start = time.monotonic()
+        deadline = start + spins * 10
+        pattern = re.escape(expect.encode('UTF-8'))
+        if expect in show_cmd:
+            pattern = rb"[\r\n][ \t]*" + pattern
+        wanted = [pattern] + list(events or [])
+        delay = 0.5
+        polls = 0
+        while time.monotonic() < deadline:
             # On some devices (Huawei VRP), the command to disable paging
             # only has a temporary effect?!
             # To make sure we're not getting paged output, send the no_paging_command
             # always, if the attribute exists on the extended VM class.
             try:
                 self.wait_write(self.no_paging_command, wait=None)
+                self.tn.expect([self.cli_prompt], 1)
             except AttributeError:
                 pass
             self.wait_write(show_cmd, wait=None)
-            _, match, data = self.tn.expect([expect.encode('UTF-8')], timeout=10)
-            self.logger.trace(data.decode('UTF-8'))
+            polls += 1
+            idx, match, data = self.tn.expect(wanted + [self.cli_prompt],
+                                              min(10, max(0, deadline - time.monotonic())))
+            self.logger.trace(data.decode('UTF-8', errors='replace'))
+            if match and idx < len(wanted):
+                break
+            # the output is complete (or taking long), watch the console
+            # until polling again
+            idx, match, data = self.tn.expect(wanted, min(delay, max(0, deadline - time.monotonic())))
             if match:
-                self.logger.debug('a wild {} has appeared!'.format(expect))
-                return True
-            wait_spins += 1
-        self.logger.error('{} not found in {}'.format(expect, show_cmd))
-        return False
+                # we read the prompt already, a console message does not
+                # bring it back, so get a new one for the next wait_write()
+                self.wait_write("", wait=None)
+                break
+            delay = min(delay * 2, 10)
+        else:
+            self.logger.error('{} not found in {} after {:.1f}s'.format(expect, show_cmd, time.monotonic() - start))
+            return False
+        how = show_cmd if idx == 0 else "console message"
+        self.logger.info('{} ready after {:.1f}s ({} polls, seen in {})'.format(
+            expect, time.monotonic() - start, polls, how))
+        self.timeline.mark("ready", expect)
+        return True
 
     @property
     def version(self):
@@ -409,6 +1617,26 @@ class VR:
     def __init__(self, username, password):
         self.logger = logging.getLogger()
         self.vms = []
+        signal.signal(signal.SIGCHLD, handle_SIGCHLD)
+        # forward management ports in-process, set PORT_FORWARDER=socat to
+        # use one socat process per port instead
+        self.port_forwarder = None
+        if os.getenv("PORT_FORWARDER", "builtin") != "socat":
+            self.port_forwarder = portfwd.PortForwarder(event_loop())
+        # health and boot timelines over HTTP, STATUS_PORT=0 to disable, and
+        # on a unix socket, STATUS_SOCKET= (empty) to disable
+        self.status_port = int(os.getenv("STATUS_PORT", "9099"))
+        self.status_socket = os.getenv("STATUS_SOCKET", "/run/vrnetlab-status.sock")
+        # the console output is only served on the unix socket, the port has
+        # no authentication, STATUS_CONSOLE_TCP=1 serves it there as well
+        self.status_console_tcp = os.getenv("STATUS_CONSOLE_TCP", "0") == "1"
+        self.status_server = None
+        self.health_status = None
+        self.started = time.monotonic()
+        # host resources used by the VMs, for metrics()
+        self.resources = resources.ResourceCollector(lambda: self.vms)
+        # limits how many routers boot at once on the host, see admission.py
+        self.admission = admission.Admission.from_env()
 
         try:
             os.mkdir("/tftpboot")
@@ -416,9 +1644,140 @@ class VR:
             pass
 
     def update_health(self, exit_status, message):
-        health_file = open("/health", "w")
-        health_file.write("%d %s" % (exit_status, message))
-        health_file.close()
+        """ Write the health status to /health when it changed
+
+            The file has a single line, the exit status for the docker health
+            check followed by a message. It is replaced atomically so the
+            health check never reads half of it. The details are served by
+            the status server.
+        """
+        if (exit_status, message) == self.health_status:
+            return
+        self.health_status = (exit_status, message)
+        with open("/health.tmp", "w") as health_file:
+            health_file.write("%d %s\n" % (exit_status, message))
+        os.replace("/health.tmp", "/health")
+
+    def health(self):
+        """ Health of the virtual router and its VMs as a dict
+        """
+        exit_status, message = self.health_status or (1, "starting")
+        res = {
+            'status': exit_status,
+            'message': message,
+            'uptime': round(time.monotonic() - self.started, 1),
+            'vms': {},
+        }
+        for vm in self.vms:
+            res['vms'][str(vm)] = {
+                'running': vm.running,
+                'status': vm.vm_status,
+                'phase': vm.timeline.phase(),
+                'restarts': sum(vm.timeline.restarts.values()),
+                'uptime': round(time.monotonic() - vm.running_since, 1) if vm.running_since is not None else None,
+                'boot_duration': vm.boot_duration,
+                'prewarm': vm.prewarm_stats,
+                'hugepages_kb': vm.hugepages_used,
+                'cpus': placement.format_cpulist(vm.cpus) if vm.cpus else None,
+                'numa_node': vm.numa_node,
+                'nics_plugged': sorted(vm.nics_plugged) if vm.nic_hotplug_enabled else None,
+                'console': vm.console_log.stats() if vm.console_log is not None else None,
+                'timeline': vm.timeline.as_dict(),
+            }
+            if vm.density:
+                res['vms'][str(vm)]['memory'] = self.memory_report(vm)
+        if self.port_forwarder is not None:
+            res['port_forwarding'] = self.port_forwarder.stats()
+        if self.admission is not None:
+            res['boot_slot'] = {'held': self.admission.slot, 'waited': round(self.admission.waited, 1)}
+        return res
+
+    def memory_report(self, vm):
+        """ How much memory vm gave back in density mode, for the health
+            status
+        """
+        res = self.resources.collect().get(str(vm))
+        if res is None:
+            return None
+        return {
+            'ram_bytes': res['ram_bytes'],
+            'balloon_bytes': res['balloon_bytes'],
+            'resident_bytes': res['process']['rss_bytes'] if res['process'] is not None else None,
+            'ksm_merged_bytes': res['ksm_bytes'],
+            'returned_bytes': resources.memory_returned(res),
+        }
+
+    def metrics(self):
+        """ Metrics of the virtual router for status.format_metrics()
+        """
+        running, duration, phases, events, restarts, console_bytes = [], [], [], [], [], []
+        for vm in self.vms:
+            labels = {'vm': str(vm)}
+            running.append((labels, int(vm.running)))
+            if vm.console_log is not None:
+                console_bytes.append((labels, vm.console_log.stats()['bytes']))
+            tl = vm.timeline.as_dict()
+            for cause, count in tl['restarts'].items():
+                restarts.append((dict(labels, cause=cause), count))
+            if not tl['boots']:
+                continue
+            completed = [boot for boot in tl['boots'] if boot['duration'] is not None]
+            if completed:
+                duration.append((dict(labels, kind=completed[-1]['kind']), completed[-1]['duration']))
+            boot = tl['boots'][-1]
+            for phase, seconds in boot['phases'].items():
+                phases.append((dict(labels, phase=phase), seconds))
+            for event in boot['events']:
+                if event['event'] in timeline.MILESTONES:
+                    events.append((dict(labels, event=event['event']), event['at']))
+
+        metrics = [
+            ("vrnetlab_up", "gauge", "1 if all VMs are running",
+             [({}, int(self.health_status is not None and self.health_status[0] == 0))]),
+            ("vrnetlab_vm_running", "gauge", "1 if the VM is running", running),
+            ("vrnetlab_vm_boot_duration_seconds", "gauge", "time the last completed boot took to reach running", duration),
+            ("vrnetlab_vm_boot_phase_seconds", "gauge",
+             "time the current boot took to reach a milestone from the previous one", phases),
+            ("vrnetlab_vm_boot_event_seconds", "gauge", "time from start of the current boot to a milestone", events),
+            ("vrnetlab_vm_restarts_total", "counter", "restarts of the VM by cause", restarts),
+            ("vrnetlab_vm_console_bytes_total", "counter", "output of the VM on its serial console", console_bytes),
+        ]
+        if self.port_forwarder is not None:
+            stats = self.port_forwarder.stats()
+            for name, key, help_text in (("connections", "connections", "connections (UDP: peers) forwarded"),
+                                         ("failures", "failed", "connections that could not be forwarded"),
+                                         ("received_bytes", "bytes_in", "bytes forwarded to the virtual router"),
+                                         ("sent_bytes", "bytes_out", "bytes forwarded from the virtual router")):
+                metrics.append(("vrnetlab_port_forward_%s_total" % name, "counter", help_text,
+                                [({'port': port}, counters[key]) for port, counters in sorted(stats.items())]))
+        metrics.extend(resources.metrics(self.resources.collect()))
+        return metrics
+
+    def console(self, vm_name, nbytes):
+        """ The last nbytes of console output of the VM called vm_name, None
+            if there is no such VM or its console is not captured
+        """
+        for vm in self.vms:
+            if str(vm) == vm_name and vm.console_log is not None:
+                return vm.console_log.tail(nbytes)
+        return None
+
+    def start_status_server(self):
+        if not self.status_port and not self.status_socket:
+            return
+        self.status_server = status.StatusServer(event_loop(), self.status_port, self.health, self.metrics,
+                                                 self.status_socket, self.console, self.status_console_tcp)
+        self.status_server.start()
+
+    def start_port_forwarding(self, src_offset=0, dst_offset=2000):
+        """ Forward the HOST_FWDS ports of the container to the host forwards
+            of qemu user mode networking (see VM.gen_host_forwards)
+        """
+        if self.port_forwarder is None:
+            self.start_socat(src_offset, dst_offset)
+            return
+        for proto, src_port, dst_port in HOST_FWDS:
+            self.port_forwarder.add(proto, src_port + src_offset, "127.0.0.1", dst_port + dst_offset)
 
     def start_socat(self, src_offset=0, dst_offset=2000):
         for proto, src_port, dst_port in HOST_FWDS:
@@ -428,22 +1787,65 @@ class VR:
                          "%s:127.0.0.1:%d" % (proto.upper(), dst_port + dst_offset)],
                          background=True)
 
+    def supervise(self, vm):
+        """ Drive the bootstrap state machine of a single VM
+
+            Every VM gets its own thread running this loop so that a VM
+            blocking on its serial console or qemu process does not hold up
+            the other VMs of a multi-VM router (vMX VCP + vFPC, distributed
+            SROS etc). Any exception is handed over to the main thread.
+        """
+        try:
+            was_running = False
+            while True:
+                vm.work()
+                if vm.running and not was_running:
+                    vm.running_since = time.monotonic()
+                    vm.boot_duration = vm.running_since - vm.boot_started
+                    self.logger.info("%s running, boot took %.1fs" % (vm, vm.boot_duration))
+                was_running = vm.running
+                if vm.running:
+                    # nothing to do until qemu fails
+                    vm.qemu.event.wait(1)
+        except BaseException as exc:
+            self.logger.exception("%s supervisor failed" % vm)
+            self.vm_failure = exc
+
     def start(self):
         """ Start the virtual router
         """
         self.logger.debug("Starting vrnetlab %s", self)
         self.logger.debug("VMs: %s", self.vms)
-        self.start_socat()
+        self.start_port_forwarding()
+        self.start_status_server()
 
-        started = False
-        while True:
-            all_running = True
+        # only resume from saved state if all VMs can, mixing resumed and
+        # freshly booted VMs of the same router is asking for trouble
+        if any(vm.warm_boot for vm in self.vms) and not all(vm.restorable_snapshot() for vm in self.vms):
+            self.logger.info("Not all VMs have a usable saved state, booting from scratch")
             for vm in self.vms:
-                vm.work()
-                if not vm.running:
-                    all_running = False
+                vm.snapshot_restore = False
 
-            if all_running:
+        self.vm_failure = None
+        start_time = time.monotonic()
+        for vm in self.vms:
+            vm.admission = self.admission
+        for vm in self.vms:
+            threading.Thread(target=self.supervise, args=(vm,), name=str(vm), daemon=True).start()
+
+        started = False
+        while True:
+            if self.vm_failure is not None:
+                raise self.vm_failure
+
+            if all(vm.running for vm in self.vms):
+                if not started:
+                    # boot_duration is set by the supervisor thread right after
+                    # the VM reports running, it may lag behind by a moment
+                    self.logger.info("All VMs running in %.1fs (%s)" % (
+                        time.monotonic() - start_time,
+                        ", ".join("%s: %s" % (vm, "%.1fs" % vm.boot_duration if vm.boot_duration is not None else "n/a")
+                                  for vm in self.vms)))
                 self.update_health(0, "running")
                 started = True
             else:
@@ -451,11 +1853,13 @@ class VR:
                     self.update_health(1, "VM failed - restarting")
                 else:
                     self.update_health(1, "starting")
+            time.sleep(1)
 
 class VR_Installer:
     def __init__(self):
         self.logger = logging.getLogger()
         self.vm = None
+        signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
     def install(self):
         vm =  self.vm
@@ -7,20 +7,15 @@ import random
 import re
 import signal
 import sys
-import telnetlib
 import time
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -82,7 +77,7 @@ class NXOS_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -97,12 +92,13 @@ class NXOS_vm(vrnetlab.VM):
         self.logger.info("applying bootstrap configuration")
         self.wait_write("", None)
         self.wait_write("configure")
-        self.wait_write("username %s password 0 %s role network-admin" % (self.username, self.password))
-
-        # configure mgmt interface
-        self.wait_write("interface mgmt0")
-        self.wait_write("ip address 10.0.0.15/24")
-        self.wait_write("exit")
+        self.send_config([
+            "username %s password 0 %s role network-admin" % (self.username, self.password),
+            # configure mgmt interface
+            "interface mgmt0",
+            "ip address 10.0.0.15/24",
+            "exit",
+        ])
         self.wait_write("exit")
         self.wait_write("copy running-config startup-config")
 
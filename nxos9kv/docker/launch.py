@@ -10,15 +10,11 @@ import sys
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -33,6 +29,14 @@ logging.Logger.trace = trace
 
 
 class NXOS9K_vm(vrnetlab.VM):
+    config_drive = "iso"
+    config_drive_file = "nxos_config.txt"
+    # hostname# or hostname(config-xx)#, see VM.cli_prompt
+    cli_prompt = rb"[\r\n][\w.-]+(\([\w-]+\))?[#>] ?\Z"
+    # the Linux of the guest has virtio-balloon, for density mode
+    has_balloon_driver = True
+    memory_floor = 6144
+
     def __init__(self, bios, username, password, num_nics):
         disk_image = None
         for e in sorted(os.listdir("/")):
@@ -54,11 +58,9 @@ class NXOS9K_vm(vrnetlab.VM):
         extended_args = ['-nographic', '-bios', self.bios, '-smp', '2']
         # use SATA driver for disk and set to drive 0
         extended_args.extend(['-device', 'ahci,id=ahci0,bus=pci.0',
-            '-drive', 'if=none,file=%s,id=drive-sata-disk0,format=qcow2' % self.overlay_disk_image,
+            '-drive', ','.join(['if=none,file=%s,id=drive-sata-disk0,format=qcow2' % self.overlay_disk_image]
+                               + self.disk_profile.drive_options(self.overlay_disk_image)),
             '-device', 'ide-drive,bus=ahci0.0,drive=drive-sata-disk0,id=drive-sata-disk0'])
-        # create initial config and load it
-        pre_start_cmds.append(['genisoimage', '-o', '/cfg.iso', '-l', '--iso-level', '2', 'nxos_config.txt'])
-        extended_args.extend(['-drive', 'file=cfg.iso,media=cdrom'])
 
         return pre_start_cmds, extended_args
 
@@ -87,7 +89,8 @@ class NXOS9K_vm(vrnetlab.VM):
                 self.wait_write(password, wait="Password:")
 
                 # run main config!
-                self.bootstrap_config()
+                if not self.bootstrap_config():
+                    return
                 # close telnet connection
                 self.tn.close()
                 # startup time?
@@ -103,7 +106,7 @@ class NXOS9K_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         elif res != b'':
-            self.logger.trace("OUTPUT: %s", res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -112,25 +115,51 @@ class NXOS9K_vm(vrnetlab.VM):
         return
 
 
+    def gen_bootstrap_config(self):
+        """ Initial configuration from nxos_config.txt plus our bootstrap
+            configuration, picked up from the config drive at boot
+        """
+        with open("/nxos_config.txt") as f:
+            config = f.read().splitlines()
+        config.extend([
+            "username %s password 0 %s role network-admin" % (self.username, self.password),
+            # configure mgmt interface
+            "interface mgmt0",
+            "  ip address %s" % self.mgmt_address.with_prefixlen,
+            "exit",
+            # enable netconf with 10 sessions (max allowed)
+            "feature netconf",
+            "netconf sessions 10",
+        ])
+        config.extend(self.extra_config)
+        return config
+
+
     def bootstrap_config(self):
-        """ Do the actual bootstrap config
+        """ Make sure the bootstrap config is applied
+
+            It is normally picked up from the config drive while booting, if
+            that did not happen it is typed on the serial console instead.
+            Returns False if it is not applied either way, after restarting
+            the VM.
         """
-        self.logger.info("applying bootstrap configuration")
         self.wait_write("", None)
-        # figure out the running image
+        if self.wait_config("show running-config | include ^username", "username %s " % self.username, spins=1):
+            self.logger.info("bootstrap configuration applied from config drive")
+            return True
+
+        self.logger.warning("bootstrap configuration not applied from config drive, applying it on the serial console")
+        # wait_config() read the last prompt
         self.wait_write("", None)
-        self.wait_write("configure")
-        self.wait_write("username %s password 0 %s role network-admin" % (self.username, self.password))
-
-        # configure mgmt interface
-        self.wait_write("interface mgmt0")
-        self.wait_write("ip address 10.0.0.15/24")
-        self.wait_write("exit")
-        # enable netconf with 10 sessions (max allowed)
-        self.wait_write("feature netconf")
-        self.wait_write("netconf sessions 10")
-        self.wait_write("exit")
-        self.wait_write("copy running-config startup-config")
+        self.wait_write("configure", timeout=30)
+        self.send_config(self.gen_bootstrap_config())
+        self.wait_write("end", timeout=30)
+        self.wait_write("copy running-config startup-config", timeout=30)
+        if not self.wait_config("show running-config | include ^username", "username %s " % self.username,
+                                spins=3):
+            self.restart("bootstrap configuration not applied")
+            return False
+        return True
 
 
 class NXOS9K(vrnetlab.VR):
@@ -6,19 +6,14 @@ import os
 import re
 import signal
 import sys
-import telnetlib
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -29,6 +24,9 @@ def trace(self, message, *args, **kws):
 logging.Logger.trace = trace
 
 class OpenWRT_vm(vrnetlab.VM):
+    disk_interfaces = ("ide", "virtio")
+    nic_hotplug = True
+
     def __init__(self, username, password):
         disk_image = None
         for e in sorted(os.listdir("/")):
@@ -66,7 +64,7 @@ class OpenWRT_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
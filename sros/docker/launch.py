@@ -6,19 +6,16 @@ import math
 import os
 import re
 import signal
+import socket
 import sys
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -61,6 +58,11 @@ vrnetlab.HOST_FWDS.append(('tcp', 57400, 57400))
 
 
 class SROS_vm(vrnetlab.VM):
+    default_console_engine = "asyncio"
+    # the bootstrap config is put on the TFTP server and executed from there
+    config_drive = "tftp"
+    config_drive_file = "bootstrap.cfg"
+
     def __init__(self, username, password, num=0):
         super(SROS_vm, self).__init__(username, password, disk_image = "/sros.qcow2", num=num, ram=6144)
 
@@ -100,7 +102,7 @@ class SROS_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -109,6 +111,113 @@ class SROS_vm(vrnetlab.VM):
         return
 
 
+    def gen_user_config(self):
+        """ Our user with console, NETCONF and gRPC access
+        """
+        config = []
+        if self.username and self.password:
+            config.append("configure system security user \"%s\" password %s" % (self.username, self.password))
+            config.append("configure system security user \"%s\" access console netconf grpc" % (self.username))
+            config.append("configure system security user \"%s\" console member \"administrative\" \"default\"" % (self.username))
+        return config
+
+
+    def gen_name_config(self):
+        """ The system name, SYSTEM_NAME if set, otherwise in fleet mode the
+            hostname of the container, which tells clones apart
+        """
+        name = os.getenv("SYSTEM_NAME") or (socket.gethostname() if self.fleet else None)
+        if not name:
+            return []
+        return ["configure system name \"%s\"" % name]
+
+
+    def gen_system_config(self):
+        """ Users, management protocols and such, the same on all variants
+        """
+        config = self.gen_name_config()
+        config.extend(self.gen_user_config())
+        config.extend([
+            "configure system netconf no shutdown",
+            "configure system grpc allow-unsecure-connection",
+            "configure system grpc no shutdown",
+            "configure system security profile \"administrative\" netconf base-op-authorization lock",
+            "configure system login-control ssh inbound-max-sessions 30",
+        ])
+        return config
+
+
+    def gen_mode_config(self):
+        """ Switch to the configured management interface configuration mode
+        """
+        if self.mode == 'cli':
+            return []
+        return [
+            "configure system management-interface yang-modules no nokia-modules",
+            "configure system management-interface yang-modules nokia-combined-modules",
+            "configure system management-interface yang-modules no base-r13-modules",
+            "configure system management-interface configuration-mode {}".format(self.mode),
+        ]
+
+
+    def bootstrap_config(self):
+        """ Execute the bootstrap config from the TFTP server
+
+            This is a single command instead of waiting for the prompt after
+            every line of the config. SROS prints "Executed N lines" once it
+            has run the file, but exec stops at the first line that fails, as
+            it does when the file could not be fetched. Unless all lines were
+            executed and our user is there, the config is typed on the serial
+            console instead, which carries on past lines that fail.
+        """
+        config = self.gen_bootstrap_config()
+        self.wait_write("exec tftp://10.0.0.2/%s" % self.config_drive_file, timeout=30)
+        idx, match, res = self.tn.expect([rb"Executed (\d+) lines"] + self.config_errors, 120)
+        self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
+        applied = False
+        if match is None:
+            self.logger.warning("no result of exec of the bootstrap config within 120s")
+        elif idx > 0:
+            error = match.group(0) + self.tn.read_until(b"\n", 5)
+            self.logger.warning("exec of the bootstrap config failed: %s" % error.decode(errors="replace").strip())
+        elif int(match.group(1)) < len([line for line in config if line.strip()]):
+            self.logger.warning("exec of the bootstrap config stopped after %s lines" % match.group(1).decode())
+        else:
+            applied = (not self.username or self.wait_config("admin display-config | match %s" % self.username,
+                                                              "user \"%s\"" % self.username, spins=1))
+        if applied:
+            self.logger.info("bootstrap configuration applied from TFTP")
+        else:
+            self.logger.warning("bootstrap configuration not applied from TFTP, applying it on the serial console")
+            # the prompt may be gone already, get one for send_config()
+            self.wait_write("", None)
+            self.send_config(config)
+        self.wait_write("admin save", timeout=30)
+        self.wait_write("logout", timeout=30)
+
+
+    def fleet_delta_config(self):
+        """ Set our system name and replace the user of the golden VM with
+            ours on a fleet clone
+
+            The golden VM logged out after its bootstrap config so we are
+            looking at a login prompt.
+        """
+        if getattr(self, 'mode', 'cli') != 'cli':
+            raise NotImplementedError("only supported in classic CLI mode")
+        self.logger.info("Applying per-instance configuration to %s" % self)
+        self.wait_write("", wait=None)
+        self.wait_write("admin", wait="Login:")
+        self.wait_write("admin", wait="Password:")
+        config = self.gen_name_config()
+        if self.fleet_meta['username'] != self.username:
+            config.append("configure system security no user \"%s\"" % self.fleet_meta['username'])
+        config.extend(self.gen_user_config())
+        self.send_config(config)
+        self.wait_write("admin save")
+        self.wait_write("logout")
+
+
     def read_license(self):
         """ Read the license file, if it exists, and extract the UUID and start
             time of the license
@@ -164,33 +273,23 @@ class SROS_integrated(SROS_vm):
 
 
 
-    def bootstrap_config(self):
-        """ Do the actual bootstrap config
+    def gen_bootstrap_config(self):
+        """ Bootstrap config of the integrated VSR-SIM
         """
-        if self.username and self.password:
-            self.wait_write("configure system security user \"%s\" password %s" % (self.username, self.password))
-            self.wait_write("configure system security user \"%s\" access console netconf grpc" % (self.username))
-            self.wait_write("configure system security user \"%s\" console member \"administrative\" \"default\"" % (self.username))
-        self.wait_write("configure system netconf no shutdown")
-        self.wait_write("configure system grpc allow-unsecure-connection")
-        self.wait_write("configure system grpc no shutdown")
-        self.wait_write("configure system security profile \"administrative\" netconf base-op-authorization lock")
-        self.wait_write("configure system login-control ssh inbound-max-sessions 30")
-        self.wait_write("configure card 1 mda 1 shutdown")
-        self.wait_write("configure card 1 mda 1 no mda-type")
-        self.wait_write("configure card 1 shutdown")
-        self.wait_write("configure card 1 no card-type")
-        self.wait_write("configure card 1 card-type iom-xp-b")
-        self.wait_write("configure card 1 mcm 1 mcm-type mcm-xp")
-        self.wait_write("configure card 1 mda 1 mda-type m20-1gb-xp-sfp")
-        self.wait_write("configure card 1 no shutdown")
-        if self.mode != 'cli':
-            self.wait_write("configure system management-interface yang-modules no nokia-modules")
-            self.wait_write("configure system management-interface yang-modules nokia-combined-modules")
-            self.wait_write("configure system management-interface yang-modules no base-r13-modules")
-            self.wait_write("configure system management-interface configuration-mode {}".format(self.mode))
-        self.wait_write("admin save")
-        self.wait_write("logout")
+        config = self.gen_system_config()
+        config.extend([
+            "configure card 1 mda 1 shutdown",
+            "configure card 1 mda 1 no mda-type",
+            "configure card 1 shutdown",
+            "configure card 1 no card-type",
+            "configure card 1 card-type iom-xp-b",
+            "configure card 1 mcm 1 mcm-type mcm-xp",
+            "configure card 1 mda 1 mda-type m20-1gb-xp-sfp",
+            "configure card 1 no shutdown",
+        ])
+        config.extend(self.gen_mode_config())
+        config.extend(self.extra_config)
+        return config
 
 class SROS_cp(SROS_vm):
     """ Control plane for distributed VSR-SIM
@@ -233,36 +332,23 @@ class SROS_cp(SROS_vm):
 
 
 
-    def bootstrap_config(self):
-        """ Do the actual bootstrap config
+    def gen_bootstrap_config(self):
+        """ Bootstrap config of the distributed VSR-SIM control plane
         """
-        if self.username and self.password:
-            self.wait_write("configure system security user \"%s\" password %s" % (self.username, self.password))
-            self.wait_write("configure system security user \"%s\" access console netconf grpc" % (self.username))
-            self.wait_write("configure system security user \"%s\" console member \"administrative\" \"default\"" % (self.username))
-        self.wait_write("configure system netconf no shutdown")
-        self.wait_write("configure system grpc allow-unsecure-connection")
-        self.wait_write("configure system grpc no shutdown")
-        self.wait_write("configure system security profile \"administrative\" netconf base-op-authorization lock")
-        self.wait_write("configure system login-control ssh inbound-max-sessions 30")
+        config = self.gen_system_config()
 
         # configure SFMs
         for i in range(1, 17):
-            self.wait_write("configure sfm {} sfm-type sfm-x20-b".format(i))
+            config.append("configure sfm {} sfm-type sfm-x20-b".format(i))
 
         # configure line card & MDAs
         for i in range(1, self.num_lc+1):
-            self.wait_write("configure card {} card-type xcm-x20".format(i))
-            self.wait_write("configure card {} mda 1 mda-type cx20-10g-sfp".format(i))
-
-        if self.mode != 'cli':
-            self.wait_write("configure system management-interface yang-modules no nokia-modules")
-            self.wait_write("configure system management-interface yang-modules nokia-combined-modules")
-            self.wait_write("configure system management-interface yang-modules no base-r13-modules")
-            self.wait_write("configure system management-interface configuration-mode {}".format(self.mode))
-        self.wait_write("admin save")
-        self.wait_write("logout")
+            config.append("configure card {} card-type xcm-x20".format(i))
+            config.append("configure card {} mda 1 mda-type cx20-10g-sfp".format(i))
 
+        config.extend(self.gen_mode_config())
+        config.extend(self.extra_config)
+        return config
 
 
 
@@ -272,6 +358,7 @@ class SROS_lc(SROS_vm):
     def __init__(self, slot=1):
         super(SROS_lc, self).__init__(None, None, num=slot)
         self.slot = slot
+        self.config_drive = None
 
         self.num_nics = 6
         self.smbios = ["type=1,product=TIMOS:chassis=XRS-20 chassis-topology=XRS-40 slot={} sfm=sfm-x20-b card=xcm-x20 mda/1=cx20-10g-sfp".format(slot)]
@@ -7,20 +7,15 @@ import random
 import re
 import signal
 import sys
-import telnetlib
 import time
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -83,7 +78,7 @@ class UCPE_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -121,8 +116,7 @@ class UCPE_vm(vrnetlab.VM):
     def insert_startup_config(self, startup_config):
         self.logger.debug('startup_config = ' + startup_config)
         self.wait_write("config terminal")
-        for line in startup_config.split('\n'):
-            self.wait_write(line)
+        self.send_config(startup_config.split('\n'))
         self.wait_write("commit and-quit")
         self.wait_write("")
         self.wait_write("")
@@ -7,20 +7,15 @@ import random
 import re
 import signal
 import sys
-import telnetlib
 import time
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -33,6 +28,9 @@ logging.Logger.trace = trace
 
 
 class VEOS_vm(vrnetlab.VM):
+    # the Linux of the guest has virtio-balloon, for density mode
+    has_balloon_driver = True
+    memory_floor = 1536
     def __init__(self, username, password):
         disk_image = None
         for e in sorted(os.listdir("/")):
@@ -78,7 +76,7 @@ class VEOS_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -95,16 +93,17 @@ class VEOS_vm(vrnetlab.VM):
         self.wait_write("", None)
         self.wait_write("enable", ">")
         self.wait_write("configure")
-        self.wait_write("username %s secret 0 %s role network-admin" % (self.username, self.password))
-
-        # configure mgmt interface
-        self.wait_write("interface Management 1")
-        self.wait_write("ip address 10.0.0.15/24")
-        self.wait_write("exit")
-        self.wait_write("management api http-commands")
-        self.wait_write("protocol unix-socket")
-        self.wait_write("no shutdown")
-        self.wait_write("exit")
+        self.send_config([
+            "username %s secret 0 %s role network-admin" % (self.username, self.password),
+            # configure mgmt interface
+            "interface Management 1",
+            "ip address 10.0.0.15/24",
+            "exit",
+            "management api http-commands",
+            "protocol unix-socket",
+            "no shutdown",
+            "exit",
+        ])
         self.wait_write("exit")
         self.wait_write("copy running-config startup-config")
 
@@ -5,9 +5,7 @@ import logging
 import os
 import pathlib
 import re
-import select
 import signal
-import subprocess
 import sys
 import time
 from typing import List, Optional
@@ -15,15 +13,11 @@ from typing import List, Optional
 import vrnetlab
 
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -150,7 +144,7 @@ class VMX_vcp(vrnetlab.VM):
             # no match, if we saw some output from the router it's probably
             # booting, so let's give it some more time
             if res != b'':
-                self.logger.trace("OUTPUT VCP[%d]: %s" % (self.num, res.decode()))
+                self.logger.trace("OUTPUT VCP[%d]: %s", self.num, vrnetlab.LazyDecode(res))
                 # reset spins if we saw some output
                 self.spins = 0
 
@@ -180,7 +174,7 @@ class VMX_vcp(vrnetlab.VM):
                         break
                     if ridx == 1:
                         self.tn.write("yes\r".encode())
-            self.logger.trace("Read: %s" % res.decode())
+            self.logger.trace("Read: %s", vrnetlab.LazyDecode(res))
         self.logger.debug("writing to serial console: %s" % cmd)
         self.tn.write("{}\r".format(cmd).encode())
 
@@ -301,9 +295,9 @@ class VMX(vrnetlab.VR):
         vrnetlab.run_command(["ip", "link", "set", "int_cp", "up"])
 
     def start(self):
-        # Set up socats for re1, with a different offset: $CONTAINER_IP:1022 -> 10.0.0.16:3022
+        # Set up port forwarding for re1, with a different offset: $CONTAINER_IP:1022 -> 10.0.0.16:3022
         if self.dual_re:
-            self.start_socat(src_offset=1000, dst_offset=3000)
+            self.start_port_forwarding(src_offset=1000, dst_offset=3000)
 
         super(VMX, self).start()
 
@@ -339,34 +333,11 @@ class VMX_installer(VMX):
                     vcp.work()
         self.logger.debug("All %d VCPs running" % len(self.vms))
 
-        def waitable_pipes():
-            return [vcp.p.stdout for vcp in self.vms if vcp.running and not vcp.p.stdout.closed] + \
-                [vcp.p.stderr for vcp in self.vms if vcp.running and not vcp.p.stderr.closed]
         # wait for system to shut down cleanly
-        while waitable_pipes():
-            read_pipes, _, _ = select.select(waitable_pipes(), [],  [])
-            for read_pipe in read_pipes:
-                for idx, vcp in enumerate(self.vms):
-                    if read_pipe in (vcp.p.stdout, vcp.p.stderr):
-                        break
-
-                try:
-                    vcp.p.communicate(timeout=1)
-                except subprocess.TimeoutExpired:
-                    pass
-                except Exception as exc:
-                    # assume it's dead
-                    self.logger.info("RE[%d]: Can't communicate with qemu process, assuming VM has shut down properly.\n%s" % (idx, str(exc)))
-                    vcp.stop()
-
-                try:
-                    (ridx, match, res) = vcp.tn.expect([b"Powering system off"], 1)
-                    if res != b'':
-                        self.logger.trace("RE[%d]: OUTPUT VCP: %s" % (idx, res.decode()))
-                except Exception as exc:
-                    # assume it's dead
-                    self.logger.info("RE[%d]: Can't communicate with qemu process, assuming VM has shut down properly.\n%s" % (idx, str(exc)))
-                    vcp.stop()
+        for idx, vcp in enumerate(self.vms):
+            vcp.qemu.event.wait()
+            self.logger.info("RE[%d]: %s" % (idx, vcp.qemu.failure))
+            vcp.stop()
 
         self.logger.info("Installation complete")
 
@@ -7,17 +7,14 @@ import re
 import signal
 import sys
 
+import qcow2
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -33,7 +30,7 @@ class VQFX_vcp(vrnetlab.VM):
     def __init__(self, username, password):
         for e in sorted(os.listdir("/")):
             if re.search("-re-.*.vmdk", e):
-                vrnetlab.run_command(["qemu-img", "create", "-b", "/" + e, "-f", "qcow", "/vcp.qcow2"])
+                qcow2.create("/vcp.qcow2", backing_file="/" + e)
         super(VQFX_vcp, self).__init__(username, password, disk_image="/vcp.qcow2", ram=2048)
         self.num_nics = 12
 
@@ -104,7 +101,7 @@ class VQFX_vcp(vrnetlab.VM):
             # no match, if we saw some output from the router it's probably
             # booting, so let's give it some more time
             if res != b'':
-                self.logger.trace("OUTPUT VCP: %s" % res.decode())
+                self.logger.trace("OUTPUT VCP: %s", vrnetlab.LazyDecode(res))
                 # reset spins if we saw some output
                 self.spins = 0
 
@@ -146,7 +143,7 @@ class VQFX_vcp(vrnetlab.VM):
                         break
                     if ridx == 1:
                         self.tn.write("yes\r".encode())
-            self.logger.trace("Read: %s" % res.decode())
+            self.logger.trace("Read: %s", vrnetlab.LazyDecode(res))
         self.logger.debug("writing to serial console: %s" % cmd)
         self.tn.write("{}\r".format(cmd).encode())
 
@@ -158,7 +155,7 @@ class VQFX_vpfe(vrnetlab.VM):
     def __init__(self):
         for e in sorted(os.listdir("/")):
             if re.search("-pfe-.*.vmdk", e):
-                vrnetlab.run_command(["qemu-img", "create", "-b", "/" + e, "-f", "qcow", "/vpfe.qcow2"])
+                qcow2.create("/vpfe.qcow2", backing_file="/" + e)
         super(VQFX_vpfe, self).__init__(None, None, disk_image="/vpfe.qcow2", num=1, ram=2048)
         self.num_nics = 0
 
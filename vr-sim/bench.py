@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+""" Benchmark the launchers against simulated routers
+
+    Runs the launch.py of each platform as it runs in its container, with
+    sim.py standing in for qemu-system-x86_64, and measures:
+
+      running  - seconds from starting the launcher to /health reporting the
+                 router running
+      booted   - seconds from starting the launcher to the (last) VM being
+                 booted up to where the launcher has to take over
+      config   - seconds the bootstrap configuration took, from the boot
+                 timeline of the launcher
+      restarts - VM restarts the launcher did before the router ran
+      cpu      - CPU seconds of the launcher process up to running, the
+                 simulated VMs not included
+      idle     - CPU of the launcher while the router runs, in percent of a
+                 CPU, over the --idle window
+      sim cpu  - CPU seconds of all the simulated VMs
+      check    - whether the launcher configured everything the platform
+                 needs and saved it where it has to, see the reports of
+                 sim.py
+
+    The launchers look for their images in / and write there, so this needs
+    root and is meant to run in the vr-sim container. Images are small sparse
+    files. Everything a run adds to /, /run, /tftpboot and /vmx is removed
+    after it.
+"""
+
+import argparse
+import glob
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the top of the repository, or of the vr-sim container which has the same
+# layout
+ROOT = os.path.dirname(HERE)
+
+IMAGE_MB = 16
+LICENSE = "0f8fc3fa-1a2b-4c3d-8e9f-001122334455 sros-vsr 2021-01-01 vr-sim\n"
+
+# what each profile needs in / besides the launcher: images (None for an
+# empty file, else a sparse one) and files copied from the repository,
+# the platform simulated and the environment of the launcher
+PROFILES = {
+    'xrv': {'files': {"/iosxrv-k9-demo-6.1.2.vmdk": IMAGE_MB}},
+    'xrv9k': {'files': {"/xrv9k-fullk9-x-7.2.1.qcow2": IMAGE_MB}, 'env': {'VERSION': "7.2.1"}},
+    'vmx': {'files': {"/vmx/re/junos-vmx-x86-64-18.2R1.9.qcow2": IMAGE_MB, "/vmx/re/vmxhdd.img": IMAGE_MB,
+                      "/vmx/vfpc.img": IMAGE_MB},
+            'env': {'VERSION': "18.2R1.9"}},
+    'sros': {'files': {"/sros-vm-16.0.R7.qcow2": IMAGE_MB}},
+    # release 19 and later always run distributed, with a line card VM
+    'sros-distributed': {'platform': "sros", 'files': {"/sros-vm-20.10.R1.qcow2": IMAGE_MB,
+                                                       "/sros.license": LICENSE}},
+    'csr': {'files': {"/csr1000v-universalk9.16.12.04.qcow2": IMAGE_MB}, 'env': {'VERSION': "16.12.04"}},
+    'nxos9kv': {'files': {"/nexus9300v.9.3.9.qcow2": IMAGE_MB, "/OVMF-pure-efi.fd": None,
+                          "/nxos_config.txt": "nxos9kv/nxos_config.txt"}},
+    'veos': {'files': {"/vEOS-lab-4.26.1F.vmdk": IMAGE_MB, "/Aboot-veos-serial-8.0.0.iso": IMAGE_MB}},
+    'vrp': {'files': {"/ne40e-v800r011c00spc607b607.qcow2": IMAGE_MB}},
+    'vsr1000': {'files': {"/VSR1000_HPE-CMW710-E0324-X64.qco": IMAGE_MB}},
+    'routeros': {'files': {"/chr-6.47.9.vmdk": IMAGE_MB}},
+    'openwrt': {'files': {"/openwrt-19.07.7-x86-64-combined-ext4.img": IMAGE_MB}},
+}
+
+# directories the launchers write to, new entries in them are removed
+# after every run
+SCRATCH = ("/", "/run", "/tftpboot", "/vmx")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def get_health(path):
+    """ The health details from the status server of the launcher or None
+    """
+    try:
+        conn = UnixHTTPConnection(path)
+        conn.request("GET", "/health")
+        resp = conn.getresponse()
+        res = json.loads(resp.read())
+        conn.close()
+        return res
+    except (OSError, ValueError):
+        return None
+
+
+def read_health():
+    try:
+        with open("/health") as f:
+            return f.readline()
+    except FileNotFoundError:
+        return ""
+
+
+def process_cpu(pid):
+    """ CPU seconds used by process pid itself, not its children
+    """
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            stat = f.read()
+    except FileNotFoundError:
+        return None
+    # the command name in parentheses may contain spaces
+    fields = stat[stat.rindex(")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def snapshot_scratch():
+    return {d: set(os.listdir(d)) if os.path.isdir(d) else set() for d in SCRATCH}
+
+
+def clean_scratch(before):
+    for d in SCRATCH:
+        if not os.path.isdir(d):
+            continue
+        for entry in set(os.listdir(d)) - before[d]:
+            path = os.path.join(d, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+
+def setup_files(files):
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(content, int):
+            with open(path, "wb") as f:
+                f.truncate(content * 1024 * 1024)
+        elif content is None:
+            open(path, "wb").close()
+        elif "\n" in content:
+            with open(path, "w") as f:
+                f.write(content)
+        else:
+            shutil.copy(os.path.join(ROOT, content), path)
+
+
+def boot_config(health):
+    """ Seconds the longest bootstrap configuration of the VMs took
+    """
+    res = None
+    for vm in (health or {}).get('vms', {}).values():
+        boots = vm['timeline']['boots']
+        if not boots:
+            continue
+        at = {e['event']: e['at'] for e in boots[-1]['events']}
+        if "bootstrap_start" in at and "bootstrap_end" in at:
+            res = max(res or 0, at["bootstrap_end"] - at["bootstrap_start"])
+    return res
+
+
+def read_reports(directory):
+    """ Reports of the simulated VMs, the last one of each VM first in the
+        list of that VM, by role and number
+    """
+    res = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        with open(path) as f:
+            report = json.load(f)
+        res.setdefault((report['role'], report['num']), []).append(report)
+    for reports in res.values():
+        reports.sort(key=lambda r: r['started'], reverse=True)
+    return res
+
+
+def check(reports):
+    """ Summary of what the launcher got wrong, from the last report of each
+        VM, and the details of it
+    """
+    problems = []
+    details = []
+    rejected = 0
+    for (role, num), (report, *_) in sorted(reports.items()):
+        name = "%s%d" % (role, num)
+        if report['ready'] is None:
+            problems.append("%s not booted" % name)
+        if report['missing']:
+            problems.append("%s missing %d" % (name, len(report['missing'])))
+        if report['saved'] is False:
+            problems.append("%s unsaved" % name)
+        rejected += len(report['rejected'])
+        for regex in report['missing']:
+            details.append("%s: not configured: %s" % (name, regex))
+        for mode, line, error in report['rejected']:
+            details.append("%s: rejected in %s: %s (%s)" % (name, mode, line, error))
+    if not reports:
+        problems.append("no VM")
+    res = ", ".join(problems) or "ok"
+    if rejected:
+        res += " (%d rejected)" % rejected
+    return res, details
+
+
+def run_profile(name, args, bindir, log_dir):
+    profile = PROFILES[name]
+    platform = profile.get('platform', name)
+    launcher = os.path.join(args.root, platform, "docker", "launch.py")
+    report_dir = os.path.join(log_dir, "%s-reports" % name)
+    status_socket = os.path.join(log_dir, "%s-status.sock" % name)
+    env = dict(os.environ)
+    env.update({
+        'PATH': bindir + os.pathsep + env.get('PATH', "/usr/bin:/bin"),
+        'PYTHONPATH': os.path.join(args.root, "common"),
+        'SIM_PLATFORM': platform,
+        'SIM_SPEED': str(args.speed),
+        'SIM_REPORT_DIR': report_dir,
+        'SIM_TRANSCRIPTS': os.path.join(args.root, "benchmark", "transcripts"),
+        'STATUS_PORT': "0",
+        'STATUS_SOCKET': status_socket,
+        'CONSOLE_LOG_DIR': "",
+    })
+    env.update(profile.get('env', {}))
+
+    before = snapshot_scratch()
+    res = {'platform': name}
+    try:
+        setup_files(profile['files'])
+        cmd = [sys.executable, launcher]
+        if args.trace:
+            cmd.append("--trace")
+        with open(os.path.join(log_dir, "%s.log" % name), "w") as log:
+            start = time.time()
+            p = subprocess.Popen(cmd, cwd="/", env=env, stdout=log, stderr=subprocess.STDOUT,
+                                 start_new_session=True)
+            try:
+                while not read_health().startswith("0 "):
+                    if p.poll() is not None or time.time() - start > args.timeout:
+                        break
+                    time.sleep(0.05)
+                else:
+                    res['running'] = time.time() - start
+                    res['cpu'] = process_cpu(p.pid)
+                    health = get_health(status_socket)
+                    res['config'] = boot_config(health)
+                    res['restarts'] = sum(vm['restarts'] for vm in (health or {}).get('vms', {}).values())
+                    time.sleep(args.idle)
+                    cpu = process_cpu(p.pid)
+                    if cpu is not None and res['cpu'] is not None:
+                        res['idle'] = (cpu - res['cpu']) * 100 / args.idle
+            finally:
+                stop(p)
+        reports = read_reports(report_dir)
+        ready = [r[0]['ready'] for r in reports.values() if r[0]['ready'] is not None]
+        if ready and len(ready) == len(reports):
+            res['booted'] = max(ready) - start
+        res['sim_cpu'] = sum(r['cpu'] for rs in reports.values() for r in rs)
+        res['check'], res['details'] = check(reports)
+        if 'running' not in res:
+            res['check'] = ("exited %d" % p.returncode if p.returncode else "timeout") + ", " + res['check']
+    finally:
+        clean_scratch(before)
+    return res
+
+
+def stop(p):
+    """ Stop the launcher and the simulated VMs it started, like docker stop
+    """
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        p.wait(10)
+    except subprocess.TimeoutExpired:
+        pass
+    # qemu of an exited launcher is left behind in its process group
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    p.wait()
+
+
+def fmt(value, spec="%8.1f"):
+    return spec % value if value is not None else "%8s" % "-"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the launchers against simulated routers')
+    parser.add_argument('platforms', nargs='*', default=list(PROFILES), help='profiles to run, all by default: %s'
+                        % ", ".join(PROFILES))
+    parser.add_argument('--speed', type=float, default=0.1, help='time scale of the simulated boots, 1 is real time')
+    parser.add_argument('--idle', type=float, default=10, help='seconds to measure the launcher idling once running')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for a router to run')
+    parser.add_argument('--root', default=ROOT, help='directory with common/ and the launchers in <platform>/docker/')
+    parser.add_argument('--log-dir', help='keep the launcher logs and VM reports in this directory')
+    parser.add_argument('--trace', action='store_true', help='trace level logging of the launchers')
+    parser.add_argument('--verbose', action='store_true', help='print what the launchers got wrong')
+    args = parser.parse_args()
+
+    for name in args.platforms:
+        if name not in PROFILES:
+            parser.error("unknown platform %s, one of %s" % (name, ", ".join(PROFILES)))
+    if os.geteuid() != 0:
+        parser.error("the launchers write to /, run as root in the vr-sim container")
+
+    # clean up after docker stop as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    tmp = tempfile.mkdtemp(prefix="vr-sim-")
+    log_dir = args.log_dir or tmp
+    os.makedirs(log_dir, exist_ok=True)
+    # the launchers run qemu-system-x86_64 from the PATH
+    os.symlink(os.path.join(HERE, "sim.py"), os.path.join(tmp, "qemu-system-x86_64"))
+
+    failed = False
+    print("%-18s %8s %8s %8s %8s %8s %8s %8s  %s" % ("platform", "running", "booted", "config", "restarts",
+                                                    "cpu s", "idle %", "sim cpu", "check"), flush=True)
+    try:
+        for name in args.platforms:
+            res = run_profile(name, args, tmp, log_dir)
+            print("%-18s %s %s %s %s %s %s %s  %s" % (
+                name, fmt(res.get('running')), fmt(res.get('booted')), fmt(res.get('config')),
+                fmt(res.get('restarts'), "%8d"), fmt(res.get('cpu'), "%8.2f"), fmt(res.get('idle'), "%8.2f"),
+                fmt(res.get('sim_cpu'), "%8.2f"), res['check']), flush=True)
+            if args.verbose:
+                for line in res['details']:
+                    print("  " + line, flush=True)
+            failed = failed or res['check'] != "ok" and not res['check'].startswith("ok ")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,1302 @@
+#!/usr/bin/env python3
+
+""" What the simulated platforms do on their serial console
+
+    Every platform is a script: the boot output, the dialogues of the first
+    boot the launcher has to get through (logins, setting passwords, pressing
+    return) and a CLI taking the bootstrap configuration. The CLIs are small,
+    they know the commands the launchers use and the output and prompts the
+    launchers wait for, configuration lines are taken as they are. What the
+    launcher has to configure is listed as regexes the configuration is
+    checked against in the report (see sim.Report).
+
+    The boot output is a recording from benchmark/transcripts where we have
+    one (xrv, sros, veos) and made up for the rest, as are the timings, which
+    are about what the real thing takes on a decent server. A platform that
+    runs several VMs (vmx, distributed sros) plays a role per VM, told apart
+    by the disk image or the SMBIOS data the launcher gave qemu.
+"""
+
+import asyncio
+import copy
+import os
+import re
+import struct
+import time
+
+# seconds from starting qemu to where the launcher takes over, at SIM_SPEED 1
+BOOT_TIME = {
+    'xrv': 180,
+    'xrv9k': 420,
+    'vcp': 150,
+    'vfpc': 60,
+    'sros': 60,
+    'sros-lc': 30,
+    'csr': 150,
+    'nxos9kv': 240,
+    'veos': 90,
+    'vrp': 240,
+    'vsr1000': 60,
+    'routeros': 8,
+    'openwrt': 6,
+}
+
+ISO_SECTOR = 2048
+
+
+def kernel_boot(sim, banner, driver="e1000"):
+    """ Made up boot output of a Linux based NOS, for the platforms we have
+        no recording of
+    """
+    lines = [
+        "[    0.000000] Linux version 4.19.0 (vr-sim@localhost) (gcc version 8.3.0) #1 SMP",
+        "[    0.000000] Command line: console=ttyS0,115200",
+        "[    0.000000] BIOS-provided physical RAM map:",
+        "[    0.011287] Hypervisor detected: KVM",
+        "[    0.124112] smpboot: CPU0: QEMU Virtual CPU version 2.5+ (family: 0x6, model: 0x6, stepping: 0x3)",
+        "[    0.532214] PCI: Using configuration type 1 for base access",
+    ]
+    t = 1.2149
+    for i in range(sim.args.data_nics + 1):
+        lines.append("[%12.6f] %s 0000:00:%02x.0 eth%d: registered, 52:54:00:00:%02x:%02x"
+                     % (t, driver, i + 3, i, sim.args.num, i))
+        t += 0.0187
+    lines.extend([
+        "[%12.6f] EXT4-fs (sda1): mounted filesystem with ordered data mode. Opts: (null)" % (t + 1.5),
+        "[%12.6f] random: crng init done" % (t + 1.9),
+    ])
+    return lines + banner
+
+
+def iso_file(path, name):
+    """ Contents of the file name in the root directory of the ISO 9660
+        image at path, None if it is not there
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(16 * ISO_SECTOR)
+            pvd = f.read(ISO_SECTOR)
+            if pvd[1:6] != b"CD001":
+                return None
+            # the directory record of the root directory
+            extent, size = struct.unpack_from("<I4xI", pvd, 156 + 2)
+            f.seek(extent * ISO_SECTOR)
+            data = f.read(size)
+            i = 0
+            while i < len(data):
+                length = data[i]
+                if length == 0:
+                    # records do not cross sectors, on to the next one
+                    i = (i // ISO_SECTOR + 1) * ISO_SECTOR
+                    continue
+                record = data[i:i + length]
+                file_name = record[33:33 + record[32]].decode(errors="replace").split(";")[0]
+                if file_name.lower() == name.lower():
+                    extent, size = struct.unpack_from("<I4xI", record, 2)
+                    f.seek(extent * ISO_SECTOR)
+                    return f.read(size).decode(errors="replace")
+                i += length
+    except OSError:
+        pass
+    return None
+
+
+def config_drive(sim, name):
+    """ Lines of the file name on the config drive of the VM, None without
+        one
+    """
+    for path in sim.args.cdroms:
+        content = iso_file(path, name)
+        if content is not None:
+            return content.splitlines()
+    return None
+
+
+class Cli:
+    """ Line based CLI of a booted router, subclasses implement command()
+
+        The configuration is a tree of lines, the lines of a sub mode (like
+        "interface ...") are children of the line entering it. Platforms
+        with a commit model change a copy (the candidate) and commit() makes
+        it the running configuration.
+    """
+    hostname = "Router"
+    # (regex, mode) of configuration lines entering a sub mode, mode is
+    # expanded with the match
+    submodes = []
+    # configuration lines taking us back to the top level from a sub mode,
+    # like IOS does for commands unknown in the sub mode
+    toplevel = None
+    commit_model = False
+    indent = " "
+    invalid = "% Invalid input detected at '^' marker.\n"
+    # seconds a command takes
+    latency = 0.05
+
+    def __init__(self, sim, con, running=None):
+        self.sim = sim
+        self.con = con
+        self.modes = ["exec"]
+        self.context = []
+        self.running = running if running is not None else {}
+        self.candidate = None
+        sim.report.config = lambda: self.render(self.running)
+
+    @property
+    def mode(self):
+        return self.modes[-1]
+
+    @property
+    def tree(self):
+        return self.candidate if self.commit_model and self.candidate is not None else self.running
+
+    def prompt(self):
+        raise NotImplementedError()
+
+    async def run(self, mode="exec"):
+        """ Serve the CLI until the user logs out
+        """
+        self.sim.report.mark_ready()
+        self.modes = [mode]
+        self.context = []
+        while self.modes:
+            await self.con.out(self.prompt())
+            self.con.mode = self.mode
+            line = await self.con.readline()
+            self.sim.report.command(self.mode, line)
+            await self.con.sleep(self.latency)
+            res = await self.command(line.strip())
+            if res:
+                await self.con.out(res)
+
+    async def command(self, line):
+        """ Run line, returns its output
+        """
+        raise NotImplementedError()
+
+    def reject(self, line, error=None):
+        """ Output of a command the NOS does not accept
+        """
+        error = error or self.invalid
+        self.sim.report.reject(self.mode, line, error.strip().splitlines()[-1].strip())
+        return error
+
+    def save(self):
+        self.sim.report.saved = True
+
+    def enter_config(self, mode="config"):
+        self.modes.append(mode)
+        self.context = []
+        if self.commit_model:
+            self.candidate = copy.deepcopy(self.running)
+
+    def configure(self, line):
+        """ Add line to the configuration, entering a sub mode if it does
+        """
+        if self.context and (self.toplevel and re.match(self.toplevel, line)
+                             or any(re.match(regex, line) for regex, _ in self.submodes)):
+            self.exit_submodes()
+        node = self.tree
+        for parent in self.context:
+            node = node.setdefault(parent, {})
+        if line.startswith("no ") and line[3:] in node:
+            del node[line[3:]]
+        else:
+            node.setdefault(line, {})
+        for regex, mode in self.submodes:
+            m = re.match(regex, line)
+            if m:
+                self.context.append(line)
+                self.modes.append(m.expand(mode))
+                break
+
+    def exit_submodes(self):
+        while self.context:
+            self.context.pop()
+            self.modes.pop()
+
+    def exit(self):
+        """ Leave the current mode, returns True if that left configuration
+            mode
+        """
+        if self.context:
+            self.context.pop()
+            self.modes.pop()
+            return False
+        self.modes.pop()
+        return True
+
+    @property
+    def uncommitted(self):
+        return self.commit_model and self.candidate is not None and self.candidate != self.running
+
+    def commit(self):
+        if self.candidate is not None:
+            self.running = copy.deepcopy(self.candidate)
+
+    def abort(self):
+        if self.candidate is not None:
+            self.candidate = copy.deepcopy(self.running)
+
+    def load(self, lines):
+        """ Apply configuration lines from a config drive or file at boot
+        """
+        modes = self.modes
+        self.modes = []
+        self.enter_config()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith(("!", "#")):
+                continue
+            if line.startswith("do "):
+                if re.match(r"do (wr|write|copy run)", line):
+                    self.save()
+                continue
+            if line in ("exit", "quit"):
+                if self.context:
+                    self.exit()
+                continue
+            if line == "end":
+                break
+            self.configure(line)
+        self.commit()
+        self.candidate = None
+        self.modes = modes
+        self.context = []
+
+    def render(self, tree, indent=""):
+        res = []
+        for line, children in tree.items():
+            res.append(indent + line)
+            res.extend(self.render(children, indent + self.indent))
+        return res
+
+    def show_config(self, args=""):
+        """ The running configuration, filtered like "| include regex"
+        """
+        lines = self.render(self.running)
+        if "|" in args:
+            m = re.match(r"\s*(include|inc|i|match)\s+(.*)", args.split("|", 1)[1])
+            if m:
+                regex = re.compile(m.group(2).strip())
+                lines = [line for line in lines if regex.search(line)]
+        return "".join(line + "\n" for line in lines)
+
+    def accounts(self, regex):
+        """ Users and their password as configured, from lines matching
+            regex with user and password groups
+        """
+        res = {}
+        for line in self.render(self.running):
+            m = re.match(regex, line)
+            if m:
+                res[m.group("user")] = m.group("password")
+        return res
+
+
+class IosCli(Cli):
+    """ Cisco IOS and IOS XE
+    """
+    submodes = [(r"interface ", "config-if"), (r"line ", "config-line")]
+    toplevel = r"(hostname|username|ip domain|crypto|restconf|netconf-yang|enable|router|do) "
+
+    def __init__(self, sim, con):
+        super().__init__(sim, con)
+        self.hostname = "Router"
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "%s>" % self.hostname
+        if self.mode == "enable":
+            return "%s#" % self.hostname
+        return "%s(%s)#" % (self.hostname, self.mode)
+
+    def configure(self, line):
+        if line.startswith("crypto key generate"):
+            # not a configuration line
+            return
+        super().configure(line)
+        if line.startswith("hostname "):
+            self.hostname = line.split()[1]
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode in ("exec", "enable"):
+            return self.exec_command(line)
+        if line == "end":
+            self.modes[1:] = []
+            self.context = []
+            return None
+        if line == "exit":
+            self.exit()
+            return None
+        if line.startswith("do "):
+            return self.exec_command(line[3:])
+        self.configure(line)
+        if line.startswith("crypto key generate rsa"):
+            return ("The name for the keys will be: %s.example.com\n\n"
+                    "%% The key modulus size is 2048 bits\n"
+                    "%% Generating 2048 bit RSA keys, keys will be non-exportable...\n"
+                    "[OK] (elapsed time was 1 seconds)\n" % self.hostname)
+        return None
+
+    def exec_command(self, line):
+        if self.mode == "exec":
+            if line == "enable":
+                self.modes.append("enable")
+                return None
+            if line in ("exit", "logout"):
+                self.modes.pop()
+                return None
+            return self.reject(line)
+        if re.match(r"conf(igure)?( t(erminal)?)?$", line):
+            self.enter_config()
+            return "Enter configuration commands, one per line.  End with CNTL/Z.\n"
+        if line.startswith("show running-config"):
+            return self.show_config(line)
+        if re.match(r"(write( memory)?|wr|copy running-config startup-config)$", line):
+            self.save()
+            return "Building configuration...\n[OK]\n"
+        if line.startswith(("terminal ", "clear ")):
+            return None
+        if line in ("disable", "exit", "logout"):
+            self.modes.pop()
+            return None
+        return self.reject(line)
+
+
+class XrCli(Cli):
+    """ Cisco IOS XR, with admin mode of the classic 32 bit XR
+    """
+    submodes = [(r"interface ", "config-if")]
+    commit_model = True
+    # the netconf lines of 5.1.1, unknown to later releases
+    unknown = {"ssh server netconf port 830", "netconf agent ssh"}
+
+    def __init__(self, sim, con, node, mgmt, interfaces):
+        super().__init__(sim, con)
+        self.node = node
+        self.mgmt = mgmt
+        # names of the interfaces present in show interfaces description
+        self.interfaces = interfaces
+        self.keys = False
+        self.call_home = False
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "%s:ios#" % self.node
+        return "%s:ios(%s)#" % (self.node, self.mode)
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode in ("exec", "admin"):
+            return await self.exec_command(line)
+        if line == "commit":
+            self.commit()
+            return None
+        if line == "abort":
+            self.abort()
+            self.end()
+            return None
+        if line in ("exit", "end"):
+            if self.context and line == "exit":
+                self.exit()
+                return None
+            if self.uncommitted:
+                answer = await self.con.ask("Uncommitted changes found, commit them before exiting(yes/no/cancel)? [cancel]:")
+                if answer.strip() == "yes":
+                    self.commit()
+                elif answer.strip() != "no":
+                    return None
+            self.end()
+            return None
+        if line.startswith("do "):
+            return await self.exec_command(line[3:])
+        if line in self.unknown:
+            return self.reject(line, "\n" + self.invalid)
+        self.configure(line)
+        return None
+
+    def end(self):
+        self.candidate = None
+        self.exit_submodes()
+        self.modes.pop()
+
+    async def exec_command(self, line):
+        if line.startswith("terminal "):
+            return None
+        if line == "crypto key generate rsa":
+            return await self.crypto_key()
+        if line == "admin" and self.mode == "exec":
+            self.modes.append("admin")
+            return None
+        if re.match(r"configure( terminal)?$", line):
+            self.enter_config("admin-config" if self.mode == "admin" else "config")
+            return None
+        if re.match(r"show interfaces? description$", line):
+            res = "\n%-18s %-11s %-11s %s\n%s\n" % ("Interface", "Status", "Protocol", "Description", "-" * 80)
+            for name in [self.mgmt] + self.interfaces:
+                res += ("%-18s %-11s %-11s" % (name, "admin-down", "admin-down")).rstrip() + "\n"
+            return res + "\n"
+        if line == "show running-config call-home":
+            if not self.call_home:
+                return "% No such configuration item(s)\n\n"
+            return "call-home\n service active\n contact smart-licensing\n profile CiscoTAC-1\n  active\n  destination transport-method http\n !\n!\n\n"
+        if line.startswith("show running-config"):
+            return self.show_config(line)
+        if line == "exit":
+            self.modes.pop()
+            return None
+        return self.reject(line)
+
+    async def crypto_key(self):
+        if self.keys:
+            answer = await self.con.ask("%% You already have keys defined for the_default\n"
+                                        "Do you really want to replace them? [yes/no]: ")
+            if answer.strip() != "yes":
+                return None
+        bits = await self.con.ask("The name for the keys will be: the_default\n"
+                                  "  Choose the size of the key modulus in the range of 512 to 4096 for your General "
+                                  "Purpose Keypair. Choosing a key modulus greater than 512 may take a few minutes.\n\n"
+                                  "How many bits in the modulus [1024]: ")
+        await self.con.out("Generating RSA keys ...\n")
+        await self.con.sleep(int(bits or 1024) / 1024.0)
+        self.keys = True
+        return "Done w/ crypto generate keypair\n[OK]\n\n"
+
+
+class EosCli(Cli):
+    """ Arista EOS
+    """
+    submodes = [(r"interface Management ?(\d+)$", r"config-if-Ma\1"),
+                (r"interface Ethernet ?(\d+)$", r"config-if-Et\1"),
+                (r"management api http-commands$", "config-mgmt-api-http-cmds"),
+                (r"management api netconf$", "config-mgmt-api-netconf")]
+    hostname = "localhost"
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "%s>" % self.hostname
+        if self.mode == "enable":
+            return "%s#" % self.hostname
+        return "%s(%s)#" % (self.hostname, self.mode)
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode == "exec":
+            if line == "enable":
+                self.modes.append("enable")
+                return None
+            if line in ("exit", "logout"):
+                self.modes.pop()
+                return None
+            return self.reject(line)
+        if self.mode == "enable":
+            if re.match(r"conf(igure)?( t(erminal)?)?$", line):
+                self.enter_config()
+                return None
+            if line.startswith("show running-config"):
+                return self.show_config(line)
+            if re.match(r"(write( memory)?|copy running-config startup-config)$", line):
+                self.save()
+                return "Copy completed successfully.\n"
+            if line.startswith("terminal "):
+                return None
+            if line in ("exit", "logout", "disable"):
+                self.modes.pop()
+                return None
+            return self.reject(line)
+        if line == "end":
+            self.exit_submodes()
+            self.modes.pop()
+            return None
+        if line == "exit":
+            self.exit()
+            return None
+        self.configure(line)
+        return None
+
+
+class NxosCli(Cli):
+    """ Cisco NX-OS
+    """
+    submodes = [(r"interface ", "config-if")]
+    toplevel = r"(hostname|username|feature|netconf|vrf context|interface) "
+    indent = "  "
+
+    @property
+    def hostname(self):
+        for line in self.running:
+            if line.startswith("hostname "):
+                return line.split()[1]
+        return "switch"
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "%s# " % self.hostname
+        return "%s(%s)# " % (self.hostname, self.mode)
+
+    def passwords(self):
+        return self.accounts(r"username (?P<user>\S+) password (?:0 )?(?P<password>\S+)")
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode == "exec":
+            if re.match(r"conf(igure)?( t(erminal)?)?$", line):
+                self.enter_config()
+                return "Enter configuration commands, one per line. End with CNTL/Z.\n"
+            if line.startswith("show running-config"):
+                if "|" in line:
+                    return self.show_config(line)
+                return "\n!Command: show running-config\n\n" + self.show_config(line)
+            if line == "copy running-config startup-config":
+                await self.con.out("[########################################] 100%\n")
+                await self.con.sleep(2)
+                self.save()
+                return "Copy complete, now saving to disk (please wait)...\nCopy complete.\n"
+            if line.startswith("terminal "):
+                return None
+            if line == "exit":
+                self.modes.pop()
+                return None
+            return self.reject(line, "% Invalid command at '^' marker.\n")
+        if line == "end":
+            self.exit_submodes()
+            self.modes.pop()
+            return None
+        if line == "exit":
+            self.exit()
+            return None
+        self.configure(line)
+        return None
+
+
+class SrosCli(Cli):
+    """ Nokia SR OS classic CLI, taking flat configure lines only
+    """
+    hostname = "vSIM"
+
+    def prompt(self):
+        return "A:%s# " % self.hostname
+
+    async def command(self, line):
+        if not line or line.startswith("environment "):
+            return None
+        m = re.match(r"exec (tftp://[^/]+/(\S+))$", line)
+        if m:
+            return await self.exec_file(m.group(1), m.group(2))
+        if line.startswith("configure "):
+            self.configure(line)
+            return None
+        if line == "admin save":
+            await self.con.out("Writing configuration to cf3:\\config.cfg\nSaving configuration .")
+            await self.con.sleep(1)
+            self.save()
+            return "... Completed.\n"
+        if line.startswith("admin display-config") or line == "info":
+            return self.show_config(line[len("admin display-config"):])
+        if line == "logout":
+            self.modes.pop()
+            return None
+        return self.reject(line, "Error: Bad command.\n")
+
+    async def exec_file(self, url, name):
+        """ exec of a file from the TFTP server of the qemu user network
+        """
+        path = os.path.join(self.sim.args.tftp_dir or "/tftpboot", name)
+        try:
+            with open(path) as f:
+                lines = [line.strip() for line in f if line.strip()]
+        except OSError:
+            return self.reject("exec %s" % url, "MINOR: CLI Could not access \"%s\".\n" % url)
+        start = time.monotonic()
+        for line in lines:
+            await self.con.out(self.prompt() + line + "\n")
+            self.sim.report.command("exec", line)
+            await self.con.sleep(0.02)
+            if line.startswith("configure "):
+                self.configure(line)
+            else:
+                self.reject(line)
+                await self.con.out("Error: Bad command.\n")
+        return "Executed %d lines in %.1f seconds from file \"%s\"\n" % (len(lines), time.monotonic() - start, url)
+
+
+class BracketCli(Cli):
+    """ Huawei VRP and HPE Comware, with views in brackets as prompt
+    """
+    hostname = "HUAWEI"
+
+    def view(self):
+        return "%s-%s" % (self.hostname, self.mode) if self.context else self.hostname
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "<%s>" % self.hostname
+        return "[%s]" % self.view()
+
+
+class VrpCli(BracketCli):
+    """ Huawei VRP, with its two stage configuration
+    """
+    submodes = [(r"interface (\S+) ?(\S*)$", r"\1\2"), (r"aaa$", "aaa")]
+    commit_model = True
+
+    def __init__(self, sim, con):
+        super().__init__(sim, con)
+        # configuration is refused until the system is done building it
+        self.busy = True
+
+    @property
+    def hostname(self):
+        for line in self.tree:
+            if line.startswith("sysname "):
+                return line.split()[1]
+        return "HUAWEI"
+
+    def view(self):
+        return ("*" if self.uncommitted else "~") + super().view()
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode == "exec":
+            if line == "screen-length 0 temporary":
+                return "Info: The configuration takes effect on the current user terminal interface only.\n"
+            if line.startswith("display current-configuration"):
+                return self.show_config(line)
+            if line == "system-view":
+                self.enter_config()
+                return "Enter system view, return user view with return command.\n"
+            if line == "quit":
+                self.modes.pop()
+                return None
+            return self.reject(line, "Error: Unrecognized command found at '^' position.\n")
+        if line == "commit":
+            if self.busy:
+                return self.reject(line, "Error: The system is busy in building configuration. Please wait for a moment...\n")
+            self.commit()
+            return None
+        if line == "return" or line == "quit" and not self.context:
+            # uncommitted changes are lost
+            self.candidate = None
+            self.exit_submodes()
+            self.modes.pop()
+            return None
+        if line == "quit":
+            self.exit()
+            return None
+        if line.startswith("display current-configuration"):
+            return self.show_config(line)
+        m = re.match(r"local-user (\S+) password$", line)
+        if m and self.mode == "aaa":
+            password = await self.con.ask("Please configure the password (8-128)\nEnter Password:", echo=False)
+            confirm = await self.con.ask("Confirm Password:", echo=False)
+            if password != confirm:
+                return self.reject(line, "Error: The two passwords are different.\n")
+            line = "local-user %s password irreversible-cipher %s" % (m.group(1), password)
+        self.configure(line)
+        return None
+
+
+class ComwareCli(BracketCli):
+    """ HPE Comware
+    """
+    submodes = [(r"user-interface class (\S+)$", r"line-class-\1"),
+                (r"user-interface aux (\d+)$", r"line-aux\1"),
+                (r"local-user (\S+)$", r"luser-manage-\1"),
+                (r"interface (\S+)$", r"\1")]
+    hostname = "HPE"
+
+    def __init__(self, sim, con, running=None):
+        super().__init__(sim, con, running)
+        self.aux_open = asyncio.Event()
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode == "exec":
+            if line == "system-view":
+                self.enter_config()
+                return "System View: return to User View with Ctrl+Z.\n"
+            if line == "quit":
+                self.modes.pop()
+                return None
+            if line.startswith("display current-configuration"):
+                return self.show_config(line)
+            return self.reject(line, "             ^\n % Unrecognized command found at '^' position.\n")
+        if line == "return":
+            self.exit_submodes()
+            self.modes.pop()
+            return None
+        if line == "quit":
+            self.exit()
+            return None
+        new_user = re.match(r"local-user (\S+)$", line) and line not in self.running
+        self.configure(line)
+        if self.context[-1:] == ["user-interface aux 0"] and line == "authentication-mode none":
+            self.aux_open.set()
+        if new_user:
+            return "New local user added.\n"
+        return None
+
+
+class JunosCli(Cli):
+    """ Juniper Junos, the cli of the vMX VCP
+    """
+    commit_model = True
+
+    def prompt(self):
+        if self.mode == "exec":
+            return "root> "
+        return "\n[edit]\nroot# "
+
+    async def command(self, line):
+        if not line:
+            return None
+        if self.mode == "exec":
+            if line in ("configure", "edit"):
+                self.enter_config()
+                return "Entering configuration mode\n"
+            if line in ("exit", "quit"):
+                self.modes.pop()
+                return None
+            if line.startswith("show configuration"):
+                return self.show_config(line)
+            return self.reject(line, "                    ^\nunknown command.\n")
+        if line == "commit":
+            await self.con.sleep(5)
+            for old in [old for old in self.candidate if old.startswith("## Last commit:")]:
+                del self.candidate[old]
+            self.candidate["## Last commit: %s UTC by root" % time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())] = {}
+            self.commit()
+            return "commit complete\n"
+        m = re.match(r"load (merge|override|replace) (\S+)$", line)
+        if m:
+            # the file is on the USB stick with EXTRA_CONFIG, which we
+            # cannot read, only tell whether the launcher put it there
+            if not (self.sim.mounted and os.getenv("EXTRA_CONFIG")):
+                return self.reject(line, "error: Could not open configuration file: %s\n" % m.group(2))
+            self.candidate["## loaded %s" % m.group(2)] = {}
+            return "load complete\n"
+        if line in ("exit", "quit"):
+            if self.uncommitted:
+                answer = await self.con.ask("The configuration has been changed but not committed\n"
+                                            "Exit with uncommitted changes? [yes,no] (yes) ")
+                if answer.strip() == "no":
+                    return None
+            self.candidate = None
+            self.modes.pop()
+            return "Exiting configuration mode\n\n"
+        if line.startswith("set ") or line.startswith("delete "):
+            self.configure(line)
+            return None
+        return self.reject(line, "                    ^\nsyntax error.\n")
+
+
+class Shell(Cli):
+    """ A root shell, subclasses add their commands
+    """
+    prompt_text = "# "
+
+    def prompt(self):
+        return self.prompt_text
+
+    async def command(self, line):
+        if not line:
+            return None
+        if line in ("exit", "logout"):
+            self.modes.pop()
+            return None
+        return self.reject(line, "-sh: %s: not found\n" % line.split()[0])
+
+
+class VcpShell(Shell):
+    """ FreeBSD shell of the vMX VCP
+    """
+    prompt_text = "root@:~ # "
+
+    async def command(self, line):
+        if line == "mount_msdosfs /dev/da0 /mnt":
+            if not any("usb-storage" in value for value in self.sim.args.values("-device")):
+                return self.reject(line, "mount_msdosfs: /dev/da0: No such file or directory\n")
+            self.sim.mounted = True
+            return None
+        if line == "cli":
+            cli = JunosCli(self.sim, self.con, self.running)
+            await cli.run()
+            self.running = cli.running
+            return None
+        return await super().command(line)
+
+
+class AshShell(Shell):
+    """ The BusyBox shell of OpenWrt, with the files the launcher changes
+    """
+    prompt_text = "root@OpenWrt:/# "
+
+    def __init__(self, sim, con):
+        super().__init__(sim, con)
+        self.files = {
+            '/etc/passwd': ["root:x:0:0:root:/root:/bin/ash", "daemon:*:1:1:daemon:/var:/bin/false",
+                            "ftp:*:55:55:ftp:/home/ftp:/bin/false", "network:*:101:101:network:/var:/bin/false",
+                            "nobody:*:65534:65534:nobody:/var:/bin/false"],
+            '/etc/group': ["root:x:0:", "daemon:x:1:", "adm:x:4:", "mail:x:8:", "dialout:x:20:",
+                           "audio:x:29:", "www-data:x:33:", "ftp:x:55:", "users:x:100:", "network:x:101:",
+                           "nogroup:x:65534:"],
+        }
+        self.shadow = {'root': ""}
+        self.dirs = {}
+        self.ifconfig = {}
+        sim.report.config = self.config
+
+    def config(self):
+        res = ["%s:%s" % (path, line) for path, lines in self.files.items() for line in lines]
+        res.extend("/etc/shadow:%s:%s" % item for item in self.shadow.items())
+        res.extend("%s %s" % item for item in self.ifconfig.items())
+        res.extend("dir %s %s" % item for item in self.dirs.items())
+        return res
+
+    async def command(self, line):
+        if not line:
+            return None
+        m = re.match(r"ifconfig (\S+) (.+)$", line)
+        if m:
+            self.ifconfig[m.group(1)] = m.group(2)
+            return None
+        m = re.match(r"passwd ?(\S*)$", line)
+        if m:
+            user = m.group(1) or "root"
+            if not any(entry.startswith(user + ":") for entry in self.files['/etc/passwd']):
+                return self.reject(line, "passwd: unknown user %s\n" % user)
+            password = await self.con.ask("Changing password for %s\nNew password: " % user, echo=False)
+            again = await self.con.ask("Retype password: ", echo=False)
+            if password != again:
+                return self.reject(line, "passwd: password for %s is unchanged\n" % user)
+            self.shadow[user] = password
+            return "passwd: password for %s changed by root\n" % user
+        m = re.match(r"echo '(.*)' >> (\S+)$", line)
+        if m:
+            self.files.setdefault(m.group(2), []).append(m.group(1))
+            return None
+        m = re.match(r"sed -i '(\d+)(d|i (.*))' (\S+)$", line)
+        if m and m.group(4) in self.files:
+            lines = self.files[m.group(4)]
+            i = int(m.group(1)) - 1
+            if m.group(2) == "d":
+                del lines[i:i + 1]
+            else:
+                lines.insert(i, m.group(3))
+            return None
+        m = re.match(r"mkdir -p (\S+)$", line)
+        if m:
+            self.dirs[m.group(1)] = "root"
+            return None
+        m = re.match(r"chown (\S+) (\S+)$", line)
+        if m and m.group(2) in self.dirs:
+            self.dirs[m.group(2)] = m.group(1)
+            return None
+        m = re.match(r"cat (\S+)$", line)
+        if m and m.group(1) in self.files:
+            return "".join(entry + "\n" for entry in self.files[m.group(1)])
+        return await super().command(line)
+
+
+class RouterOsCli(Cli):
+    """ MikroTik RouterOS, taking commands with their full path only
+    """
+    def prompt(self):
+        return "[admin@MikroTik] > "
+
+    async def command(self, line):
+        if not line:
+            return None
+        if line == "/quit":
+            self.modes.pop()
+            return "interrupted\n"
+        if re.match(r"/(ip|user|system|interface|snmp) ", line):
+            self.configure(line)
+            return None
+        return self.reject(line, "bad command name %s (line 1 column 1)\n" % line.split()[0])
+
+
+def require(sim, *regexes):
+    """ Lines the configuration has to have in the end, {username} and
+        {password} are the credentials of the launcher
+    """
+    sim.report.required.extend(regex.format(username=re.escape(sim.username), password=re.escape(sim.password))
+                               for regex in regexes)
+
+
+async def xr_admin_dialog(sim, cli):
+    """ Creating the first user of IOS XR
+    """
+    con = sim.con
+    await con.out("\n\n\n!!!!!!!!!!!!!!!!!!!! NO root-system username is configured. Need to configure root-system "
+                  "username. !!!!!!!!!!!!!!!!!!!!\n\n         --- Administrative User Dialog ---\n\n\n")
+    username = ""
+    while not username.strip():
+        username = await con.ask("  Enter root-system username: ")
+    while True:
+        secret = await con.ask("  Enter secret: ", echo=False)
+        again = await con.ask("  Enter secret again: ", echo=False)
+        if secret == again:
+            break
+        await con.out("% Entered secrets do not match\n")
+    sim.report.command("admin-dialog", username)
+    cli.running["username %s group root-system" % username] = {}
+    cli.running["username %s secret %s" % (username, secret)] = {}
+    await con.out("Use the 'configure' command to modify this configuration.\n")
+
+
+async def xr_login(sim, cli):
+    con = sim.con
+    await con.out("User Access Verification\n\n")
+    await con.login("Username: ", cli.accounts(r"username (?P<user>\S+) secret (?P<password>\S+)$"),
+                    failure="% Authentication failed\n\n")
+    await con.out("\n\n")
+
+
+async def boot_xrv(sim):
+    con = sim.con
+    await con.replay(sim.transcript("xrv", until="!!!!!!!!!!!!!!!!!!!! NO root-system"), BOOT_TIME['xrv'])
+    cli = XrCli(sim, con, "RP/0/0/CPU0", "Mg0/0/CPU0/0",
+                ["Gi0/0/0/%d" % i for i in range(sim.args.data_nics)])
+    require(sim, r"^username {username} group root-system$", r"^username {username} secret {password}$",
+            r"^ssh server v2$", r"^interface MgmtEth 0/0/CPU0/0$", r"^ ipv4 address 10\.0\.0\.15/24$")
+    await xr_admin_dialog(sim, cli)
+    con.later(20, "RP/0/0/CPU0:Jan  1 00:03:44.011 : cfgmgr-rp[159]: %MGBL-CONFIG-6-DB_COMMIT : "
+              "Configuration committed by user 'SYSTEM'.\nSYSTEM CONFIGURATION COMPLETE\n")
+    while True:
+        await xr_login(sim, cli)
+        await cli.run()
+
+
+async def boot_xrv9k(sim):
+    con = sim.con
+    version = os.getenv("VERSION", "7.2.1")
+    lines = kernel_boot(sim, [
+        "Cisco IOS XR Software, Version %s" % version,
+        "Copyright (c) 2013-2020 by Cisco Systems, Inc.",
+        "Starting system manager",
+        "hwclock: settimeofday() failed: Not settable: Success",
+        "Starting calvados, the admin plane",
+        "Installing XR packages",
+        "ios con0/RP0/CPU0 is now available",
+    ], driver="virtio-pci")
+    await con.replay(lines, BOOT_TIME['xrv9k'])
+    cli = XrCli(sim, con, "RP/0/RP0/CPU0", "Mg0/RP0/CPU0/0", [])
+    require(sim, r"^username {username} secret {password}$", r"^ssh server v2$",
+            r"^interface MgmtEth 0/RP0/CPU0/0$", r"^ ipv4 address 10\.0\.0\.15/24$")
+
+    # the data plane comes up a while after the CLI
+    def interfaces_up():
+        cli.interfaces = ["Gi0/0/0/%d" % i for i in range(sim.args.data_nics)]
+    con.schedule(60, interfaces_up)
+    con.later(60, "RP/0/RP0/CPU0:Jan  1 00:07:02.114 : ifmgr[232]: %PKT_INFRA-LINK-3-UPDOWN : "
+              "Interface GigabitEthernet0/0/0/0, changed state to Down\n")
+    con.schedule(30, lambda: setattr(cli, "call_home", True))
+    await xr_admin_dialog(sim, cli)
+    while True:
+        await xr_login(sim, cli)
+        await cli.run()
+
+
+async def boot_csr(sim):
+    con = sim.con
+    version = os.getenv("VERSION", "16.12.05")
+    lines = kernel_boot(sim, [
+        "%IOSXEBOOT-4-BOOT_ACTIVITY_LONG_TIME: (rp/0): load_modules took: 2 seconds, expected max time 2 seconds",
+        "",
+        "              Restricted Rights Legend",
+        "",
+        "Cisco IOS Software [Gibraltar], Virtual XE Software (X86_64_LINUX_IOSD-UNIVERSALK9-M), Version %s" % version,
+        "Copyright (c) 1986-2020 by Cisco Systems, Inc.",
+        "",
+        "cisco CSR1000V (VXE) processor (revision VXE) with 2071993K/3075K bytes of memory.",
+        "%d Gigabit Ethernet interfaces" % (sim.args.data_nics + 1),
+    ], driver="virtio-pci")
+    await con.replay(lines, BOOT_TIME['csr'])
+    cli = IosCli(sim, con)
+    cli.load(["hostname Router", "interface GigabitEthernet1", "exit", "line vty 0 4", "exit"])
+    config = config_drive(sim, "iosxe_config.txt")
+    if config is not None:
+        cli.load(config)
+        await con.out("%%IOSXE-5-PLATFORM: Applied %d lines of configuration from the config drive\n" % len(config))
+    require(sim, r"^username {username} privilege 15 password {password}$", r"^interface GigabitEthernet1$",
+            r"^ ip address 10\.0\.0\.15 255\.255\.255\.0$", r"^ transport input all$")
+    while True:
+        await con.out("\n\nPress RETURN to get started!\n\n\n")
+        await con.readline(echo=False)
+        await cli.run()
+
+
+async def boot_nxos9kv(sim):
+    con = sim.con
+    lines = kernel_boot(sim, [
+        "Loader Version 8.36",
+        "Booting nxos image: bootflash:/nxos.9.3.7.bin",
+        "Image verification OK",
+        "INIT: version 2.88 booting",
+        "Starting Cisco NX-OSv9k",
+        "Checking all filesystems.",
+        "System is coming up ... Please wait ...",
+        "Starting Power On Auto Provisioning...",
+    ])
+    await con.replay(lines, BOOT_TIME['nxos9kv'])
+    cli = NxosCli(sim, con)
+    config = config_drive(sim, "nxos_config.txt")
+    if config is not None:
+        cli.load(config)
+        await con.out("Done\nAbort Power On Auto Provisioning and continue with normal setup\n")
+    require(sim, r"^username {username} password (0 )?{password} role network-admin$", r"^interface mgmt0$",
+            r"^\s+ip address 10\.0\.0\.15/24$", r"^feature netconf$")
+    if "admin" not in cli.passwords():
+        while True:
+            password = await con.ask('\n         ---- System Admin Account Setup ----\n\n\n'
+                                     'Enter the password for "admin": ', echo=False)
+            again = await con.ask('Confirm the password for "admin": ', echo=False)
+            if password == again:
+                break
+        cli.running["username admin password 0 %s role network-admin" % password] = {}
+    while True:
+        await con.out("\nUser Access Verification\n")
+        await con.login("%s login: " % cli.hostname, cli.passwords(), banner=(
+            "\nCisco NX-OS Software\nCopyright (c) 2002-2020, Cisco Systems, Inc. All rights reserved.\n"
+            "Nexus 9000v software (\"Nexus 9000v Software\") and related documentation,\n"
+            "files or other reference materials (\"Documentation\") are\n"
+            "the proprietary property and confidential information of Cisco\nSystems, Inc.\n"))
+        await cli.run()
+
+
+async def boot_veos(sim):
+    con = sim.con
+    await con.replay(sim.transcript("veos", until="localhost login:"), BOOT_TIME['veos'])
+    cli = EosCli(sim, con)
+    require(sim, r"^username {username} secret 0 {password} role network-admin$",
+            r"^interface Management ?1$", r"^ ip address 10\.0\.0\.15/24$", r"^management api http-commands$")
+    sim.report.saved = False
+    while True:
+        # admin has no password on a fresh vEOS
+        await con.login("localhost login: ", {'admin': ""}, password_prompt=None)
+        await cli.run()
+
+
+async def boot_vrp(sim):
+    con = sim.con
+    lines = kernel_boot(sim, [
+        "Huawei Versatile Routing Platform Software",
+        "VRP (R) software, Version 8.180 (NE40E V800R011C00SPC607B607)",
+        "Copyright (C) 2012-2018 Huawei Technologies Co., Ltd.",
+        "Starting the system, please wait ...",
+    ], driver="virtio-pci")
+    await con.replay(lines, BOOT_TIME['vrp'])
+    await con.login("localhost login: ", {'root': "Huawei@123"})
+    while True:
+        password = await con.ask("The password needs to be changed. Change now? [Y/N]: Y\n"
+                                 "Please configure the login password (8-16)\nEnter Password:", echo=False)
+        again = await con.ask("Confirm Password:", echo=False)
+        if password == again:
+            break
+        await con.out("Error: The two passwords are different.\n")
+    cli = VrpCli(sim, con)
+    require(sim, r"^ local-user {username} password irreversible-cipher {password}$",
+            r"^ local-user {username} service-type ssh$", r"^ local-user {username} user-group manage-ug$",
+            r"^interface GigabitEthernet ?0/0/0$", r"^ ip address 10\.0\.0\.15 24$")
+
+    def interfaces_up():
+        for i in range(sim.args.data_nics + 1):
+            cli.running.setdefault("interface GigabitEthernet4/0/%d" % i, {"undo shutdown": {}})
+    con.schedule(60, interfaces_up)
+    con.schedule(90, lambda: setattr(cli, "busy", False))
+    while True:
+        await cli.run()
+        await con.readline(echo=False)
+
+
+async def boot_vsr1000(sim):
+    con = sim.con
+    lines = kernel_boot(sim, [
+        "Press Ctrl+B to access EXTENDED-BOOTWARE MENU...",
+        "Loading the main image files...",
+        "Image file flash:/vsr1000-cmw710-system.bin is self-decompressing...",
+        "System image is starting...",
+        "Line aux0 is available.",
+        "",
+        "Press ENTER to get started.",
+        "Startup configuration file does not exist.",
+        "Automatic configuration attempt: 1.",
+    ])
+    await con.replay(lines, BOOT_TIME['vsr1000'])
+    sim.report.mark_ready()
+    await con.out("Performing automatic configuration... Press CTRL_C or CTRL_D to break.\n")
+    # the launcher breaks it and opens aux0 with the keyboard of the VM
+    screen = ComwareCli(sim, sim.screen)
+    line = ""
+    while "\x04" not in line and "\x03" not in line:
+        line = await sim.screen.readline()
+    await con.out("\nAutomatic configuration is aborted.\n")
+    asyncio.ensure_future(screen.run())
+    cli = ComwareCli(sim, con, screen.running)
+    require(sim, r"^local-user {username}$", r"^ password simple {password}$", r"^ service-type ssh$",
+            r"^ authorization-attribute user-role network-admin$", r"^interface GigabitEthernet\d+/0$",
+            r"^ ip address 10\.0\.0\.15 255\.255\.255\.0$", r"^ssh server enable$")
+    await screen.aux_open.wait()
+    while True:
+        await con.out("\nLine aux0 is available.\n\n\nPress ENTER to get started.\n")
+        await con.readline(echo=False)
+        await cli.run()
+
+
+async def boot_routeros(sim):
+    con = sim.con
+    lines = kernel_boot(sim, ["", "MikroTik 6.48.6 (long-term)", ""])
+    await con.replay(lines, BOOT_TIME['routeros'])
+    cli = RouterOsCli(sim, con)
+    require(sim, r'^/user add name={username} password="{password}" group=full$',
+            r"^/ip address add interface=ether1 address=10\.0\.0\.15 netmask=255\.255\.255\.0$")
+    while True:
+        # +ct asks for the plain console, without colours and terminal
+        # detection
+        await con.login("MikroTik Login: ", {'admin': ""}, strip=r"\+\w+$", failure="Login failed, incorrect username or password\n\n")
+        answer = await con.ask("\n\n  MMM      MMM       KKK                          TTTTTTTTTTT      KKK\n"
+                               "  MikroTik RouterOS 6.48.6 (c) 1999-2021       http://www.mikrotik.com/\n\n"
+                               "Do you want to see the software license? [Y/n]: ")
+        if answer.strip().lower() != "n":
+            await con.out("\nRouterOS is released under the MikroTik Software License\n\n")
+        await cli.run()
+
+
+async def boot_openwrt(sim):
+    con = sim.con
+    lines = kernel_boot(sim, [
+        "[    3.420190] init: Console is alive",
+        "[    3.912775] init: - preinit -",
+        "[    5.101134] procd: - init -",
+    ])
+    await con.replay(lines, BOOT_TIME['openwrt'])
+    await con.out("Please press Enter to activate this console.\n")
+    await con.out("[    6.418001] br-lan: port 1(eth0) entered blocking state\n"
+                  "[    6.418223] br-lan: port 1(eth0) entered disabled state\n"
+                  "[    6.420117] device eth0 entered promiscuous mode\n"
+                  "[    6.441908] br-lan: port 1(eth0) entered forwarding state\n")
+    await con.readline(echo=False)
+    cli = AshShell(sim, con)
+    require(sim, r"^br-lan 10\.0\.0\.15 netmask 255\.255\.255\.0$", r"^/etc/passwd:{username}:x:501:501:",
+            r"^/etc/group:root:x:0:{username}$", r"^/etc/shadow:{username}:{password}$",
+            r"^/etc/shadow:root:{password}$", r"^dir /home/{username} {username}$")
+    while True:
+        await con.out("\n\nBusyBox v1.28.4 () built-in shell (ash)\n\n"
+                      " OpenWrt 18.06.2, r7676-cddd7b4c77\n -----------------------------------------------------\n")
+        await cli.run()
+        await con.out("Please press Enter to activate this console.\n")
+        await con.readline(echo=False)
+
+
+async def boot_vmx_vcp(sim):
+    con = sim.con
+    version = os.getenv("VERSION", "18.2R1.9")
+    lines = kernel_boot(sim, [
+        "Consoles: serial port",
+        "FreeBSD/x86 bootstrap loader, Revision 1.1",
+        "Booting [/packages/sets/active/boot/os-kernel/kernel]...",
+        "Copyright (c) 1996-2018, Juniper Networks, Inc.",
+        "JUNOS %s Kernel 64-bit  JNPR-11.0-20180614.6c3f819_buil" % version,
+        "Mounting junos-platform",
+        "Starting cron.",
+        "",
+        "Amnesiac (ttyu0)",
+        "",
+    ])
+    await con.replay(lines, BOOT_TIME['vcp'])
+    sim.mounted = False
+    shell = VcpShell(sim, con, {"version %s;" % version: {}})
+    require(sim, r"^## Last commit: .* by root$")
+    while True:
+        await con.login("login: ", {'root': "VR-netlab9"},
+                        banner="\n--- JUNOS %s Kernel 64-bit  JNPR-11.0-20180614.6c3f819_buil\n" % version)
+        await shell.run()
+
+
+async def boot_vmx_vfpc(sim):
+    con = sim.con
+    lines = kernel_boot(sim, [
+        "Wind River Linux 6.0.0.13 qemux86-64",
+        "Starting riot",
+        "Starting the forwarding engine",
+    ], driver="virtio-pci")
+    await con.replay(lines, BOOT_TIME['vfpc'])
+    sim.report.mark_ready()
+    while True:
+        await con.out("\nqemux86-64 login: ")
+        await con.readline()
+
+
+async def boot_sros(sim):
+    con = sim.con
+    await con.replay(sim.transcript("sros", until=" Login:"), BOOT_TIME['sros'])
+    cli = SrosCli(sim, con)
+    require(sim, r'^configure system security user "{username}" password {password}$',
+            r'^configure system security user "{username}" access console netconf grpc$',
+            r"^configure system netconf no shutdown$")
+    if "card=cfm-xp-b" in sim.args.smbios:
+        require(sim, r"^configure card 1 card-type iom-xp-b$")
+    else:
+        require(sim, r"^configure card 1 card-type xcm-x20$", r"^configure sfm 16 sfm-type sfm-x20-b$")
+    sim.report.saved = False
+    while True:
+        await con.out("\n")
+        await con.login(" Login: ", {'admin': "admin"}, password_prompt=" Password: ",
+                        failure="Login incorrect\n\n")
+        await cli.run()
+
+
+async def boot_sros_lc(sim):
+    con = sim.con
+    await con.replay(kernel_boot(sim, ["TiMOS-C-20.10.R1 iom/i386 Nokia 7750 SR", "Waiting for the CPM"]),
+                     BOOT_TIME['sros-lc'])
+    # line cards have nothing to configure
+    sim.report.mark_ready()
+    await asyncio.Event().wait()
+
+
+def vmx(sim):
+    if any("vfpc" in disk for disk in sim.args.disks):
+        return "vfpc", lambda: boot_vmx_vfpc(sim)
+    return "vcp", lambda: boot_vmx_vcp(sim)
+
+
+def sros(sim):
+    if "slot=A" not in sim.args.smbios:
+        return "lc", lambda: boot_sros_lc(sim)
+    if "card=cfm-xp-b" in sim.args.smbios:
+        return "integrated", lambda: boot_sros(sim)
+    return "cp", lambda: boot_sros(sim)
+
+
+PLATFORMS = {
+    'xrv': lambda sim: ("vm", lambda: boot_xrv(sim)),
+    'xrv9k': lambda sim: ("vm", lambda: boot_xrv9k(sim)),
+    'vmx': vmx,
+    'sros': sros,
+    'csr': lambda sim: ("vm", lambda: boot_csr(sim)),
+    'nxos9kv': lambda sim: ("vm", lambda: boot_nxos9kv(sim)),
+    'veos': lambda sim: ("vm", lambda: boot_veos(sim)),
+    'vrp': lambda sim: ("vm", lambda: boot_vrp(sim)),
+    'vsr1000': lambda sim: ("vm", lambda: boot_vsr1000(sim)),
+    'routeros': lambda sim: ("vm", lambda: boot_routeros(sim)),
+    'openwrt': lambda sim: ("vm", lambda: boot_openwrt(sim)),
+}
+
+
+def script(platform, sim):
+    """ (role, coroutine function) of the VM of platform sim plays
+    """
+    try:
+        return PLATFORMS[platform](sim)
+    except KeyError:
+        raise ValueError("Unknown platform %s, must be one of %s" % (platform, ", ".join(PLATFORMS))) from None
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+
+""" A fake qemu-system-x86_64 booting simulated virtual routers
+
+    The launch code of a platform, bootstrap_spin() with its wait_write()
+    and wait_config() calls, the spin limits and restarts, only ever runs
+    against the real thing: a licensed image of several GB, KVM and minutes
+    of waiting for every try. This pretends to be qemu instead. It takes the
+    command line the launcher built, opens the serial consoles, the human
+    monitor and QMP where qemu would, and plays the boot of the platform in
+    SIM_PLATFORM on the first serial console (see platforms.py): the boot
+    output, recorded (benchmark/transcripts/) or made up, followed by the
+    dialogues of the first boot and a small emulation of the CLI, good
+    enough for the bootstrap configuration.
+
+    Every command the launcher typed is recorded, and what it configured is
+    checked against what the platform has to end up with. The result goes
+    to a JSON report in SIM_REPORT_DIR when qemu is told to quit, see
+    bench.py for what it is used for.
+
+    SIM_SPEED scales all delays, 1 is about the time the real thing takes
+    on a decent server, 0.1 boots ten times as fast. Output is not throttled,
+    neither is it by qemu. Restoring saved state (-incoming) is not
+    simulated, qemu exits with an error instead.
+"""
+
+import asyncio
+import json
+import os
+import re
+import resource
+import signal
+import sys
+import time
+
+import platforms
+
+SPEED = float(os.getenv("SIM_SPEED", "1"))
+REPORT_DIR = os.getenv("SIM_REPORT_DIR", "/run/vr-sim")
+TRANSCRIPT_DIR = os.getenv("SIM_TRANSCRIPTS", os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                           "..", "benchmark", "transcripts"))
+
+# qemu options without a value, everything else takes one
+FLAGS = {"-enable-kvm", "-nographic", "-usb", "-no-user-config", "-nodefaults", "-no-reboot",
+         "-no-shutdown", "-S"}
+
+# telnet protocol bytes, see RFC 854
+IAC = 255
+SB = 250
+SE = 240
+WILL = 251
+# what qemu sends to a telnet client: WILL ECHO, WILL SUPPRESS-GO-AHEAD,
+# DONT LINEMODE
+TELNET_GREETING = bytes([IAC, WILL, 1, IAC, WILL, 3, IAC, 254, 34])
+
+QMP_GREETING = {'QMP': {'version': {'qemu': {'micro': 0, 'minor': 2, 'major': 5}, 'package': "vr-sim"},
+                        'capabilities': ["oob"]}}
+# QMP commands accepted without doing anything
+QMP_NOOPS = {"qmp_capabilities", "cont", "stop", "system_reset", "getfd", "closefd", "netdev_add",
+             "netdev_del", "device_add", "device_del", "migrate-set-capabilities", "balloon"}
+
+# keys of input-send-event and what they type, see QKeyCode in the qemu
+# QAPI schema
+QCODE_CHARS = {
+    'spc': " ", 'minus': "-", 'equal': "=", 'bracket_left': "[", 'bracket_right': "]",
+    'semicolon': ";", 'apostrophe': "'", 'grave_accent': "`", 'backslash': "\\", 'comma': ",",
+    'dot': ".", 'slash': "/", 'ret': "\n", 'kp_enter': "\n", 'tab': "\t",
+}
+SHIFTED_CHARS = dict(zip("`1234567890-=[];'\\,./", '~!@#$%^&*()_+{}:"|<>?'))
+MODIFIERS = {"shift", "shift_r", "ctrl", "ctrl_r", "alt", "alt_r"}
+
+
+def parse_opts(value, implied=None):
+    """ The key=value pairs of a qemu option value as a dict, a first part
+        without a key is stored as implied
+    """
+    res = {}
+    for i, part in enumerate(value.split(",")):
+        if "=" in part:
+            key, val = part.split("=", 1)
+            res[key] = val
+        elif i == 0 and implied:
+            res[implied] = part
+        else:
+            res[part] = "on"
+    return res
+
+
+class QemuArgs:
+    """ The parts of a qemu command line we care about
+    """
+    def __init__(self, argv):
+        self.options = []
+        i = 0
+        while i < len(argv):
+            name = argv[i]
+            if name in FLAGS or i + 1 >= len(argv):
+                self.options.append((name, None))
+                i += 1
+            else:
+                self.options.append((name, argv[i + 1]))
+                i += 2
+        chardevs = {}
+        for value in self.values("-chardev"):
+            opts = parse_opts(value, "backend")
+            chardevs[opts.get('id')] = opts
+
+        # (port, log file) of every serial port, in order
+        self.serials = []
+        for value in self.values("-serial"):
+            if value.startswith("telnet:"):
+                self.serials.append((int(value.split(",")[0].rsplit(":", 1)[1]), None))
+            elif value.startswith("chardev:"):
+                opts = chardevs[value.split(":", 1)[1]]
+                self.serials.append((int(opts['port']), opts.get('logfile')))
+        self.monitor_port = None
+        for value in self.values("-monitor"):
+            if value.startswith("tcp:"):
+                self.monitor_port = int(value.split(",")[0].rsplit(":", 1)[1])
+        self.qmp_path = None
+        for value in self.values("-qmp"):
+            if value.startswith("unix:"):
+                self.qmp_path = value.split(",")[0][len("unix:"):]
+
+        self.disks = []
+        self.cdroms = list(self.values("-cdrom"))
+        for value in self.values("-drive"):
+            opts = parse_opts(value)
+            if "file" not in opts:
+                continue
+            if opts.get('media') == "cdrom":
+                self.cdroms.append(opts['file'])
+            else:
+                self.disks.append(opts['file'])
+        self.smbios = " ".join(self.values("-smbios"))
+        self.tftp_dir = None
+        self.data_nics = 0
+        for value in self.values("-netdev"):
+            opts = parse_opts(value, "type")
+            if opts['type'] == "user" and "tftp" in opts:
+                self.tftp_dir = opts['tftp']
+            if opts['type'] == "socket" and re.match(r"p\d+$", opts.get('id', "")) and opts['id'] != "p00":
+                self.data_nics += 1
+        self.incoming = self.value("-incoming")
+
+    def values(self, name):
+        return [value for opt, value in self.options if opt == name]
+
+    def value(self, name, default=None):
+        values = self.values(name)
+        return values[-1] if values else default
+
+    @property
+    def num(self):
+        """ The number of the VM the launcher gave us, from the console port
+        """
+        return self.serials[0][0] - 5000 if self.serials else 0
+
+
+class SerialPort:
+    """ A serial port behind a telnet server, like -serial telnet:...,server
+
+        Like qemu it serves one client at a time, other clients wait until
+        it disconnects, and output is lost while no client is connected. It
+        is always written to the log file of the chardev though.
+    """
+    def __init__(self, port, logfile=None):
+        self.port = port
+        self.logfile = logfile
+        self.log_fd = None
+        self.writer = None
+        self.lock = None
+        self.input = bytearray()
+        self.input_ready = None
+        self.connected = None
+        self.connections = 0
+        self.telnet_cmd = b""
+        self.last_cr = False
+
+    async def start(self):
+        self.lock = asyncio.Lock()
+        self.input_ready = asyncio.Event()
+        self.connected = asyncio.Event()
+        if self.logfile:
+            try:
+                self.log_fd = os.open(self.logfile, os.O_WRONLY | os.O_NONBLOCK | os.O_APPEND | os.O_CREAT, 0o600)
+            except OSError as exc:
+                print("vr-sim: unable to open console log %s: %s" % (self.logfile, exc), file=sys.stderr)
+        await asyncio.start_server(self.serve, "0.0.0.0", self.port)
+
+    async def serve(self, reader, writer):
+        async with self.lock:
+            self.writer = writer
+            self.connections += 1
+            writer.write(TELNET_GREETING)
+            self.connected.set()
+            try:
+                while True:
+                    data = await reader.read(4096)
+                    if not data:
+                        break
+                    self.receive(data)
+            except ConnectionError:
+                pass
+            finally:
+                self.writer = None
+                self.connected.clear()
+                writer.close()
+
+    def receive(self, data):
+        """ Strip telnet commands and turn line endings into a single \\r
+        """
+        for b in data:
+            if self.telnet_cmd:
+                self.telnet_cmd += bytes([b])
+                cmd = self.telnet_cmd
+                if cmd == bytes([IAC, IAC]):
+                    self.telnet_cmd = b""
+                    self.input.append(IAC)
+                elif cmd[1] == SB:
+                    if cmd.endswith(bytes([IAC, SE])):
+                        self.telnet_cmd = b""
+                elif cmd[1] >= WILL and len(cmd) < 3:
+                    continue
+                else:
+                    self.telnet_cmd = b""
+                continue
+            if b == IAC:
+                self.telnet_cmd = bytes([b])
+                continue
+            if self.last_cr and b in (0, 10):
+                self.last_cr = False
+                continue
+            self.last_cr = b == 13
+            self.input.append(13 if b == 10 else b)
+        self.input_ready.set()
+
+    def write(self, data):
+        if self.log_fd is not None:
+            try:
+                os.write(self.log_fd, data)
+            except (BlockingIOError, BrokenPipeError):
+                pass
+        if self.writer is not None:
+            try:
+                self.writer.write(data)
+            except ConnectionError:
+                pass
+
+
+class Console:
+    """ The terminal the boot scripts and CLIs talk to on a serial port
+    """
+    def __init__(self, sim, port):
+        self.sim = sim
+        self.port = port
+        # the CLI mode commands are recorded with
+        self.mode = "boot"
+
+    async def out(self, text):
+        self.port.write(text.replace("\n", "\r\n").encode())
+        # let the event loop send it before we carry on
+        await asyncio.sleep(0)
+
+    def later(self, seconds, text):
+        """ Print text after seconds, like a log message of the NOS
+        """
+        async def message():
+            await self.sleep(seconds)
+            await self.out(text)
+        asyncio.ensure_future(message())
+
+    def schedule(self, seconds, func):
+        """ Call func after seconds, for things the NOS does in the
+            background, like bringing up interfaces
+        """
+        asyncio.get_event_loop().call_later(seconds * SPEED, func)
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds * SPEED)
+
+    def discard_input(self):
+        self.port.input.clear()
+
+    async def readline(self, echo=True):
+        """ The next line of input, echoed back unless echo is False
+        """
+        while True:
+            i = self.port.input.find(b"\r")
+            if i != -1:
+                line = self.port.input[:i].decode(errors="replace")
+                del self.port.input[:i + 1]
+                await self.out((line if echo else "") + "\n")
+                return line
+            self.port.input_ready.clear()
+            await self.port.input_ready.wait()
+
+    async def ask(self, prompt, echo=True):
+        await self.out(prompt)
+        return await self.readline(echo)
+
+    async def replay(self, lines, seconds):
+        """ Print lines spread over seconds, the boot of the NOS
+        """
+        delay = seconds / max(len(lines), 1)
+        for line in lines:
+            await self.out(line + "\n")
+            await self.sleep(delay)
+        # the NOS does not read the console while booting
+        self.discard_input()
+
+    async def login(self, prompt, accounts, password_prompt="Password: ", banner="", failure="Login incorrect\n",
+                    strip=None):
+        """ Ask for username and password until they are one of accounts, a
+            dict of username to password, returns the username
+        """
+        while True:
+            self.mode = "login"
+            username = await self.ask(prompt)
+            if not username.strip():
+                continue
+            if strip:
+                username = re.sub(strip, "", username)
+            # None for accounts without a password
+            password = await self.ask(password_prompt, echo=False) if password_prompt is not None else ""
+            self.sim.report.command("login", "%s %s" % (username, password))
+            if accounts.get(username) == password:
+                await self.out(banner)
+                return username
+            await self.out(failure)
+
+
+class Keyboard:
+    """ Text typed on the keyboard of the VM through QMP input-send-event
+    """
+    def __init__(self):
+        self.text = ""
+        self.typed = None
+        self.held = set()
+
+    def event(self, event):
+        if event.get('type') != "key":
+            return
+        key = event['data']['key']['data']
+        if not event['data']['down']:
+            self.held.discard(key)
+            return
+        if key in MODIFIERS:
+            self.held.add(key)
+            return
+        shift = bool(self.held & {"shift", "shift_r"})
+        if self.held & {"ctrl", "ctrl_r"}:
+            c = chr(ord(key[0].lower()) - ord("a") + 1) if len(key) == 1 else ""
+        elif len(key) == 1:
+            c = SHIFTED_CHARS.get(key, key.upper()) if shift else key
+        else:
+            c = QCODE_CHARS.get(key, "")
+            if shift:
+                c = SHIFTED_CHARS.get(c, c)
+        self.text += c
+        self.typed.set()
+
+    async def readline(self):
+        """ The next line typed, with the control characters in it
+        """
+        while "\n" not in self.text:
+            self.typed.clear()
+            await self.typed.wait()
+        line, self.text = self.text.split("\n", 1)
+        return line
+
+
+class KeyboardConsole:
+    """ The keyboard and screen of the VM as a Console, for CLIs the
+        launcher types on through QMP. What is shown on the screen is not
+        simulated.
+    """
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+        self.mode = "keyboard"
+
+    async def out(self, text):
+        pass
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds * SPEED)
+
+    async def readline(self, echo=True):
+        return await self.keyboard.readline()
+
+    async def ask(self, prompt, echo=True):
+        return await self.readline(echo)
+
+
+class Report:
+    """ What the launcher did to the simulated VM, checked against what it
+        has to configure
+    """
+    def __init__(self, platform, role, args):
+        self.platform = platform
+        self.role = role
+        self.num = args.num
+        self.started = time.time()
+        self.ready = None
+        self.commands = []
+        self.rejected = []
+        # required: regexes of lines the configuration of the VM must have
+        # in the end, config: function returning the configuration
+        self.required = []
+        self.config = lambda: []
+        # whether the configuration was saved, None if the launcher does not
+        # have to
+        self.saved = None
+
+    def command(self, mode, line):
+        self.commands.append([round(time.time() - self.started, 3), mode, line])
+
+    def reject(self, mode, line, error):
+        self.rejected.append([mode, line, error])
+
+    def mark_ready(self):
+        """ The VM booted up to where the launcher has to take over
+        """
+        if self.ready is None:
+            self.ready = time.time()
+
+    def as_dict(self):
+        config = self.config()
+        text = "\n".join(config)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            'platform': self.platform,
+            'role': self.role,
+            'num': self.num,
+            'pid': os.getpid(),
+            'started': self.started,
+            'ready': self.ready,
+            'commands': self.commands,
+            'rejected': self.rejected,
+            'config': config,
+            'missing': [regex for regex in self.required if not re.search(regex, text, re.M)],
+            'saved': self.saved,
+            'cpu': round(usage.ru_utime + usage.ru_stime, 3),
+        }
+
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "%s-%s-%d.json" % (self.platform, self.role, os.getpid()))
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+class Sim:
+    """ One simulated VM, the role decides what it plays (see platforms.py)
+    """
+    def __init__(self, platform, args):
+        self.platform = platform
+        self.args = args
+        self.serials = [SerialPort(port, logfile) for port, logfile in args.serials]
+        self.con = Console(self, self.serials[0]) if self.serials else None
+        self.keyboard = Keyboard()
+        self.screen = KeyboardConsole(self.keyboard)
+        # the credentials the launcher was given, see its --username and
+        # --password
+        self.username = os.getenv("USERNAME", "vrnetlab")
+        self.password = os.getenv("PASSWORD", "VR-netlab9")
+        self.role, self.script = platforms.script(platform, self)
+        self.report = Report(platform, self.role, args)
+        self.started = time.monotonic()
+        self.stopping = None
+
+    def transcript(self, name, until=None):
+        """ Lines of the recorded boot transcript name, up to the first one
+            containing until
+        """
+        res = []
+        with open(os.path.join(TRANSCRIPT_DIR, "%s.log" % name), errors="replace") as f:
+            for line in f.read().splitlines():
+                if until is not None and until in line:
+                    break
+                res.append(line)
+        return res
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.stopping = asyncio.Event()
+        self.keyboard.typed = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.terminate, sig)
+        for serial in self.serials:
+            await serial.start()
+        if self.args.monitor_port is not None:
+            await asyncio.start_server(self.serve_monitor, "0.0.0.0", self.args.monitor_port)
+        if self.args.qmp_path:
+            if os.path.exists(self.args.qmp_path):
+                os.remove(self.args.qmp_path)
+            await asyncio.start_unix_server(self.serve_qmp, self.args.qmp_path)
+        task = asyncio.ensure_future(self.script())
+        stop = asyncio.ensure_future(self.stopping.wait())
+        await asyncio.wait([task, stop], return_when=asyncio.FIRST_COMPLETED)
+        if task.done() and task.exception() is not None:
+            raise task.exception()
+        if not stop.done():
+            # the guest shut down by itself, qemu stays like -no-shutdown
+            await self.stopping.wait()
+        task.cancel()
+
+    def terminate(self, sig):
+        print("qemu-system-x86_64: terminating on signal %d" % sig, file=sys.stderr, flush=True)
+        self.stopping.set()
+
+    async def serve_monitor(self, reader, writer):
+        writer.write(b"QEMU 5.2.0 monitor - type 'help' for more information\r\n(qemu) ")
+        while await reader.readline():
+            writer.write(b"\r\n(qemu) ")
+        writer.close()
+
+    async def serve_qmp(self, reader, writer):
+        writer.write(json.dumps(QMP_GREETING).encode() + b"\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            reply = self.qmp_command(msg.get('execute'), msg.get('arguments') or {})
+            if 'id' in msg:
+                reply['id'] = msg['id']
+            writer.write(json.dumps(reply).encode() + b"\r\n")
+            if msg.get('execute') == "quit":
+                self.stopping.set()
+        writer.close()
+
+    def qmp_command(self, name, args):
+        if name in QMP_NOOPS or name == "quit":
+            return {'return': {}}
+        if name == "query-status":
+            return {'return': {'status': "running", 'running': True, 'singlestep': False}}
+        if name == "query-cpus-fast":
+            return {'return': [{'cpu-index': 0, 'thread-id': os.getpid(), 'target': "x86_64"}]}
+        if name == "human-monitor-command":
+            return {'return': ""}
+        if name == "input-send-event":
+            for event in args.get('events', []):
+                self.keyboard.event(event)
+            return {'return': {}}
+        if name == "query-balloon":
+            return {'error': {'class': "DeviceNotActive", 'desc': "No balloon device has been activated"}}
+        return {'error': {'class': "CommandNotFound", 'desc': "The command %s has not been found" % name}}
+
+
+def main():
+    args = QemuArgs(sys.argv[1:])
+    if "-version" in sys.argv[1:] or "--version" in sys.argv[1:]:
+        print("QEMU emulator version 5.2.0 (vr-sim)")
+        return 0
+    if args.incoming is not None:
+        print("qemu-system-x86_64: -incoming %s: restoring saved state is not simulated" % args.incoming,
+              file=sys.stderr)
+        return 1
+    for path in args.disks + args.cdroms + args.values("-bios"):
+        if not os.path.exists(path):
+            print("qemu-system-x86_64: Could not open '%s': No such file or directory" % path, file=sys.stderr)
+            return 1
+    platform = os.getenv("SIM_PLATFORM")
+    if not platform:
+        print("qemu-system-x86_64: SIM_PLATFORM is not set, one of %s" % ", ".join(platforms.PLATFORMS),
+              file=sys.stderr)
+        return 1
+    sim = Sim(platform, args)
+    try:
+        asyncio.get_event_loop().run_until_complete(sim.run())
+    finally:
+        sim.report.write(REPORT_DIR)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,17 +7,14 @@ import signal
 import sys
 import time
 import os
+import qcow2
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -29,6 +26,8 @@ logging.Logger.trace = trace
 
 class simulator_VM(vrnetlab.VM):
     no_paging_command = 'screen-length 0 temporary'
+    # <HUAWEI> or [~HUAWEI-aaa], see VM.cli_prompt
+    cli_prompt = rb"[\r\n](<[^<>\r\n]+>|\[[^\[\]\r\n]+\])\Z"
 
     def __init__(self, username, password):
         disk_image = None
@@ -45,7 +44,7 @@ class simulator_VM(vrnetlab.VM):
         self.wait_time = 30
         self.nic_type = 'virtio-net-pci'
 
-        vrnetlab.run_command(["qemu-img", "create", "-f", "qcow2", "DataDisk.qcow2", self.disk_size])
+        qcow2.create("DataDisk.qcow2", self.disk_size)
 
         self.qemu_args.extend(["-smp", str(self.vcpu),
                                "-cpu", "host",
@@ -101,7 +100,7 @@ class simulator_VM(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -115,24 +114,27 @@ class simulator_VM(vrnetlab.VM):
         # Wait for GigabitEthernet4/0/X interfaces to appear in running config
         # NOTE: do not use 'display current-configuration interface GigabitEtherhet 4/0/X'
         # to check. The output differs from 'display current-configuration'!
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/1')
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/4')
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/14')
-        # The first response might be the log message like
+        # Filtering it with include is fine, and a lot less output than the
+        # whole configuration on every poll.
+        # The output might contain log messages like
         # 12/active/linkDown/Major/occurredTime:2019-11-11 23:49:03/-/-/alarmID:0x08520003/VS=Admin-VS-CID=0x807a0404:The interface status changes. (ifName=GigabitEthernet4/0/14, AdminStatus=UP, OperStatus=UP, Reason=Interface physical link is up, mainIfname=GigabitEthernet4/0/14
-        # So wait three more times to make sure we get the correct response
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/14')
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/14')
-        self.wait_config("display current-configuration", 'interface GigabitEthernet4/0/14')
+        # which used to be mistaken for the configuration. wait_config() only
+        # matches "interface ..." at the start of a line, as it is part of
+        # the command.
+        for intf in ("GigabitEthernet4/0/1", "GigabitEthernet4/0/4", "GigabitEthernet4/0/14"):
+            self.wait_config("display current-configuration | include ^interface %s" % intf,
+                             "interface %s" % intf)
         self.logger.info("applying bootstrap configuration")
         self.wait_write(cmd="", wait=None)
         self.wait_write(cmd="", wait=None)
 
         self.wait_write(cmd="system-view", wait=None)
-        self.wait_write(cmd="sysname HUAWEI", wait="]")
-        self.wait_write(cmd="ssh server key-exchange dh_group14_sha1", wait="]")
-        self.wait_write(cmd="interface GigabitEthernet 0/0/0", wait="]")
-        self.wait_write(cmd="ip address 10.0.0.15 24", wait="]")
+        self.send_config([
+            "sysname HUAWEI",
+            "ssh server key-exchange dh_group14_sha1",
+            "interface GigabitEthernet 0/0/0",
+            "ip address 10.0.0.15 24",
+        ], wait="]")
         self.wait_write(cmd="commit", wait="]")
 
         # when simulator booting, config is not ok
@@ -6,20 +6,15 @@ import os
 import re
 import signal
 import sys
-import telnetlib
 import time
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -55,10 +50,8 @@ class VSR_vm(vrnetlab.VM):
             if ridx == 0: # login
                 self.logger.debug("VM started")
 
-                self.wait_write("", wait="(qemu)", con=self.qm)
-
                 # To allow access to aux0 serial console
-                self.logger.debug("Writing to QEMU Monitor")
+                self.logger.debug("Typing on the keyboard through QEMU")
 
                 # Cred to @plajjan for this one
                 commands = """\x04
@@ -72,24 +65,12 @@ quit
 
 """
 
-                key_map = {
-                    '\x04': 'ctrl-d',
-                    ' ': 'spc',
-                    '-': 'minus',
-                    '\n': 'kp_enter'
-                }
-
-                qemu_commands = [ "sendkey {}".format(key_map.get(c) or c) for c in commands ]
-
-                for c in qemu_commands:
-                    self.wait_write(c, wait="(qemu)", con=self.qm)
-                    # Pace the characters sent via QEMU Monitor
-                    time.sleep(0.1)
+                self.send_keys(commands, key_map={'\x04': ["ctrl", "d"], '\n': "kp_enter"})
 
-                self.logger.debug("Done writing to QEMU Monitor")
+                self.logger.debug("Done typing")
                 self.logger.debug("Switching to line aux0")
 
-                self.tn = telnetlib.Telnet("127.0.0.1", 5000 + self.num)
+                self.tn = self.open_console(5000 + self.num)
 
                 # run main config!
                 self.bootstrap_config()
@@ -105,7 +86,7 @@ quit
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -7,20 +7,15 @@ import random
 import re
 import signal
 import sys
-import telnetlib
 import time
 
 import vrnetlab
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
 def handle_SIGTERM(signal, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, handle_SIGTERM)
 signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
 
 TRACE_LEVEL_NUM = 9
 logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
@@ -33,6 +28,8 @@ logging.Logger.trace = trace
 
 
 class XRV_vm(vrnetlab.VM):
+    default_console_engine = "asyncio"
+
     def __init__(self, username, password):
         disk_image = None
         for e in sorted(os.listdir("/")):
@@ -100,7 +97,7 @@ class XRV_vm(vrnetlab.VM):
         # no match, if we saw some output from the router it's probably
         # booting, so let's give it some more time
         if res != b'':
-            self.logger.trace("OUTPUT: %s" % res.decode())
+            self.logger.trace("OUTPUT: %s", vrnetlab.LazyDecode(res))
             # reset spins if we saw some output
             self.spins = 0
 
@@ -135,31 +132,35 @@ class XRV_vm(vrnetlab.VM):
         if self.username and self.password:
             self.wait_write("admin")
             self.wait_write("configure")
-            self.wait_write("username %s group root-system" % (self.username))
-            self.wait_write("username %s group cisco-support" % (self.username))
-            self.wait_write("username %s secret %s" % (self.username, self.password))
+            self.send_config([
+                "username %s group root-system" % (self.username),
+                "username %s group cisco-support" % (self.username),
+                "username %s secret %s" % (self.username, self.password),
+            ])
             self.wait_write("commit")
             self.wait_write("exit")
             self.wait_write("exit")
 
         self.wait_write("show interface description")
         self.wait_write("configure")
-        # configure netconf
-        self.wait_write("ssh server v2")
-        self.wait_write("ssh server netconf port 830") # for 5.1.1
-        self.wait_write("ssh server netconf vrf default") # for 5.3.3
-        self.wait_write("ssh server rate-limit 600")
-        self.wait_write("netconf agent ssh") # for 5.1.1
-        self.wait_write("netconf-yang agent ssh") # for 5.3.3
-
-        # configure xml agent
-        self.wait_write("xml agent tty")
-
-        # configure mgmt interface
-        self.wait_write("interface MgmtEth 0/0/CPU0/0")
-        self.wait_write("no shutdown")
-        self.wait_write("ipv4 address 10.0.0.15/24")
-        self.wait_write("exit")
+        # the netconf lines are for different releases, so some of them are
+        # rejected, don't fall back to line mode for that
+        self.send_config([
+            # configure netconf
+            "ssh server v2",
+            "ssh server netconf port 830", # for 5.1.1
+            "ssh server netconf vrf default", # for 5.3.3
+            "ssh server rate-limit 600",
+            "netconf agent ssh", # for 5.1.1
+            "netconf-yang agent ssh", # for 5.3.3
+            # configure xml agent
+            "xml agent tty",
+            # configure mgmt interface
+            "interface MgmtEth 0/0/CPU0/0",
+            "no shutdown",
+            "ipv4 address 10.0.0.15/24",
+            "exit",
+        ], errors=[])
         self.wait_write("commit")
         self.wait_write("exit")
 